@@ -2,6 +2,8 @@ from motor.motor_asyncio import AsyncIOMotorClient
 import os
 from dotenv import load_dotenv
 
+from config import Config
+
 load_dotenv()
 
 MONGODB_URL = os.getenv("MONGODB_URL")
@@ -32,16 +34,27 @@ async def create_indexes():
         await db.chat_sessions.create_index([("user_id", 1), ("document_id", 1)])
         await db.chat_sessions.create_index("last_active")
         
+        await db.chat_messages.create_index([("session_id", 1), ("bucket", -1)])
+        
         await db.documents.create_index("user_id")
         await db.documents.create_index([("user_id", 1), ("url", 1)], unique=True)
         await db.documents.create_index([("user_id", 1), ("created_at", -1)])
         
         await db.document_chunks.create_index([("document_id", 1), ("chunk_index", 1)])
         await db.document_chunks.create_index("user_id")
+        await db.document_chunks.create_index([("user_id", 1), ("simhash_bands", 1)])
         
         await db.bm25_tokens.create_index([("user_id", 1), ("document_id", 1)])
         await db.bm25_tokens.create_index([("user_id", 1), ("method", 1)])
         
+        await db.concept_chunks.create_index(
+            [("user_id", 1), ("document_id", 1), ("concept_key", 1)], unique=True
+        )
+        
+        await db.concept_edges.create_index([("user_id", 1), ("source_key", 1)])
+        await db.concept_edges.create_index([("user_id", 1), ("target_key", 1)])
+        await db.concept_edges.create_index([("user_id", 1), ("document_id", 1)])
+        
         await db.quiz_results.create_index("user_id")
         await db.document_quizzes.create_index([("user_id", 1), ("document_id", 1)])
         await db.document_quizzes.create_index([("user_id", 1), ("document_id", 1), ("topic_key", 1)])
@@ -51,7 +64,28 @@ async def create_indexes():
         
         await db.users.create_index("email")
         
-        await db.activity_logs.create_index([("user_id", 1), ("timestamp", -1)])
+        await db.llm_response_cache.create_index("created_at", expireAfterSeconds=Config.LLM_CACHE_TTL)
+        
+        await db.question_cache.create_index([("document_id", 1), ("terms", 1)])
+        await db.question_cache.create_index("created_at", expireAfterSeconds=Config.QUESTION_CACHE_TTL)
+        
+        await db.generation_leases.create_index("expires_at", expireAfterSeconds=0)
+        
+        await db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+        
+        await db.context_cache_handles.create_index([("user_id", 1), ("document_id", 1)])
+        await db.context_cache_handles.create_index("expires_at", expireAfterSeconds=0)
+        
+        await db.credit_ledger.create_index([("status", 1), ("expires_at", 1)])
+        await db.credit_ledger.create_index([("user_id", 1), ("created_at", -1)])
+        await db.credit_ledger.create_index(
+            "settled_at", expireAfterSeconds=Config.CREDIT_LEDGER_RETENTION_DAYS * 86400
+        )
+        
+        await db.user_activities.create_index([("user_id", 1), ("created_at", -1)])
+        await db.user_activities.create_index(
+            "created_at", expireAfterSeconds=Config.ACTIVITY_RETENTION_DAYS * 86400
+        )
         
         print("MongoDB indexes created successfully")
     except Exception as e:
@@ -1,16 +1,19 @@
 import firebase_admin
 from firebase_admin import credentials, auth
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import asyncio
+import hashlib
 import os
+import time
 from dotenv import load_dotenv
+from config import Config
 
 load_dotenv()
 
 try:
     firebase_admin.get_app()
 except ValueError:
-    from config import Config
     import json
     from pathlib import Path
 
@@ -43,19 +46,43 @@ except ValueError:
 security = HTTPBearer()
 
 from Database.database import get_db
+from Services.memory_cache import MemoryCache
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# Verified claims keyed by token hash, each kept until the token's own exp.
+# verify_id_token doesn't check revocation, so this doesn't loosen anything.
+_verified_tokens = MemoryCache(Config.AUTH_TOKEN_CACHE_SIZE)
+# uids whose users document was upserted recently in this process.
+_initialized_users = MemoryCache(Config.AUTH_TOKEN_CACHE_SIZE, Config.AUTH_USER_INIT_TTL)
+
+
+async def _verify_token(token: str) -> dict:
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    claims = _verified_tokens.get(key)
+    if claims is None:
+        claims = await asyncio.to_thread(auth.verify_id_token, token)
+        remaining = claims.get("exp", 0) - time.time()
+        if remaining > 0:
+            _verified_tokens.set(key, claims, remaining)
+    return dict(claims)
+
+
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     try:
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = await _verify_token(token)
         uid = decoded_token['uid']
-        email = decoded_token.get('email')
-        name = decoded_token.get('name')
-        picture = decoded_token.get('picture')
         
-        from Services.credit_service import CreditService
-        await CreditService.initialize_user(uid, email, name, picture)
+        if _initialized_users.get(uid) is None:
+            from Services.credit_service import CreditService
+            await CreditService.initialize_user(
+                uid,
+                decoded_token.get('email'),
+                decoded_token.get('name'),
+                decoded_token.get('picture')
+            )
+            _initialized_users.set(uid, True)
         
+        request.state.user = decoded_token
         return decoded_token
     except Exception as e:
         print(f"❌ Auth Error: {str(e)}")
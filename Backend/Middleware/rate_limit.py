@@ -1,38 +1,154 @@
-from fastapi import Request, HTTPException
-from pyrate_limiter import Duration, Rate, Limiter, InMemoryBucket, BucketFullException
-from typing import Callable
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
 
-quiz_rate = Rate(10, Duration.HOUR)
-quiz_limiter = Limiter(InMemoryBucket([quiz_rate]))
+from fastapi import Request, HTTPException, Depends
+from pymongo import ReturnDocument
 
-notes_rate = Rate(15, Duration.HOUR)
-notes_limiter = Limiter(InMemoryBucket([notes_rate]))
+from config import Config
+from Database.database import get_db
+from Middleware.auth import get_current_user
 
-chat_rate = Rate(50, Duration.HOUR)
-chat_limiter = Limiter(InMemoryBucket([chat_rate]))
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
 
-extract_rate = Rate(20, Duration.HOUR)
-extract_limiter = Limiter(InMemoryBucket([extract_rate]))
 
-def get_user_key(request: Request) -> str:
-    if hasattr(request.state, "user") and request.state.user:
-        return f"user:{request.state.user.get('uid')}"
-    return f"ip:{request.client.host if request.client else 'unknown'}"
+def parse_rate(spec: str) -> Tuple[int, int]:
+    """"50/hour" -> (50, 3600)."""
+    count, _, unit = spec.partition("/")
+    return int(count), PERIODS[unit.strip().lower().rstrip("s")]
 
-def create_dependency(limiter: Limiter, context_name: str) -> Callable:
-    async def dependency(request: Request):
-        key = get_user_key(request)
+
+class MemoryRateLimitBackend:
+    """Per-process sliding-window log. Only correct with a single worker;
+    meant for tests and local development."""
+
+    def __init__(self):
+        self._hits: Dict[str, deque] = {}
+
+    def _window(self, key: str, now: float, period: int) -> deque:
+        hits = self._hits.setdefault(key, deque())
+        while hits and hits[0] <= now - period:
+            hits.popleft()
+        return hits
+
+    async def hit(self, key: str, limit: int, period: int) -> Tuple[bool, List[float]]:
+        now = time.time()
+        hits = self._window(key, now, period)
+        allowed = len(hits) < limit
+        if allowed:
+            hits.append(now)
+        return allowed, list(hits)
+
+    async def peek(self, key: str, period: int) -> List[float]:
+        return list(self._window(key, time.time(), period))
+
+
+class MongoRateLimitBackend:
+    """Sliding-window log shared by all workers: one ``rate_limits`` document
+    per key holding the timestamps of the hits still inside the window. A
+    single pipeline update drops expired hits, checks the count and records
+    the new hit atomically."""
+
+    async def hit(self, key: str, limit: int, period: int) -> Tuple[bool, List[float]]:
+        now = time.time()
+        db = await get_db()
+        doc = await db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"hits": {"$filter": {
+                    "input": {"$ifNull": ["$hits", []]},
+                    "cond": {"$gt": ["$$this", now - period]}
+                }}}},
+                {"$set": {"allowed": {"$lt": [{"$size": "$hits"}, limit]}}},
+                {"$set": {
+                    "hits": {"$cond": ["$allowed", {"$concatArrays": ["$hits", [now]]}, "$hits"]},
+                    "expires_at": datetime.utcnow() + timedelta(seconds=period)
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return doc["allowed"], doc["hits"]
+
+    async def peek(self, key: str, period: int) -> List[float]:
+        db = await get_db()
+        doc = await db.rate_limits.find_one({"_id": key}, {"hits": 1})
+        cutoff = time.time() - period
+        return [t for t in (doc or {}).get("hits", []) if t > cutoff]
+
+
+_BACKENDS = {"memory": MemoryRateLimitBackend, "mongo": MongoRateLimitBackend}
+backend = _BACKENDS[Config.RATE_LIMIT_BACKEND]()
+
+
+class RateLimiter:
+    def __init__(self, name: str, spec: str, label: str):
+        self.name = name
+        self.label = label
+        self.limit, self.period = parse_rate(spec)
+
+    def _key(self, uid: str) -> str:
+        return f"{self.name}:{uid}"
+
+    def _quota(self, hits: List[float]) -> Dict:
+        remaining = max(0, self.limit - len(hits))
+        # Seconds until the oldest hit leaves the window and frees a slot.
+        reset = max(0, int(hits[0] + self.period - time.time()) + 1) if hits else 0
+        return {"limit": self.limit, "remaining": remaining, "reset": reset, "window": self.period}
+
+    async def acquire(self, uid: str) -> Tuple[bool, Dict]:
         try:
-            limiter.try_acquire(key)
-        except BucketFullException as err:
+            allowed, hits = await backend.hit(self._key(uid), self.limit, self.period)
+        except Exception as e:
+            # Don't take the API down with the limiter's store.
+            print(f"⚠️ Rate limiter unavailable for {self.name}: {e}")
+            return True, {"limit": self.limit, "remaining": self.limit, "reset": 0, "window": self.period}
+        return allowed, self._quota(hits)
+
+    async def status(self, uid: str) -> Dict:
+        return self._quota(await backend.peek(self._key(uid), self.period))
+
+
+def quota_headers(quota: Dict) -> Dict[str, str]:
+    return {
+        "X-RateLimit-Limit": str(quota["limit"]),
+        "X-RateLimit-Remaining": str(quota["remaining"]),
+        "X-RateLimit-Reset": str(quota["reset"]),
+    }
+
+
+async def rate_limit_headers(request: Request, call_next):
+    """Copy the quota recorded by a limiter dependency onto the response,
+    whatever kind of response the endpoint returned."""
+    response = await call_next(request)
+    quota = getattr(request.state, "rate_limit", None)
+    if quota:
+        response.headers.update(quota_headers(quota))
+    return response
+
+
+def create_dependency(limiter: RateLimiter) -> Callable:
+    async def dependency(request: Request, current_user: dict = Depends(get_current_user)):
+        allowed, quota = await limiter.acquire(current_user["uid"])
+        request.state.rate_limit = quota
+        if not allowed:
             raise HTTPException(
                 status_code=429,
-                detail=f"Rate limit exceeded for {context_name}. Please try again later."
+                detail=f"Rate limit exceeded for {limiter.label}. Please try again later.",
+                headers={**quota_headers(quota), "Retry-After": str(quota["reset"])}
             )
     return dependency
 
-limit_quiz = create_dependency(quiz_limiter, "Quiz Generation")
-limit_notes = create_dependency(notes_limiter, "Note Generation")
-limit_chat = create_dependency(chat_limiter, "Chat")
-limit_extract = create_dependency(extract_limiter, "URL Extraction")
 
+LIMITERS = {
+    "quiz": RateLimiter("quiz", Config.RATE_LIMIT_QUIZ, "Quiz Generation"),
+    "notes": RateLimiter("notes", Config.RATE_LIMIT_NOTES, "Note Generation"),
+    "chat": RateLimiter("chat", Config.RATE_LIMIT_CHAT, "Chat"),
+    "extraction": RateLimiter("extraction", Config.RATE_LIMIT_EXTRACT, "URL Extraction"),
+}
+
+limit_quiz = create_dependency(LIMITERS["quiz"])
+limit_notes = create_dependency(LIMITERS["notes"])
+limit_chat = create_dependency(LIMITERS["chat"])
+limit_extract = create_dependency(LIMITERS["extraction"])
@@ -1,7 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from Middleware.auth import get_current_user
 from Services.credit_service import CreditService
-from Database.database import get_db
 
 router = APIRouter()
 
@@ -11,17 +10,6 @@ async def get_user_profile(current_user: dict = Depends(get_current_user)):
     if not stats:
         raise HTTPException(status_code=404, detail="User stats not found")
     
-    from Services.activity_service import ActivityService
-    recent_activity = await ActivityService.get_recent_activity(current_user['uid'], limit=5)
-    
-    db = await get_db()
-    pipeline = [
-        {"$match": {"user_id": current_user['uid']}},
-        {"$group": {"_id": None, "average": {"$avg": "$percentage"}}}
-    ]
-    avg_result = await db.quiz_results.aggregate(pipeline).to_list(length=1)
-    quiz_average = round(avg_result[0]['average']) if avg_result else 0
-    
     return {
         "uid": current_user['uid'],
         "email": current_user.get('email'),
@@ -31,6 +19,6 @@ async def get_user_profile(current_user: dict = Depends(get_current_user)):
         "plan": stats.get("plan", "free"),
         "usage": stats.get("total_usage", {}),
         "days_until_reset": stats.get("days_until_reset", 30),
-        "recent_activity": recent_activity,
-        "quiz_average": quiz_average
+        "recent_activity": stats.get("recent_activity", []),
+        "quiz_average": stats.get("quiz_average", 0)
     }
@@ -1,16 +1,80 @@
+import asyncio
+from typing import Dict, Optional
 from fastapi import APIRouter, HTTPException, Depends
-from Services.gemini_client import ask_question_about_text
-from Services.persistent_vector_store import PersistentVectorStore
-from Services.conversational_memory import ChatSessionService
+from fastapi.responses import StreamingResponse
+import anyio
+from Services.gemini_client import ask_question_about_text, stream_question_about_text, QA_ERROR_PREFIX
+from Services.persistent_vector_store import PersistentVectorStore, weighted_query
+from Services.conversational_memory import ChatSessionService, ChatTurn
 from Middleware.auth import get_current_user
 from Middleware.rate_limit import limit_chat
 from Services.chat_utils import get_general_response
 from Services.credit_service import CreditService
+from Services.question_cache import QuestionCacheService
 from models.requests import ChatRequest
+from config import Config
+from Services.sse import format_sse, SSE_HEADERS
+from Services.context_packer import pack_context
+from Services.context_cache import ContextCacheService
 
 router = APIRouter()
 
 
+async def _retrieve_context(user_id: str, query: Dict[str, float], k: int, document_id: str):
+    store = PersistentVectorStore()
+    if Config.HIERARCHICAL_RETRIEVAL:
+        return await store.search_hierarchical(
+            user_id,
+            query,
+            k=k,
+            document_id=document_id,
+            top_sections=Config.HIERARCHICAL_TOP_SECTIONS
+        )
+    return await store.search_bm25(user_id, query, k=k, document_id=document_id)
+
+
+async def _build_prompt_context(turn: ChatTurn, question: str, context_results):
+    """Return the per-turn prompt context and, when the retrieved chunk set
+    is cached server-side, the handle to send with it. A turn that retrieves
+    the same chunks as an earlier one reuses its handle instead of resending
+    them."""
+    cached_context = await ContextCacheService.get_handle(turn.user_id, turn.document_id, context_results, task="qa")
+    if cached_context:
+        context_results = [r for r in context_results if r.get("chunk_id") not in cached_context.chunk_ids]
+    context = pack_context(context_results, Config.CONTEXT_BUDGET_QA)
+    
+    conversation_context = turn.context_string()
+    
+    if conversation_context and conversation_context != "No previous conversation.":
+        return f"""{conversation_context}
+
+Current question: {question}
+
+Relevant content from document:
+{context}
+
+Answer the current question using the provided content and conversation context.""", cached_context
+    return context, cached_context
+
+
+async def _finish_turn(turn: ChatTurn, question: str, answer: str, transaction_id: str,
+                       context_results=None):
+    """Persist the exchange, settle the credit and (for standalone questions,
+    passed with their context_results) cache the answer, all concurrently.
+
+    The writes go to different collections, so they aren't one batch: the
+    slowest is the exchange, which takes two sequential round trips (the
+    session counter hands out sequence numbers, then the bucket write), so
+    the write phase costs two round trips of latency, not one."""
+    writes = [
+        turn.record(question, answer),
+        CreditService.complete_transaction(turn.user_id, transaction_id)
+    ]
+    if context_results is not None:
+        writes.append(QuestionCacheService.store(turn.user_id, turn.document_id, question, context_results, answer))
+    await asyncio.gather(*writes)
+
+
 @router.post("/chat", dependencies=[Depends(limit_chat)])
 async def chat_with_document(req: ChatRequest, current_user: dict = Depends(get_current_user)):
     question = (req.question or "").strip()
@@ -33,53 +97,47 @@ async def chat_with_document(req: ChatRequest, current_user: dict = Depends(get_
                 "document_id": document_id
             }
         
-        enhanced_query = await ChatSessionService.enhance_query(question, user_id, document_id)
+        turn = await ChatSessionService.load_turn(user_id, document_id)
+        followup_terms = turn.followup_terms(question)
+        standalone = not followup_terms
         
-        transaction_id = await CreditService.check_and_deduct(user_id, "chat")
-        
-        store = PersistentVectorStore()
-        context_results = await store.search_bm25(
-            user_id, 
-            enhanced_query, 
-            k=req.top_k, 
-            document_id=document_id
-        )
+        query = weighted_query(question, followup_terms)
+        context_results = await _retrieve_context(user_id, query, req.top_k, document_id)
         
         if not context_results:
             response = "I don't have information about that in this document. Please make sure you've extracted content from it first."
-            await ChatSessionService.add_exchange(user_id, document_id, question, response)
+            await turn.record(question, response)
             return {
                 "answer": response,
                 "sources_used": 0,
                 "document_id": document_id
             }
         
-        context = "\n\n".join([r["content"] for r in context_results])
-        
-        conversation_context = await ChatSessionService.get_context_string(user_id, document_id)
+        if standalone:
+            cached_answer = await QuestionCacheService.lookup(document_id, question, context_results)
+            if cached_answer:
+                await turn.record(question, cached_answer)
+                return {
+                    "answer": cached_answer,
+                    "sources_used": len(context_results),
+                    "document_id": document_id,
+                    "query_enhanced": False,
+                    "source": "cache"
+                }
         
-        if conversation_context and conversation_context != "No previous conversation.":
-            enhanced_prompt = f"""{conversation_context}
-
-Current question: {question}
-
-Relevant content from document:
-{context}
-
-Answer the current question using the provided content and conversation context."""
-            answer = ask_question_about_text(question, enhanced_prompt, history=[])
-        else:
-            answer = ask_question_about_text(question, context, history=[])
+        transaction_id = await CreditService.check_and_deduct(user_id, "chat")
         
-        await ChatSessionService.add_exchange(user_id, document_id, question, answer)
+        prompt_context, cached_context = await _build_prompt_context(turn, question, context_results)
+        answer = await ask_question_about_text(question, prompt_context, history=[], cached_context=cached_context)
         
-        await CreditService.complete_transaction(user_id, transaction_id)
+        cache_answer = standalone and not answer.startswith(QA_ERROR_PREFIX)
+        await _finish_turn(turn, question, answer, transaction_id, context_results if cache_answer else None)
         
         return {
             "answer": answer,
             "sources_used": len(context_results),
             "document_id": document_id,
-            "query_enhanced": enhanced_query != question
+            "query_enhanced": not standalone
         }
     
     except HTTPException:
@@ -88,16 +146,115 @@ Answer the current question using the provided content and conversation context.
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
 
 
+@router.post("/chat/stream", dependencies=[Depends(limit_chat)])
+async def stream_chat_with_document(req: ChatRequest, current_user: dict = Depends(get_current_user)):
+    """Same as /chat, but relays the answer token by token as Server-Sent Events.
+
+    Events: ``start`` (metadata), unnamed ``data`` events carrying ``token``,
+    then ``done`` with the full answer or ``error``. The exchange is persisted
+    and the credit committed only once the stream completes; a disconnect
+    cancels the upstream Gemini call and refunds the credit.
+    """
+    question = (req.question or "").strip()
+    document_id = req.document_id
+    user_id = current_user['uid']
+    
+    if not question:
+        raise HTTPException(status_code=400, detail="question is required")
+    
+    if not document_id:
+        raise HTTPException(status_code=400, detail="document_id is required for chat")
+    
+    def _single_message_stream(answer: str):
+        async def events():
+            yield format_sse({"document_id": document_id, "sources_used": 0}, event="start")
+            yield format_sse({"token": answer})
+            yield format_sse({"answer": answer}, event="done")
+        return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+    
+    response = get_general_response(question)
+    if response:
+        await ChatSessionService.add_exchange(user_id, document_id, question, response)
+        return _single_message_stream(response)
+    
+    turn = await ChatSessionService.load_turn(user_id, document_id)
+    followup_terms = turn.followup_terms(question)
+    standalone = not followup_terms
+    
+    query = weighted_query(question, followup_terms)
+    context_results = await _retrieve_context(user_id, query, req.top_k, document_id)
+    
+    if not context_results:
+        response = "I don't have information about that in this document. Please make sure you've extracted content from it first."
+        await turn.record(question, response)
+        return _single_message_stream(response)
+    
+    if standalone:
+        cached_answer = await QuestionCacheService.lookup(document_id, question, context_results)
+        if cached_answer:
+            await turn.record(question, cached_answer)
+            return _single_message_stream(cached_answer)
+    
+    transaction_id = await CreditService.check_and_deduct(user_id, "chat")
+    
+    try:
+        prompt_context, cached_context = await _build_prompt_context(turn, question, context_results)
+    except Exception:
+        await CreditService.refund_by_action(user_id, "chat", transaction_id)
+        raise
+    
+    async def events():
+        parts = []
+        completed = False
+        try:
+            yield format_sse({
+                "document_id": document_id,
+                "sources_used": len(context_results),
+                "query_enhanced": not standalone
+            }, event="start")
+            
+            async for token in stream_question_about_text(question, prompt_context, history=[], cached_context=cached_context):
+                parts.append(token)
+                yield format_sse({"token": token})
+            
+            answer = "".join(parts).strip()
+            with anyio.CancelScope(shield=True):
+                await _finish_turn(turn, question, answer, transaction_id, context_results if standalone else None)
+            completed = True
+            
+            yield format_sse({"answer": answer}, event="done")
+        except Exception as e:
+            if not completed:
+                yield format_sse({"message": f"Chat failed: {str(e)}"}, event="error")
+        finally:
+            if not completed:
+                with anyio.CancelScope(shield=True):
+                    await CreditService.refund_by_action(user_id, "chat", transaction_id)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 @router.get("/chat/history/{document_id}")
-async def get_chat_history(document_id: str, current_user: dict = Depends(get_current_user)):
-    """Get chat history for a specific document."""
+async def get_chat_history(
+    document_id: str,
+    limit: int = 50,
+    before: Optional[int] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get chat history for a specific document, newest page first.
+
+    Pass the returned ``next_cursor`` as ``before`` to fetch older messages;
+    it is null once the start of the session is reached.
+    """
     user_id = current_user['uid']
-    history = await ChatSessionService.get_history(user_id, document_id)
+    limit = max(1, min(limit, Config.CHAT_HISTORY_PAGE_MAX))
+    history, next_cursor = await ChatSessionService.get_history_page(user_id, document_id, limit=limit, before=before)
     summary = await ChatSessionService.get_session_summary(user_id, document_id)
     
     return {
         "document_id": document_id,
         "history": history,
+        "next_cursor": next_cursor,
         "summary": summary
     }
 
@@ -1,18 +1,18 @@
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Request
 from pydantic import BaseModel, HttpUrl
 from typing import List, Optional
-import asyncio
 from Services.gemini_client import extract_concepts_from_text
 from Middleware.auth import get_current_user
 from config import Config
 from models.requests import ExtractRequest
 from Services.job_service import JobService
 from Services.chunking_service import TextChunker
+from Services.dedup_service import ChunkDeduplicator
 from Database.database import get_db
 from datetime import datetime
 from bson import ObjectId
 import httpx
-from bs4 import BeautifulSoup
+from Services.text_cleaner import extract_sections
 import re
 import warnings
 from bs4 import MarkupResemblesLocatorWarning
@@ -40,16 +40,13 @@ async def process_extraction_job(job_id: str, url: str, user_id: str, transactio
             
         await JobService.update_job(job_id, progress=30)
         
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        for script in soup(["script", "style"]):
-            script.decompose()
-            
-        text = soup.get_text()
-        
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = '\n'.join(chunk for chunk in chunks if chunk)
+        sections = extract_sections(
+            html,
+            min_words=Config.MIN_SECTION_WORDS,
+            link_density_threshold=Config.BOILERPLATE_LINK_DENSITY,
+            boilerplate_max_words=Config.BOILERPLATE_MAX_WORDS
+        )
+        text = '\n'.join(section["text"] for section in sections)
         
         if not text.strip():
             raise Exception("No text found at the provided URL")
@@ -57,7 +54,13 @@ async def process_extraction_job(job_id: str, url: str, user_id: str, transactio
         await JobService.update_job(job_id, progress=40)
         
         chunker = TextChunker(chunk_size=Config.DEFAULT_CHUNK_SIZE, overlap=Config.DEFAULT_CHUNK_OVERLAP)
-        chunks_data = chunker.chunk_by_sentences(text)
+        chunks_data = chunker.chunk_sections(sections)
+        
+        chunks_data, duplicates_dropped = await ChunkDeduplicator.filter_chunks(user_id, chunks_data)
+        TextChunker.index_sections(chunks_data, sections)
+        
+        if not chunks_data:
+            raise Exception("All content at this URL duplicates documents already in your library")
         chunk_texts = [c["text"] for c in chunks_data]
         
         await JobService.update_job(job_id, progress=60)
@@ -65,7 +68,7 @@ async def process_extraction_job(job_id: str, url: str, user_id: str, transactio
         concepts_list = []
         relationships = []
         try:
-            extraction_result = await asyncio.to_thread(extract_concepts_from_text, text)
+            extraction_result = await extract_concepts_from_text(text, chunk_texts)
             concepts_list = extraction_result.get("concepts", [])
             relationships = extraction_result.get("relationships", [])
             
@@ -95,8 +98,22 @@ async def process_extraction_job(job_id: str, url: str, user_id: str, transactio
             "status": "completed",
             "concepts": concepts_structured,
             "relationships": relationships,
+            "sections": [
+                {
+                    "id": section["id"],
+                    "heading": section["heading"],
+                    "level": section["level"],
+                    "path": section["path"],
+                    "parent": section["parent"],
+                    "chunk_start": section.get("chunk_start"),
+                    "chunk_end": section.get("chunk_end")
+                }
+                for section in sections
+            ],
             "metadata": {
                 "total_chunks": len(chunks_data),
+                "total_sections": len(sections),
+                "duplicate_chunks_dropped": duplicates_dropped,
                 "total_concepts": len(concepts_list),
                 "text_length": len(text),
                 "extraction_method": "gemini-2.5-flash"
@@ -118,8 +135,12 @@ async def process_extraction_job(job_id: str, url: str, user_id: str, transactio
                 "metadata": {
                     "start_sentence": c["start_sentence"],
                     "end_sentence": c["end_sentence"],
+                    "section_path": c["section_path"],
                     "type": "sentence_group"
                 },
+                "section_id": c["section_id"],
+                "simhash": c["simhash"],
+                "simhash_bands": c["simhash_bands"],
                 "created_at": datetime.utcnow().isoformat()
             })
             
@@ -137,11 +158,23 @@ async def process_extraction_job(job_id: str, url: str, user_id: str, transactio
         from Services.persistent_vector_store import PersistentVectorStore
         
         store = PersistentVectorStore()
+        tokenized_chunks = []
         for i, chunk_doc in enumerate(chunk_docs):
             tokens = chunk_doc["text"].lower().split()
-            await store.save_bm25_tokens(user_id, doc_id, chunk_oids[i], tokens)
+            tokenized_chunks.append(tokens)
+            await store.save_bm25_tokens(user_id, doc_id, chunk_oids[i], tokens, section_id=chunk_doc["section_id"])
             
         chunks_indexed = len(chunk_docs)
+        
+        if chunk_docs:
+            from Services.concept_index import ConceptIndexService
+            await ConceptIndexService.build_for_document(
+                user_id, result.inserted_id, concepts_list, chunk_oids, tokenized_chunks
+            )
+        
+        from Services.concept_graph import ConceptGraphService
+        await ConceptGraphService.build_for_document(user_id, result.inserted_id, relationships)
+        
         await db.documents.update_one(
             {"_id": result.inserted_id},
             {"$set": {"summary": f"Extracted {chunks_indexed} chunks. Key topics: {', '.join(concepts_list[:3])}..."}}
@@ -209,6 +242,12 @@ async def clear_database(current_user: dict = Depends(get_current_user)):
         db = await get_db()
         await db.documents.delete_many({"user_id": current_user['uid']})
         await db.document_chunks.delete_many({"user_id": current_user['uid']})
+        await db.concept_chunks.delete_many({"user_id": current_user['uid']})
+        await db.concept_edges.delete_many({"user_id": current_user['uid']})
+        await db.question_cache.delete_many({"user_id": current_user['uid']})
+        await db.chat_sessions.delete_many({"user_id": current_user['uid']})
+        await db.chat_messages.delete_many({"user_id": current_user['uid']})
+        await db.context_cache_handles.delete_many({"user_id": current_user['uid']})
         
         return {"message": "Database and vector stores cleared"}
     except Exception as e:
@@ -146,6 +146,18 @@ async def delete_document(doc_id: str, current_user: dict = Depends(get_current_
             "user_id": current_user['uid']
         })
         
+        await db.concept_chunks.delete_many({
+            "document_id": ObjectId(doc_id),
+            "user_id": current_user['uid']
+        })
+        
+        await db.concept_edges.delete_many({
+            "document_id": ObjectId(doc_id),
+            "user_id": current_user['uid']
+        })
+        
+        await db.question_cache.delete_many({"document_id": doc_id})
+        
         await db.concept_notes.delete_many({
             "document_id": ObjectId(doc_id),
             "user_id": current_user['uid']
@@ -7,6 +7,9 @@ from Services.note_generator import (
     extract_key_concepts
 )
 from Services.persistent_vector_store import PersistentVectorStore
+from Services.concept_index import ConceptIndexService
+from Services.concept_graph import ConceptGraphService
+from Services.single_flight import SingleFlight
 from Middleware.rate_limit import limit_notes
 
 router = APIRouter()
@@ -35,13 +38,14 @@ async def generate_notes(req: NotesRequest, current_user: dict = Depends(get_cur
         except:
             raise HTTPException(status_code=400, detail="Invalid document_id format")
         
-        existing_note = await db.concept_notes.find_one({
-            "user_id": current_user['uid'],
-            "document_id": doc_oid,
-            "concept_name": req.topic
-        })
-        
-        if existing_note:
+        async def _lookup():
+            existing_note = await db.concept_notes.find_one({
+                "user_id": current_user['uid'],
+                "document_id": doc_oid,
+                "concept_name": req.topic
+            })
+            if not existing_note:
+                return None
             return {
                 "success": True,
                 "topic": req.topic,
@@ -51,70 +55,81 @@ async def generate_notes(req: NotesRequest, current_user: dict = Depends(get_cur
                 "generated_at": existing_note.get('generated_at')
             }
 
-        from Services.credit_service import CreditService
-        transaction_id = await CreditService.check_and_deduct(current_user['uid'], "notes")
+        cached = await _lookup()
+        if cached:
+            return cached
 
-        try:
-            if req.use_stored_content and not req.content:
-                store = PersistentVectorStore()
-                results = await store.search_bm25(
-                    current_user['uid'], 
-                    req.topic, 
-                    k=10, 
-                    document_id=req.document_id
-                )
-                
-                if not results:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="No content found for this topic in the specified document."
+        async def _generate():
+            from Services.credit_service import CreditService
+            transaction_id = await CreditService.check_and_deduct(current_user['uid'], "notes")
+
+            try:
+                if req.use_stored_content and not req.content:
+                    results = await ConceptIndexService.find_context(
+                        current_user['uid'], 
+                        req.document_id, 
+                        req.topic, 
+                        k=10
                     )
+                    
+                    if not results:
+                        raise HTTPException(
+                            status_code=400,
+                            detail="No content found for this topic in the specified document."
+                        )
+                    
+                    content = results
+                elif req.content:
+                    content = req.content
+                else:
+                    raise HTTPException(status_code=400, detail="No content available")
                 
-                content = "\\n\\n".join([r["content"] for r in results])
-            elif req.content:
-                content = req.content
-            else:
-                raise HTTPException(status_code=400, detail="No content available")
-            
-            notes = generate_study_notes(content, req.topic)
-            
-            document = await db.documents.find_one({"_id": doc_oid})
-            concept_id = None
-            if document and "concepts" in document:
-                for concept in document['concepts']:
-                    if concept.get('name', '').lower() == req.topic.lower():
-                        concept_id = concept.get('_id')
-                        break
-            
-            new_note = {
-                "user_id": current_user['uid'],
-                "document_id": doc_oid,
-                "concept_name": req.topic,
-                "concept_id": concept_id,
+                notes = await generate_study_notes(content, req.topic)
                 
-                "content": notes,
-                "type": "comprehensive_notes",
+                document = await db.documents.find_one({"_id": doc_oid})
+                concept_id = None
+                if document and "concepts" in document:
+                    for concept in document['concepts']:
+                        if concept.get('name', '').lower() == req.topic.lower():
+                            concept_id = concept.get('_id')
+                            break
                 
-                "generated_at": datetime.utcnow(),
-                "generation_method": "gemini-2.5-flash"
-            }
-            await db.concept_notes.insert_one(new_note)
-            
-            from Services.activity_service import ActivityService
-            await ActivityService.log_activity(current_user['uid'], "note", req.topic, "Generated study notes")
+                new_note = {
+                    "user_id": current_user['uid'],
+                    "document_id": doc_oid,
+                    "concept_name": req.topic,
+                    "concept_id": concept_id,
+                    
+                    "content": notes,
+                    "type": "comprehensive_notes",
+                    
+                    "generated_at": datetime.utcnow(),
+                    "generation_method": "gemini-2.5-flash"
+                }
+                if not notes.get("partial"):
+                    await db.concept_notes.insert_one(new_note)
+                
+                from Services.activity_service import ActivityService
+                await ActivityService.log_activity(current_user['uid'], "note", req.topic, "Generated study notes")
 
-            await CreditService.complete_transaction(current_user['uid'], transaction_id)
-            
-            return {
-                "success": True,
-                "topic": req.topic,
-                "document_id": req.document_id,
-                "notes": notes,
-                "source": "generated"
-            }
-        except Exception as e:
-            await CreditService.refund_by_action(current_user['uid'], "notes", transaction_id)
-            raise HTTPException(status_code=500, detail=f"Note generation failed: {str(e)}")
+                await CreditService.complete_transaction(current_user['uid'], transaction_id)
+                
+                return {
+                    "success": True,
+                    "topic": req.topic,
+                    "document_id": req.document_id,
+                    "notes": notes,
+                    "source": "generated"
+                }
+            except Exception as e:
+                await CreditService.refund_by_action(current_user['uid'], "notes", transaction_id)
+                raise HTTPException(status_code=500, detail=f"Note generation failed: {str(e)}")
+
+        flight_key = SingleFlight.build_key("notes", current_user['uid'], req.document_id, req.topic)
+        result, shared = await SingleFlight.run(flight_key, _generate, _lookup)
+        if shared and result.get("source") == "generated":
+            result = {**result, "source": "coalesced"}
+        return result
     except HTTPException:
         raise
     except Exception as e:
@@ -126,7 +141,7 @@ async def create_summary(req: SummaryRequest, current_user: dict = Depends(get_c
         raise HTTPException(status_code=400, detail="Content too short for summarization")
     
     try:
-        summary = generate_quick_summary(req.content, req.max_sentences)
+        summary = await generate_quick_summary(req.content, req.max_sentences)
         
         return {
             "success": True,
@@ -150,7 +165,7 @@ async def get_key_concepts(req: ConceptsRequest, current_user: dict = Depends(ge
         raise HTTPException(status_code=400, detail="Content too short")
     
     try:
-        concepts = extract_key_concepts(req.content, req.top_n)
+        concepts = await extract_key_concepts(req.content, req.top_n)
         
         return {
             "success": True,
@@ -186,9 +201,9 @@ async def get_flashcards_for_topic(topic: str, count: int = 10, current_user: di
         if not results:
             raise HTTPException(status_code=404, detail=f"No content found for topic: {topic}")
         
-        content = "\n\n".join([r["content"] for r in results])
+        content = results
         
-        notes = generate_study_notes(content, topic)
+        notes = await generate_study_notes(content, topic)
         
         return {
             "topic": topic,
@@ -203,7 +218,7 @@ async def get_flashcards_for_topic(topic: str, count: int = 10, current_user: di
         raise HTTPException(status_code=500, detail=f"Flashcard generation failed: {str(e)}")
 
 @router.get("/notes/mind-map/{topic}", dependencies=[Depends(limit_notes)])
-async def get_mind_map(topic: str, current_user: dict = Depends(get_current_user)):
+async def get_mind_map(topic: str, document_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     try:
         db = await get_db()
         
@@ -220,15 +235,24 @@ async def get_mind_map(topic: str, current_user: dict = Depends(get_current_user
                 "source": "cache"
             }
 
+        graph_mind_map = await ConceptGraphService.build_mind_map(current_user['uid'], topic, document_id)
+        if graph_mind_map:
+            return {
+                "topic": topic,
+                "mind_map": graph_mind_map,
+                "key_points_count": len(graph_mind_map["branches"]),
+                "source": "graph"
+            }
+
         store = PersistentVectorStore()
-        results = await store.search_bm25(current_user['uid'], topic, k=8, document_id=None)
+        results = await store.search_bm25(current_user['uid'], topic, k=8, document_id=document_id)
         
         if not results:
             raise HTTPException(status_code=404, detail=f"No content found for topic: {topic}")
         
-        content = "\n\n".join([r["content"] for r in results])
+        content = results
         
-        notes = generate_study_notes(content, topic)
+        notes = await generate_study_notes(content, topic)
         
         return {
             "topic": topic,
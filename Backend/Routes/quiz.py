@@ -1,8 +1,13 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List
-from Services.gemini_client import generate_mcq_from_text
+import anyio
+from Services.gemini_client import generate_mcq_from_text, iter_mcq_shards
+from Services.sse import format_sse, SSE_HEADERS
 from Middleware.rate_limit import limit_quiz
+from Services.single_flight import SingleFlight
 from config import Config
 
 
@@ -35,20 +40,71 @@ async def save_quiz_result(result: QuizResultRequest, current_user: dict = Depen
             "created_at": datetime.utcnow()
         }
         
-        await db.quiz_results.insert_one(quiz_result)
-        
         from Services.activity_service import ActivityService
-        await ActivityService.log_activity(
-            current_user['uid'], 
-            "quiz_result", 
-            f"Scored {result.score}/{result.total}", 
-            f"Topics: {', '.join(result.topics[:2])}"
+        from Services.user_stats import UserStatsService
+        await asyncio.gather(
+            db.quiz_results.insert_one(quiz_result),
+            UserStatsService.record_quiz(current_user['uid'], quiz_result["percentage"]),
+            ActivityService.log_activity(
+                current_user['uid'], 
+                "quiz_result", 
+                f"Scored {result.score}/{result.total}", 
+                f"Topics: {', '.join(result.topics[:2])}"
+            )
         )
         
         return {"message": "Result saved successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save result: {str(e)}")
 
+async def _collect_quiz_context(user_id: str, document_id: str, topics: List[str]) -> List[dict]:
+    from Services.concept_index import ConceptIndexService
+    
+    all_context = []
+    for topic in topics:
+        results = await ConceptIndexService.find_context(
+            user_id, 
+            document_id, 
+            topic, 
+            k=10
+        )
+        if results:
+            all_context.extend(results)
+    
+    seen = set()
+    unique_context = []
+    for result in all_context:
+        if result["content"] not in seen:
+            seen.add(result["content"])
+            unique_context.append(result)
+    
+    if not unique_context:
+        raise HTTPException(
+            status_code=400, 
+            detail="No content found for these topics in the specified document."
+        )
+    return unique_context
+
+async def _find_stored_quiz(db, user_id: str, document_id: str, doc_oid, topic_key: str, count: int):
+    """The stored quiz for these settings in the /quiz/generate response
+    shape, or None."""
+    existing_quiz = await db.document_quizzes.find_one({
+        "user_id": user_id,
+        "document_id": doc_oid,
+        "topic_key": topic_key,
+        "count": count
+    })
+    if not existing_quiz:
+        return None
+    return {
+        "questions": existing_quiz['questions'],
+        "topics_covered": existing_quiz['topics_covered'],
+        "document_id": document_id,
+        "context_chunks_used": existing_quiz.get('context_chunks_used', 0),
+        "source": "cache",
+        "generated_at": existing_quiz.get('generated_at')
+    }
+
 @router.post("/quiz/generate", dependencies=[Depends(limit_quiz)])
 async def generate_quiz_with_topics(quiz_req: QuizRequest, current_user: dict = Depends(get_current_user)):
     try:
@@ -66,103 +122,218 @@ async def generate_quiz_with_topics(quiz_req: QuizRequest, current_user: dict =
         except:
             raise HTTPException(status_code=400, detail="Invalid document_id format")
         
-        topic_key = ",".join(sorted(quiz_req.topics))
+        topics = quiz_req.topics
+        if not topics:
+            raise HTTPException(status_code=400, detail="Please select at least one topic")
         
-        existing_quiz = await db.document_quizzes.find_one({
-            "user_id": current_user['uid'],
-            "document_id": doc_oid,
-            "topic_key": topic_key,
-            "count": quiz_req.count
-        })
-        
-        if existing_quiz:
-            return {
-                "questions": existing_quiz['questions'],
-                "topics_covered": existing_quiz['topics_covered'],
-                "document_id": quiz_req.document_id,
-                "context_chunks_used": existing_quiz.get('context_chunks_used', 0),
-                "source": "cache",
-                "generated_at": existing_quiz.get('generated_at')
-            }
-
-        from Services.credit_service import CreditService
-        transaction_id = await CreditService.check_and_deduct(current_user['uid'], "quiz")
-
-        try:
-            count = max(Config.MIN_QUIZ_QUESTIONS, min(Config.MAX_QUIZ_QUESTIONS, quiz_req.count))
-            topics = quiz_req.topics
-            
-            if not topics:
-                raise HTTPException(status_code=400, detail="Please select at least one topic")
+        topic_key = ",".join(sorted(topics))
+        count = max(Config.MIN_QUIZ_QUESTIONS, min(Config.MAX_QUIZ_QUESTIONS, quiz_req.count))
         
-            from Services.persistent_vector_store import PersistentVectorStore
-            store = PersistentVectorStore()
-            
-            all_context = []
-            for topic in topics:
-                results = await store.search_bm25(
-                    current_user['uid'], 
-                    topic, 
-                    k=10, 
-                    document_id=quiz_req.document_id
-                )
-                if results:
-                    all_context.extend([r["content"] for r in results])
-            
-            seen = set()
-            unique_context = []
-            for chunk in all_context:
-                if chunk not in seen:
-                    seen.add(chunk)
-                    unique_context.append(chunk)
+        async def _lookup():
+            return await _find_stored_quiz(db, current_user['uid'], quiz_req.document_id, doc_oid, topic_key, count)
+
+        cached = await _lookup()
+        if cached:
+            return cached
+
+        async def _generate():
+            from Services.credit_service import CreditService
+            transaction_id = await CreditService.check_and_deduct(current_user['uid'], "quiz")
+
+            try:
+                unique_context = await _collect_quiz_context(current_user['uid'], quiz_req.document_id, topics)
             
-            if not unique_context:
-                raise HTTPException(
-                    status_code=400, 
-                    detail="No content found for these topics in the specified document."
+                generation_stats = {}
+                quiz_json = await generate_mcq_from_text(
+                    count=count, 
+                    topics=topics,
+                    context_chunks=unique_context,
+                    stats=generation_stats
                 )
             
-            combined_text = "\\n\\n".join(unique_context)
-            
-            quiz_json = generate_mcq_from_text(
-                combined_text, 
-                count=count, 
-                topics=topics
-            )
-            
-            new_quiz = {
-                "user_id": current_user['uid'],
-                "document_id": doc_oid,
-                "topic_key": topic_key,
-                "topics_covered": topics,
-                "questions": quiz_json,
-                "count": count,
-                "context_chunks_used": len(unique_context),
-                "generated_at": datetime.utcnow(),
-                "generation_method": "gemini-2.5-flash"
-            }
-            await db.document_quizzes.insert_one(new_quiz)
+                new_quiz = {
+                    "user_id": current_user['uid'],
+                    "document_id": doc_oid,
+                    "topic_key": topic_key,
+                    "topics_covered": topics,
+                    "questions": quiz_json,
+                    "count": count,
+                    "context_chunks_used": len(unique_context),
+                    "generated_at": datetime.utcnow(),
+                    "generation_method": "gemini-2.5-flash"
+                }
+                if generation_stats.get("complete"):
+                    await db.document_quizzes.insert_one(new_quiz)
             
-            from Services.activity_service import ActivityService
-            await ActivityService.log_activity(current_user['uid'], "quiz", f"Quiz: {', '.join(topics[:2])}", f"Generated {count} questions")
+                from Services.activity_service import ActivityService
+                await ActivityService.log_activity(current_user['uid'], "quiz", f"Quiz: {', '.join(topics[:2])}", f"Generated {len(quiz_json)} questions")
 
-            await CreditService.complete_transaction(current_user['uid'], transaction_id)
+                await CreditService.complete_transaction(current_user['uid'], transaction_id)
             
-            return {
-                "questions": quiz_json, 
-                "topics_covered": topics,
-                "document_id": quiz_req.document_id,
-                "context_chunks_used": len(unique_context),
-                "source": "generated"
-            }
-        except Exception as e:
-            await CreditService.refund_by_action(current_user['uid'], "quiz", transaction_id)
-            raise HTTPException(status_code=500, detail=f"Quiz generation failed: {str(e)}")
+                return {
+                    "questions": quiz_json, 
+                    "topics_covered": topics,
+                    "document_id": quiz_req.document_id,
+                    "context_chunks_used": len(unique_context),
+                    "source": "generated"
+                }
+            except Exception as e:
+                await CreditService.refund_by_action(current_user['uid'], "quiz", transaction_id)
+                raise HTTPException(status_code=500, detail=f"Quiz generation failed: {str(e)}")
+
+        flight_key = SingleFlight.build_key("quiz", current_user['uid'], quiz_req.document_id, topic_key, count)
+        result, shared = await SingleFlight.run(flight_key, _generate, _lookup)
+        if shared and result.get("source") == "generated":
+            result = {**result, "source": "coalesced"}
+        return result
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+@router.post("/quiz/generate/stream", dependencies=[Depends(limit_quiz)])
+async def stream_quiz_with_topics(quiz_req: QuizRequest, current_user: dict = Depends(get_current_user)):
+    """Server-Sent Events variant of /quiz/generate: emits a `questions`
+    event as each shard finishes, then `done` once the quiz is stored.
+
+    Identical requests are coalesced like /quiz/generate: only the request
+    that runs the generation streams shard by shard and keeps its credit;
+    the others get the finished quiz in one `questions` event and are
+    refunded. The generation outlives a disconnecting client (others may be
+    waiting on it) and settles its own credit; it is refunded on failure.
+    """
+    user_id = current_user['uid']
+    db = await get_db()
+    
+    if not quiz_req.document_id:
+        raise HTTPException(status_code=400, detail="document_id is required for quiz generation")
+    
+    from bson import ObjectId
+    try:
+        doc_oid = ObjectId(quiz_req.document_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid document_id format")
+    
+    topics = quiz_req.topics
+    if not topics:
+        raise HTTPException(status_code=400, detail="Please select at least one topic")
+    
+    topic_key = ",".join(sorted(topics))
+    count = max(Config.MIN_QUIZ_QUESTIONS, min(Config.MAX_QUIZ_QUESTIONS, quiz_req.count))
+    
+    async def _lookup():
+        return await _find_stored_quiz(db, user_id, quiz_req.document_id, doc_oid, topic_key, count)
+    
+    cached = await _lookup()
+    if cached:
+        async def cached_events():
+            yield format_sse({"document_id": quiz_req.document_id, "source": "cache"}, event="start")
+            yield format_sse({"questions": cached['questions']}, event="questions")
+            yield format_sse({
+                "total": len(cached['questions']),
+                "topics_covered": cached['topics_covered'],
+                "context_chunks_used": cached['context_chunks_used']
+            }, event="done")
+        return StreamingResponse(cached_events(), media_type="text/event-stream", headers=SSE_HEADERS)
+    
+    from Services.credit_service import CreditService
+    transaction_id = await CreditService.check_and_deduct(user_id, "quiz")
+    
+    try:
+        unique_context = await _collect_quiz_context(user_id, quiz_req.document_id, topics)
+    except Exception:
+        await CreditService.refund_by_action(user_id, "quiz", transaction_id)
+        raise
+    
+    batches = asyncio.Queue()
+    leading = {"value": False}
+    
+    async def _generate():
+        leading["value"] = True
+        try:
+            questions = []
+            generation_stats = {}
+            async for batch in iter_mcq_shards(unique_context, count=count, topics=topics, stats=generation_stats):
+                questions.extend(batch)
+                batches.put_nowait(batch)
+            
+            if generation_stats.get("complete"):
+                await db.document_quizzes.insert_one({
+                    "user_id": user_id,
+                    "document_id": doc_oid,
+                    "topic_key": topic_key,
+                    "topics_covered": topics,
+                    "questions": questions,
+                    "count": count,
+                    "context_chunks_used": len(unique_context),
+                    "generated_at": datetime.utcnow(),
+                    "generation_method": "gemini-2.5-flash"
+                })
+            
+            from Services.activity_service import ActivityService
+            await ActivityService.log_activity(user_id, "quiz", f"Quiz: {', '.join(topics[:2])}", f"Generated {len(questions)} questions")
+            await CreditService.complete_transaction(user_id, transaction_id)
+        except BaseException:
+            await CreditService.refund_by_action(user_id, "quiz", transaction_id)
+            raise
+        # Same payload as /quiz/generate's generator: the two share flight keys.
+        return {
+            "questions": questions,
+            "topics_covered": topics,
+            "document_id": quiz_req.document_id,
+            "context_chunks_used": len(unique_context),
+            "source": "generated"
+        }
+    
+    flight_key = SingleFlight.build_key("quiz", user_id, quiz_req.document_id, topic_key, count)
+    
+    async def events():
+        flight = asyncio.ensure_future(SingleFlight.run(flight_key, _generate, _lookup))
+        getter = None
+        completed = False
+        try:
+            yield format_sse({"document_id": quiz_req.document_id, "source": "generated"}, event="start")
+            
+            while not flight.done() or not batches.empty():
+                if batches.empty():
+                    getter = asyncio.ensure_future(batches.get())
+                    done, _ = await asyncio.wait({getter, flight}, return_when=asyncio.FIRST_COMPLETED)
+                    if getter not in done:
+                        getter.cancel()
+                        continue
+                    batch = getter.result()
+                else:
+                    batch = batches.get_nowait()
+                yield format_sse({"questions": batch}, event="questions")
+            
+            result, shared = flight.result()
+            if shared:
+                with anyio.CancelScope(shield=True):
+                    await CreditService.refund_by_action(user_id, "quiz", transaction_id)
+                yield format_sse({"questions": result["questions"]}, event="questions")
+            completed = True
+            
+            yield format_sse({
+                "total": len(result["questions"]),
+                "topics_covered": result["topics_covered"],
+                "context_chunks_used": result["context_chunks_used"]
+            }, event="done")
+        except Exception as e:
+            if not completed:
+                yield format_sse({"message": f"Quiz generation failed: {str(e)}"}, event="error")
+        finally:
+            # Only stop waiting here; the shared generation keeps running.
+            for waiter in (getter, flight):
+                if waiter is not None and not waiter.done():
+                    waiter.cancel()
+            # A generation we lead settles its own credit, even after a
+            # disconnect; otherwise ours was never used.
+            if not completed and not leading["value"]:
+                with anyio.CancelScope(shield=True):
+                    await CreditService.refund_by_action(user_id, "quiz", transaction_id)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.get("/quiz", dependencies=[Depends(limit_quiz)])
 async def generate_quiz(count: int = 10, current_user: dict = Depends(get_current_user)):
     try:
@@ -185,7 +356,7 @@ async def generate_quiz(count: int = 10, current_user: dict = Depends(get_curren
             raise HTTPException(status_code=400, detail="Insufficient content for quiz generation.")
         
         count = max(Config.MIN_QUIZ_QUESTIONS, min(Config.MAX_QUIZ_QUESTIONS, count))
-        quiz_json = generate_mcq_from_text(combined_text, count=count)
+        quiz_json = await generate_mcq_from_text(combined_text, count=count, context_chunks=all_results)
         
         return {"questions": quiz_json, "context_chunks_used": len(all_chunks), "content_length": len(combined_text)}
     except HTTPException:
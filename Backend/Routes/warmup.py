@@ -1,19 +1,34 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends
+from Middleware.auth import get_current_user
 from config import Config
 
 router = APIRouter()
 
 @router.get("/rate-limit/status")
-def get_rate_limit_status(request: Request):
+async def get_rate_limit_status(current_user: dict = Depends(get_current_user)):
+    """Remaining quota per endpoint group for the current user. ``reset`` is
+    the number of seconds until the oldest counted request leaves its window."""
+    from Middleware.rate_limit import LIMITERS
     return {
-        "quotas": {
-            "quiz": Config.RATE_LIMIT_QUIZ,
-            "notes": Config.RATE_LIMIT_NOTES,
-            "chat": Config.RATE_LIMIT_CHAT,
-            "extraction": Config.RATE_LIMIT_EXTRACT
-        },
-        "reset_period": "Per minute/hour based on endpoint",
-        "message": "Limits are applied per user."
+        "quotas": {name: await limiter.status(current_user['uid']) for name, limiter in LIMITERS.items()},
+        "message": "Limits are applied per user over a sliding window."
+    }
+
+@router.get("/llm/stats", dependencies=[Depends(get_current_user)])
+def get_llm_stats():
+    from Services.llm_cache import LLMResponseCache
+    from Services.question_cache import QuestionCacheService
+    from Services.llm_metrics import LLMMetrics
+    from Services.llm_gateway import TASK_TIERS, resolve_models
+    from Services.circuit_breaker import breaker_stats
+    from Services.context_cache import ContextCacheService
+    return {
+        "response_cache": LLMResponseCache.stats(),
+        "question_cache": QuestionCacheService.stats(),
+        "routing": {task: resolve_models(task) for task in TASK_TIERS},
+        "tasks": LLMMetrics.stats(),
+        "circuits": breaker_stats(),
+        "context_cache": ContextCacheService.stats()
     }
 
 @router.get("/warmup")
@@ -1,20 +1,82 @@
+import asyncio
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from config import Config
 from Database.database import get_db
 from datetime import datetime
 
 class ActivityService:
+    """Activity events are buffered in memory and written in batches, so
+    logging never adds a database round trip to the request that caused it.
+    The buffer is flushed when it reaches ACTIVITY_FLUSH_SIZE, every
+    ACTIVITY_FLUSH_INTERVAL seconds by run_flusher, and on shutdown."""
+
+    _buffer = []
+    _flush_lock = asyncio.Lock()
+    _pending = set()
+
     @staticmethod
     async def log_activity(user_id: str, action_type: str, title: str, details: str = None):
-        db = await get_db()
-        
         activity = {
+            "_id": ObjectId(),
             "user_id": user_id,
             "action_type": action_type,
             "title": title,
             "details": details,
             "created_at": datetime.utcnow()
         }
+        ActivityService._buffer.append(activity)
+        
+        if len(ActivityService._buffer) >= Config.ACTIVITY_FLUSH_SIZE and not ActivityService._flush_lock.locked():
+            task = asyncio.ensure_future(ActivityService.flush())
+            ActivityService._pending.add(task)
+            task.add_done_callback(ActivityService._pending.discard)
+
+    @staticmethod
+    async def flush():
+        async with ActivityService._flush_lock:
+            while ActivityService._buffer:
+                batch = ActivityService._buffer[:Config.ACTIVITY_FLUSH_SIZE]
+                del ActivityService._buffer[:len(batch)]
+                try:
+                    await ActivityService._write(batch)
+                except Exception as e:
+                    # Keep the events for the next flush, within the buffer cap.
+                    # Both writes skip what a previous attempt already stored.
+                    print(f"⚠️ Activity flush failed ({len(batch)} events): {e}")
+                    ActivityService._buffer[:0] = batch
+                    overflow = len(ActivityService._buffer) - Config.ACTIVITY_BUFFER_MAX
+                    if overflow > 0:
+                        del ActivityService._buffer[:overflow]
+                    return
+
+    @staticmethod
+    async def _write(batch):
+        from Services.user_stats import UserStatsService
         
-        await db.user_activities.insert_one(activity)
+        db = await get_db()
+        try:
+            await db.user_activities.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # A retried batch may be partly stored already; duplicates are fine.
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        await UserStatsService.push_activities([
+            (a["user_id"], {
+                "id": str(a["_id"]),
+                "action_type": a["action_type"],
+                "title": a["title"],
+                "details": a["details"],
+                "created_at": a["created_at"]
+            })
+            for a in batch
+        ])
+
+    @staticmethod
+    async def run_flusher():
+        while True:
+            await asyncio.sleep(Config.ACTIVITY_FLUSH_INTERVAL)
+            await ActivityService.flush()
 
     @staticmethod
     async def get_recent_activity(user_id: str, limit: int = 5):
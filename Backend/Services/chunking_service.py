@@ -6,7 +6,7 @@ class TextChunker:
         self.chunk_size = chunk_size
         self.overlap = overlap
 
-    def _split_into_sentences(self, text: str) -> List[str]:
+    def split_into_sentences(self, text: str) -> List[str]:
         text = re.sub(r'(?<=Dr)\.', '@@POINT@@', text)
         text = re.sub(r'(?<=Mr)\.', '@@POINT@@', text)
         text = re.sub(r'(?<=Mrs)\.', '@@POINT@@', text)
@@ -23,7 +23,7 @@ class TextChunker:
         return sentences
 
     def chunk_by_sentences(self, text: str) -> List[Dict[str, Any]]:
-        sentences = self._split_into_sentences(text)
+        sentences = self.split_into_sentences(text)
         chunks = []
         
         current_chunk_sentences = []
@@ -79,6 +79,40 @@ class TextChunker:
             
         return chunks
 
+    def chunk_sections(self, sections: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        chunks = []
+        sentence_offset = 0
+        
+        for section in sections:
+            section_chunks = self.chunk_by_sentences(section["text"])
+            if not section_chunks:
+                continue
+            
+            for c in section_chunks:
+                c["start_sentence"] += sentence_offset
+                c["end_sentence"] += sentence_offset
+                c["section_id"] = section["id"]
+                c["section_path"] = section["path"]
+                chunks.append(c)
+            
+            sentence_offset = chunks[-1]["end_sentence"] + 1
+        
+        self.index_sections(chunks, sections)
+        return chunks
+
+    @staticmethod
+    def index_sections(chunks: List[Dict[str, Any]], sections: List[Dict[str, Any]]):
+        """(Re)number chunks and record each section's chunk range; call again
+        after chunks have been filtered out."""
+        ranges = {}
+        for i, c in enumerate(chunks):
+            c["chunk_index"] = i
+            start, _ = ranges.get(c["section_id"], (i, i))
+            ranges[c["section_id"]] = (start, i)
+        
+        for section in sections:
+            section["chunk_start"], section["chunk_end"] = ranges.get(section["id"], (None, None))
+
     def chunk_by_paragraphs(self, text: str) -> List[Dict[str, Any]]:
         paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
         chunks = []
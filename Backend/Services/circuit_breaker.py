@@ -0,0 +1,111 @@
+import time
+from collections import deque
+from typing import Any, Dict
+
+from config import Config
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Error-rate breaker over a sliding time window.
+
+    Closed: calls flow and outcomes are recorded. Once the window holds at
+    least LLM_BREAKER_MIN_CALLS outcomes and the failure rate reaches
+    LLM_BREAKER_ERROR_RATE, the breaker opens and rejects calls for
+    LLM_BREAKER_COOLDOWN seconds. It then goes half-open and lets a single
+    probe through: success closes it, failure re-opens it.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self._outcomes = deque()
+        self._opened_at = 0.0
+        self._probe_started = None
+        self.times_opened = 0
+
+    def _trim(self, now: float):
+        cutoff = now - Config.LLM_BREAKER_WINDOW
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == CLOSED:
+            return True
+
+        if self.state == OPEN:
+            if now - self._opened_at < Config.LLM_BREAKER_COOLDOWN:
+                return False
+            self.state = HALF_OPEN
+            self._probe_started = None
+
+        # Half-open: one probe at a time. A probe that never reports back
+        # (cancelled by a disconnecting client) stops blocking after a timeout.
+        if self._probe_started is None or now - self._probe_started > Config.LLM_TIMEOUT:
+            self._probe_started = now
+            return True
+        return False
+
+    def record_success(self):
+        now = time.monotonic()
+        if self.state != CLOSED:
+            print(f"Circuit for {self.name} closed after successful probe")
+            self.state = CLOSED
+            self._outcomes.clear()
+            self._probe_started = None
+        self._outcomes.append((now, True))
+        self._trim(now)
+
+    def record_failure(self):
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self._open(now)
+            return
+
+        self._outcomes.append((now, False))
+        self._trim(now)
+        if self.state == CLOSED and len(self._outcomes) >= Config.LLM_BREAKER_MIN_CALLS:
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if failures / len(self._outcomes) >= Config.LLM_BREAKER_ERROR_RATE:
+                self._open(now)
+
+    def release(self):
+        """A call ended without saying anything about the model's health
+        (e.g. it was cancelled): free the half-open probe slot."""
+        if self.state == HALF_OPEN:
+            self._probe_started = None
+
+    def _open(self, now: float):
+        print(f"⚠️ Circuit for {self.name} opened; failing fast for {Config.LLM_BREAKER_COOLDOWN}s")
+        self.state = OPEN
+        self._opened_at = now
+        self._probe_started = None
+        self._outcomes.clear()
+        self.times_opened += 1
+
+    def stats(self) -> Dict[str, Any]:
+        self._trim(time.monotonic())
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        return {
+            "state": self.state,
+            "window_calls": len(self._outcomes),
+            "window_failures": failures,
+            "times_opened": self.times_opened,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(name)
+    return _breakers[name]
+
+
+def breaker_stats() -> Dict[str, Any]:
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
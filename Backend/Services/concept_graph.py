@@ -0,0 +1,175 @@
+from typing import List, Dict, Optional
+from datetime import datetime
+from bson import ObjectId
+
+from Database.database import get_db
+from Services.concept_index import ConceptIndexService
+
+
+class ConceptGraphService:
+    MAX_BRANCHES = 6
+    MAX_SUB_BRANCHES = 4
+
+    @staticmethod
+    async def build_for_document(user_id: str, document_id: ObjectId, relationships: List[Dict]) -> int:
+        now = datetime.utcnow()
+        edges = []
+        seen = set()
+
+        for rel in relationships or []:
+            if not isinstance(rel, dict):
+                continue
+            source = str(rel.get("source", "")).strip()
+            target = str(rel.get("target", "")).strip()
+            relation = " ".join(str(rel.get("relation", "")).split()) or "related to"
+            source_key = ConceptIndexService.concept_key(source)
+            target_key = ConceptIndexService.concept_key(target)
+
+            if not source_key or not target_key or source_key == target_key:
+                continue
+            edge_id = (source_key, relation.casefold(), target_key)
+            if edge_id in seen:
+                continue
+            seen.add(edge_id)
+
+            edges.append({
+                "user_id": user_id,
+                "document_id": document_id,
+                "source_key": source_key,
+                "source": source,
+                "relation": relation,
+                "target_key": target_key,
+                "target": target,
+                "created_at": now
+            })
+
+        db = await get_db()
+        await db.concept_edges.delete_many({"user_id": user_id, "document_id": document_id})
+        if edges:
+            await db.concept_edges.insert_many(edges)
+
+        return len(edges)
+
+    @staticmethod
+    def _adjacency(edges: List[Dict]) -> Dict[str, Dict[str, Dict]]:
+        """Fold stored edges (from any number of documents) into an undirected
+        adjacency map: node key -> neighbor key -> merged edge info."""
+        adjacency: Dict[str, Dict[str, Dict]] = {}
+
+        for edge in edges:
+            statement = f"{edge['source']} {edge['relation']} {edge['target']}"
+            ends = (
+                (edge["source_key"], edge["target_key"], edge["target"]),
+                (edge["target_key"], edge["source_key"], edge["source"])
+            )
+            for node, neighbor_key, neighbor_name in ends:
+                info = adjacency.setdefault(node, {}).setdefault(neighbor_key, {
+                    "key": neighbor_key,
+                    "name": neighbor_name,
+                    "relations": [],
+                    "document_ids": set(),
+                    "weight": 0
+                })
+                if statement not in info["relations"]:
+                    info["relations"].append(statement)
+                info["document_ids"].add(str(edge["document_id"]))
+                info["weight"] += 1
+
+        return adjacency
+
+    @staticmethod
+    async def _find_edges(user_id: str, keys: List[str], document_id: Optional[str] = None) -> List[Dict]:
+        db = await get_db()
+        query = {
+            "user_id": user_id,
+            "$or": [{"source_key": {"$in": keys}}, {"target_key": {"$in": keys}}]
+        }
+        if document_id:
+            query["document_id"] = ObjectId(document_id)
+
+        cursor = db.concept_edges.find(
+            query,
+            {"_id": 0, "document_id": 1, "source_key": 1, "source": 1, "relation": 1, "target_key": 1, "target": 1}
+        )
+        return await cursor.to_list(length=None)
+
+    @staticmethod
+    async def get_neighborhood(user_id: str, concept: str, document_id: Optional[str] = None, depth: int = 2) -> Optional[Dict]:
+        """Neighbors of a concept merged across the user's library (or one
+        document), with an optional second hop. Returns None for unknown concepts."""
+        key = ConceptIndexService.concept_key(concept)
+        edges = await ConceptGraphService._find_edges(user_id, [key], document_id)
+        if not edges:
+            return None
+
+        adjacency = ConceptGraphService._adjacency(edges)
+        first_hop = sorted(adjacency.get(key, {}).values(), key=lambda n: -n["weight"])
+
+        second_hop: Dict[str, Dict[str, Dict]] = {}
+        if depth > 1 and first_hop:
+            neighbor_keys = [n["key"] for n in first_hop]
+            second_hop = ConceptGraphService._adjacency(
+                await ConceptGraphService._find_edges(user_id, neighbor_keys, document_id)
+            )
+
+        center_name = concept
+        for edge in edges:
+            if edge["source_key"] == key:
+                center_name = edge["source"]
+                break
+            if edge["target_key"] == key:
+                center_name = edge["target"]
+                break
+
+        neighbors = []
+        for neighbor in first_hop:
+            children = [
+                {"key": c["key"], "name": c["name"], "relations": c["relations"], "weight": c["weight"]}
+                for c in sorted(second_hop.get(neighbor["key"], {}).values(), key=lambda c: -c["weight"])
+                if c["key"] != key
+            ]
+            neighbors.append({
+                "key": neighbor["key"],
+                "name": neighbor["name"],
+                "relations": neighbor["relations"],
+                "weight": neighbor["weight"],
+                "document_ids": sorted(neighbor["document_ids"]),
+                "neighbors": children
+            })
+
+        return {"concept": center_name, "key": key, "neighbors": neighbors}
+
+    @staticmethod
+    async def build_mind_map(user_id: str, topic: str, document_id: Optional[str] = None) -> Optional[Dict]:
+        neighborhood = await ConceptGraphService.get_neighborhood(user_id, topic, document_id)
+        if not neighborhood or not neighborhood["neighbors"]:
+            return None
+
+        center = neighborhood["concept"]
+        mind_map = {
+            "central_topic": center,
+            "branches": []
+        }
+
+        for i, neighbor in enumerate(neighborhood["neighbors"][:ConceptGraphService.MAX_BRANCHES]):
+            sub_branches = []
+            for j, child in enumerate(neighbor["neighbors"][:ConceptGraphService.MAX_SUB_BRANCHES]):
+                sub_branches.append({
+                    "id": f"branch_{i+1}_{j+1}",
+                    "title": child["name"],
+                    "details": child["relations"][0]
+                })
+
+            mind_map["branches"].append({
+                "id": f"branch_{i+1}",
+                "title": neighbor["name"],
+                "details": "; ".join(neighbor["relations"]),
+                "sub_branches": sub_branches
+            })
+
+        return mind_map
+
+    @staticmethod
+    async def delete_document(user_id: str, document_id: ObjectId):
+        db = await get_db()
+        await db.concept_edges.delete_many({"user_id": user_id, "document_id": document_id})
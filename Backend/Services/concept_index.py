@@ -0,0 +1,120 @@
+from typing import List, Dict, Optional
+from datetime import datetime
+from bson import ObjectId
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+from Database.database import get_db
+
+
+class ConceptIndexService:
+    CHUNKS_PER_CONCEPT = 10
+
+    @staticmethod
+    def concept_key(name: str) -> str:
+        return " ".join(str(name).split()).casefold()
+
+    @staticmethod
+    async def build_for_document(
+        user_id: str,
+        document_id: ObjectId,
+        concepts: List[str],
+        chunk_ids: List[ObjectId],
+        tokenized_chunks: List[List[str]]
+    ) -> int:
+        """Rank the document's chunks against each extracted concept once at
+        ingest so topic lookups don't have to run BM25 at request time."""
+        if not concepts or not chunk_ids:
+            return 0
+
+        bm25 = BM25Okapi(tokenized_chunks)
+        now = datetime.utcnow()
+
+        entries = []
+        seen = set()
+        for concept in concepts:
+            key = ConceptIndexService.concept_key(concept)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+
+            scores = bm25.get_scores(key.split())
+            top_indices = np.argsort(scores)[::-1][:ConceptIndexService.CHUNKS_PER_CONCEPT]
+            ranked = [
+                {"chunk_id": chunk_ids[idx], "score": float(scores[idx])}
+                for idx in top_indices
+                if scores[idx] > 0
+            ]
+            if not ranked:
+                continue
+
+            entries.append({
+                "user_id": user_id,
+                "document_id": document_id,
+                "concept_key": key,
+                "concept_name": concept,
+                "chunks": ranked,
+                "created_at": now
+            })
+
+        db = await get_db()
+        await db.concept_chunks.delete_many({"user_id": user_id, "document_id": document_id})
+        if entries:
+            await db.concept_chunks.insert_many(entries)
+
+        return len(entries)
+
+    @staticmethod
+    async def get_context(user_id: str, document_id: str, topic: str, k: int = 10) -> Optional[List[Dict]]:
+        """Return the precomputed chunks for a known concept, or None when the
+        topic isn't one of the document's extracted concepts."""
+        db = await get_db()
+
+        pipeline = [
+            {"$match": {
+                "user_id": user_id,
+                "document_id": ObjectId(document_id),
+                "concept_key": ConceptIndexService.concept_key(topic)
+            }},
+            {"$limit": 1},
+            {"$project": {"chunks": {"$slice": ["$chunks", k]}}},
+            {"$lookup": {
+                "from": "document_chunks",
+                "localField": "chunks.chunk_id",
+                "foreignField": "_id",
+                "as": "chunk_docs"
+            }}
+        ]
+
+        entries = await db.concept_chunks.aggregate(pipeline).to_list(length=1)
+        if not entries:
+            return None
+
+        entry = entries[0]
+        chunk_map = {c["_id"]: c for c in entry.get("chunk_docs", [])}
+
+        return [
+            {
+                "content": chunk_map[c["chunk_id"]]["text"],
+                "score": c["score"],
+                "chunk_id": str(c["chunk_id"]),
+                "chunk_index": chunk_map[c["chunk_id"]].get("chunk_index")
+            }
+            for c in entry.get("chunks", [])
+            if c["chunk_id"] in chunk_map
+        ]
+
+    @staticmethod
+    async def find_context(user_id: str, document_id: str, topic: str, k: int = 10) -> List[Dict]:
+        results = await ConceptIndexService.get_context(user_id, document_id, topic, k=k)
+        if results is not None:
+            return results
+
+        from Services.persistent_vector_store import PersistentVectorStore
+        store = PersistentVectorStore()
+        return await store.search_bm25(user_id, topic, k=k, document_id=document_id)
+
+    @staticmethod
+    async def delete_document(user_id: str, document_id: ObjectId):
+        db = await get_db()
+        await db.concept_chunks.delete_many({"user_id": user_id, "document_id": document_id})
@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from config import Config
+from Database.database import get_db
+from Services.context_packer import estimate_tokens, pack_context
+from Services.memory_cache import MemoryCache
+
+
+class ContextHandle:
+    """A reusable prompt prefix: a retrieved chunk set plus where it's cached.
+
+    ``contents`` is kept alongside the handle so a call can always fall back
+    to sending the prefix inline (local backend, or an expired server cache).
+    """
+
+    def __init__(self, key: str, name: str, model: str, backend: str, contents: str,
+                 chunk_ids: List[str], expires_at: datetime):
+        self.key = key
+        self.name = name
+        self.model = model
+        self.backend = backend
+        self.contents = contents
+        self.chunk_ids = set(chunk_ids)
+        self.expires_at = expires_at
+
+    @property
+    def is_local(self) -> bool:
+        return self.backend == "local"
+
+
+class LocalContextBackend:
+    """Stand-in for tests and development: "caches" nothing server-side, and
+    the gateway inlines the contents in front of the prompt."""
+
+    name = "local"
+
+    async def create(self, model: str, contents: str, ttl: int, display_name: str) -> str:
+        return "local/" + hashlib.sha256(contents.encode("utf-8")).hexdigest()[:16]
+
+    async def delete(self, name: str):
+        pass
+
+
+class GeminiContextBackend:
+    name = "gemini"
+
+    async def create(self, model: str, contents: str, ttl: int, display_name: str) -> str:
+        from google.generativeai import caching
+
+        cached = await asyncio.to_thread(
+            caching.CachedContent.create,
+            model=model,
+            display_name=display_name[:128],
+            contents=[contents],
+            ttl=timedelta(seconds=ttl),
+        )
+        return cached.name
+
+    async def delete(self, name: str):
+        from google.generativeai import caching
+
+        try:
+            await asyncio.to_thread(lambda: caching.CachedContent.get(name).delete())
+        except Exception as e:
+            print(f"Context cache delete failed for {name}: {e}")
+
+
+_BACKENDS = {"local": LocalContextBackend, "gemini": GeminiContextBackend}
+
+
+class ContextCacheService:
+    _backend = None
+    _handles = MemoryCache(256)
+    _failures = MemoryCache(256, Config.CONTEXT_CACHE_RETRY_AFTER)
+    # One entry per chunk set, so bounded like the handles themselves.
+    _locks = MemoryCache(256)
+    _stats = {"created": 0, "reused": 0, "too_small": 0, "failures": 0}
+
+    @staticmethod
+    def backend():
+        if ContextCacheService._backend is None and Config.CONTEXT_CACHE_BACKEND in _BACKENDS:
+            ContextCacheService._backend = _BACKENDS[Config.CONTEXT_CACHE_BACKEND]()
+        return ContextCacheService._backend
+
+    @staticmethod
+    def build_key(document_id: str, chunk_ids: List[str], model: str) -> str:
+        raw = f"{document_id}|{model}|{','.join(sorted(chunk_ids))}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _contents(context_results: List[Dict]) -> str:
+        """The chunks in document order, packed to the cache budget. Scores
+        are dropped so a chunk set always packs to the same text, whatever
+        query retrieved it."""
+        ordered = sorted(context_results, key=lambda r: (r.get("chunk_index") is None, r.get("chunk_index") or 0, r["chunk_id"]))
+        packed = pack_context([{"content": r.get("content", "")} for r in ordered], Config.CONTEXT_CACHE_MAX_TOKENS)
+        return "Document excerpt:\n\n" + packed if packed else ""
+
+    @staticmethod
+    async def get_handle(user_id: str, document_id: str, context_results: List[Dict],
+                         task: str = "qa") -> Optional[ContextHandle]:
+        """Return a live cached-context handle for this (document, retrieved
+        chunk set), creating one if needed, or None when caching is off, the
+        chunks are too small to be worth it, or the backend recently failed."""
+        backend = ContextCacheService.backend()
+        if backend is None:
+            return None
+
+        context_results = [r for r in context_results if r.get("chunk_id") and r.get("content")]
+        chunk_ids = sorted({r["chunk_id"] for r in context_results})
+        if not chunk_ids:
+            return None
+
+        from Services.llm_gateway import resolve_models
+        model = resolve_models(task)[0]
+
+        key = ContextCacheService.build_key(document_id, chunk_ids, model)
+        if ContextCacheService._failures.get(key):
+            return None
+
+        contents = ContextCacheService._contents(context_results)
+        if estimate_tokens(contents) < Config.CONTEXT_CACHE_MIN_TOKENS:
+            ContextCacheService._stats["too_small"] += 1
+            return None
+
+        lock = ContextCacheService._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            ContextCacheService._locks.set(key, lock)
+        async with lock:
+            handle = await ContextCacheService._lookup(key, contents)
+            if handle:
+                ContextCacheService._stats["reused"] += 1
+                return handle
+
+            try:
+                name = await backend.create(model, contents, Config.CONTEXT_CACHE_TTL, f"luma-{document_id}")
+            except Exception as e:
+                ContextCacheService._stats["failures"] += 1
+                ContextCacheService._failures.set(key, True)
+                print(f"⚠️ Context cache create failed for document {document_id}: {e}")
+                return None
+
+            handle = ContextHandle(
+                key, name, model, backend.name, contents, chunk_ids,
+                datetime.utcnow() + timedelta(seconds=Config.CONTEXT_CACHE_TTL)
+            )
+            await ContextCacheService._remember(handle, user_id, document_id)
+            ContextCacheService._stats["created"] += 1
+            return handle
+
+    @staticmethod
+    async def _lookup(key: str, contents: str) -> Optional[ContextHandle]:
+        # Stop handing out a handle a little before the server drops it, so a
+        # turn started now doesn't reference an expired cache.
+        usable_until = datetime.utcnow() + timedelta(seconds=Config.CONTEXT_CACHE_EXPIRY_MARGIN)
+
+        handle = ContextCacheService._handles.get(key)
+        if handle and handle.expires_at > usable_until:
+            return handle
+
+        db = await get_db()
+        entry = await db.context_cache_handles.find_one({"_id": key, "expires_at": {"$gt": usable_until}})
+        if not entry or entry.get("backend") != ContextCacheService.backend().name:
+            return None
+
+        handle = ContextHandle(
+            key, entry["name"], entry["model"], entry["backend"], contents,
+            entry.get("chunk_ids", []), entry["expires_at"]
+        )
+        ContextCacheService._handles.set(key, handle)
+        return handle
+
+    @staticmethod
+    async def _remember(handle: ContextHandle, user_id: str, document_id: str):
+        ContextCacheService._handles.set(handle.key, handle)
+        db = await get_db()
+        await db.context_cache_handles.update_one(
+            {"_id": handle.key},
+            {"$set": {
+                "user_id": user_id,
+                "document_id": document_id,
+                "name": handle.name,
+                "model": handle.model,
+                "backend": handle.backend,
+                "chunk_ids": sorted(handle.chunk_ids),
+                "expires_at": handle.expires_at
+            }},
+            upsert=True
+        )
+
+    @staticmethod
+    def forget(handle: ContextHandle):
+        """Drop a handle the server no longer recognises."""
+        ContextCacheService._handles.pop(handle.key)
+        ContextCacheService._failures.set(handle.key, True)
+
+    @staticmethod
+    async def invalidate_document(user_id: str, document_id: str):
+        db = await get_db()
+        entries = await db.context_cache_handles.find(
+            {"user_id": user_id, "document_id": str(document_id)}
+        ).to_list(length=None)
+        backend = ContextCacheService.backend()
+        for entry in entries:
+            ContextCacheService._handles.pop(entry["_id"])
+            if backend and entry.get("backend") == backend.name:
+                await backend.delete(entry["name"])
+        await db.context_cache_handles.delete_many({"user_id": user_id, "document_id": str(document_id)})
+
+    @staticmethod
+    def stats() -> Dict:
+        stats = dict(ContextCacheService._stats)
+        stats["backend"] = Config.CONTEXT_CACHE_BACKEND
+        return stats
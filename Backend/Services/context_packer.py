@@ -0,0 +1,87 @@
+from typing import Dict, List, Union
+
+from Services.chunking_service import TextChunker
+
+_sentence_splitter = TextChunker()
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English prose; close enough for budgeting
+    # without a round trip to the tokenizer.
+    return (len(text) + 3) // 4
+
+
+def _sentence_key(sentence: str) -> str:
+    return " ".join(sentence.split()).casefold()
+
+
+def _as_results(chunks: List[Union[str, Dict]]) -> List[Dict]:
+    results = []
+    for rank, chunk in enumerate(chunks):
+        if isinstance(chunk, str):
+            chunk = {"content": chunk}
+        if not chunk.get("content"):
+            continue
+        results.append({**chunk, "score": chunk.get("score", 0.0), "_rank": rank})
+    return results
+
+
+def pack_context(chunks: List[Union[str, Dict]], token_budget: int, separator: str = "\n\n") -> str:
+    """Fill ``token_budget`` with whole chunks, highest score first.
+
+    Sentences already taken from a higher-ranked chunk (the sentence overlap
+    TextChunker carries between neighbours) are dropped and don't count
+    against the budget. Chunks that don't fit are skipped in favour of
+    smaller ones further down. The packed chunks are returned in document
+    order when ``chunk_index`` is known, otherwise in retrieval order. Only
+    when not even the top chunk fits is it cut, at a sentence boundary.
+    """
+    results = _as_results(chunks)
+    if not results or token_budget <= 0:
+        return ""
+
+    ranked = sorted(results, key=lambda r: (-r["score"], r["_rank"]))
+    seen = set()
+    packed = []
+    used = 0
+
+    for result in ranked:
+        novel = []
+        for sentence in _sentence_splitter.split_into_sentences(result["content"]):
+            key = _sentence_key(sentence)
+            if key and key not in seen:
+                novel.append((key, sentence))
+        if not novel:
+            continue
+
+        text = " ".join(sentence for _, sentence in novel)
+        cost = estimate_tokens(text) + (estimate_tokens(separator) if packed else 0)
+        if used + cost > token_budget:
+            continue
+
+        seen.update(key for key, _ in novel)
+        packed.append((result, text))
+        used += cost
+
+    if not packed:
+        return _cut_to_budget(ranked[0]["content"], token_budget)
+
+    packed.sort(key=lambda p: (
+        str(p[0].get("document_id", "")),
+        p[0]["chunk_index"] if p[0].get("chunk_index") is not None else p[0]["_rank"]
+    ))
+    return separator.join(text for _, text in packed)
+
+
+def _cut_to_budget(text: str, token_budget: int) -> str:
+    kept = []
+    used = 0
+    for sentence in _sentence_splitter.split_into_sentences(text):
+        cost = estimate_tokens(sentence) + (1 if kept else 0)
+        if used + cost > token_budget:
+            break
+        kept.append(sentence)
+        used += cost
+    if kept:
+        return " ".join(kept)
+    return text[:token_budget * 4]
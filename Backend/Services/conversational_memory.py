@@ -1,10 +1,77 @@
-from typing import List, Dict, Optional
+import asyncio
+import re
+from collections import Counter
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
+from pymongo import ReturnDocument
+from config import Config
 from Database.database import get_db
+from Services.question_cache import STOPWORDS
+
+FOLLOWUP_WORDS = {'it', 'this', 'that', 'they', 'them', 'its', 'more', 'explain'}
+
+
+def _format_history(history: List[Dict]) -> str:
+    if not history:
+        return "No previous conversation."
+    
+    context_parts = ["Previous conversation:"]
+    for msg in history:
+        role = "User" if msg["role"] == "user" else "Assistant"
+        context_parts.append(f"{role}: {msg['content']}")
+    
+    return "\n".join(context_parts)
+
+
+def expansion_terms(query: str, history: List[Dict], limit: int) -> List[str]:
+    """The ``limit`` strongest keywords from the recent messages that the
+    query doesn't already contain. The user's own words count double: they
+    name the topic, while answers mostly elaborate on it."""
+    query_words = set(re.findall(r"\w+", query.lower()))
+    weights = Counter()
+    for msg in history:
+        weight = 2 if msg["role"] == "user" else 1
+        for word in re.findall(r"\w+", msg["content"].lower()):
+            if len(word) > 2 and not word.isdigit() and word not in STOPWORDS and word not in query_words:
+                weights[word] += weight
+    return [word for word, _ in weights.most_common(limit)]
+
+
+def _followup_terms(query: str, history: List[Dict]) -> List[str]:
+    """Keywords to add to a follow-up question's retrieval, or [] when the
+    question reads as standalone."""
+    if len(history) < 2:
+        return []
+    
+    words = query.lower().split()
+    is_followup = len(words) < 5 or any(word.strip("?.,!") in FOLLOWUP_WORDS for word in words)
+    if not is_followup:
+        return []
+    
+    return expansion_terms(query, history[-2:], Config.CHAT_QUERY_EXPANSION_TERMS)
+
+
+def _expand_followup(query: str, history: List[Dict]) -> str:
+    terms = _followup_terms(query, history)
+    return f"{query} {' '.join(terms)}" if terms else query
 
 
 class ChatSessionService:
+    """Chat sessions keyed by user and document.
+
+    The session document keeps only a capped ``recent`` window (enough for
+    prompt context) plus the running ``message_count``. The full transcript
+    lives in ``chat_messages`` buckets of BUCKET_SIZE messages, each message
+    tagged with its sequence number, so both the per-turn window read and a
+    history page cost the same however long the session gets.
+    """
     MEMORY_WINDOW = 10
+    RECENT_SIZE = 20
+    BUCKET_SIZE = 50
+    
+    _summarizing = set()
+    _background = set()
+    
     def _build_session_id(user_id: str, document_id: str) -> str:
         return f"{user_id}_{document_id}"
     
@@ -27,7 +94,7 @@ class ChatSessionService:
             "_id": session_id,
             "user_id": user_id,
             "document_id": document_id,
-            "messages": [],
+            "recent": [],
             "message_count": 0,
             "created_at": datetime.utcnow(),
             "last_active": datetime.utcnow()
@@ -38,105 +105,289 @@ class ChatSessionService:
     
     @staticmethod
     async def add_message(user_id: str, document_id: str, role: str, content: str):
+        await ChatSessionService._append(user_id, document_id, [
+            {"role": role, "content": content, "timestamp": datetime.utcnow()}
+        ])
+    
+    @staticmethod
+    async def add_exchange(user_id: str, document_id: str, user_message: str, ai_response: str):
+        now = datetime.utcnow()
+        return await ChatSessionService._append(user_id, document_id, [
+            {"role": "user", "content": user_message, "timestamp": now},
+            {"role": "assistant", "content": ai_response, "timestamp": now}
+        ])
+    
+    @staticmethod
+    async def _append(user_id: str, document_id: str, messages: List[Dict]) -> int:
+        """Append messages and return the session's new message count."""
         db = await get_db()
         
         session_id = ChatSessionService._build_session_id(user_id, document_id)
+        now = messages[-1]["timestamp"]
         
-        message = {
-            "role": role,
-            "content": content,
-            "timestamp": datetime.utcnow()
-        }
-        
-        await db.chat_sessions.update_one(
+        # One round trip bumps the counter (which hands out sequence numbers)
+        # and pushes onto the capped window. The zero-length slice only tells
+        # us whether a pre-bucket ``messages`` array is still around.
+        session = await db.chat_sessions.find_one_and_update(
             {"_id": session_id, "user_id": user_id, "document_id": document_id},
             {
-                "$push": {"messages": message},
-                "$inc": {"message_count": 1},
-                "$set": {"last_active": datetime.utcnow()}
+                "$push": {"recent": {"$each": messages, "$slice": -ChatSessionService.RECENT_SIZE}},
+                "$inc": {"message_count": len(messages)},
+                "$set": {"last_active": now},
+                "$setOnInsert": {"created_at": now}
             },
-            upsert=True
+            projection={"message_count": 1, "messages": {"$slice": 0}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
+        
+        first_seq = session["message_count"] - len(messages)
+        await ChatSessionService._write_buckets(session_id, user_id, document_id, first_seq, messages)
+        
+        if "messages" in session:
+            await ChatSessionService._migrate_legacy(session_id, user_id, document_id, first_seq)
+        
+        return session["message_count"]
     
     @staticmethod
-    async def add_exchange(user_id: str, document_id: str, user_message: str, ai_response: str):
+    async def _write_buckets(session_id: str, user_id: str, document_id: str, first_seq: int, messages: List[Dict]):
         db = await get_db()
         
-        session_id = ChatSessionService._build_session_id(user_id, document_id)
+        by_bucket: Dict[int, List[Dict]] = {}
+        for offset, message in enumerate(messages):
+            seq = first_seq + offset
+            by_bucket.setdefault(seq // ChatSessionService.BUCKET_SIZE, []).append({**message, "seq": seq})
+        
+        for bucket, bucket_messages in by_bucket.items():
+            await db.chat_messages.update_one(
+                {"_id": f"{session_id}:{bucket}"},
+                {
+                    "$push": {"messages": {"$each": bucket_messages}},
+                    "$setOnInsert": {
+                        "session_id": session_id,
+                        "user_id": user_id,
+                        "document_id": document_id,
+                        "bucket": bucket,
+                        "created_at": bucket_messages[0].get("timestamp") or datetime.utcnow()
+                    }
+                },
+                upsert=True
+            )
+    
+    @staticmethod
+    async def _migrate_legacy(session_id: str, user_id: str, document_id: str, legacy_end: int):
+        """Move a session written before bucketing into buckets: its old
+        ``messages`` array holds the sequence numbers just before legacy_end."""
+        db = await get_db()
         
-        now = datetime.utcnow()
-        messages = [
-            {"role": "user", "content": user_message, "timestamp": now},
-            {"role": "assistant", "content": ai_response, "timestamp": now}
-        ]
+        session = await db.chat_sessions.find_one_and_update(
+            {"_id": session_id, "messages": {"$exists": True}},
+            {"$unset": {"messages": ""}},
+            projection={"messages": 1}
+        )
+        if not session:
+            return
+        
+        legacy = (session.get("messages") or [])[-legacy_end:] if legacy_end > 0 else []
+        if not legacy:
+            return
+        first_seq = legacy_end - len(legacy)
         
+        await ChatSessionService._write_buckets(session_id, user_id, document_id, first_seq, legacy)
         await db.chat_sessions.update_one(
-            {"_id": session_id, "user_id": user_id, "document_id": document_id},
-            {
-                "$push": {"messages": {"$each": messages}},
-                "$inc": {"message_count": 2},
-                "$set": {"last_active": now},
-                "$setOnInsert": {"created_at": now, "document_id": document_id}
-            },
-            upsert=True
+            {"_id": session_id},
+            {"$push": {"recent": {
+                "$each": legacy[-ChatSessionService.RECENT_SIZE:],
+                "$position": 0,
+                "$slice": -ChatSessionService.RECENT_SIZE
+            }}}
         )
     
     @staticmethod
     async def get_history(user_id: str, document_id: str, limit: int = None) -> List[Dict]:
+        """The last ``limit`` messages (at most RECENT_SIZE), read from the
+        session's capped window."""
         db = await get_db()
         
         session_id = ChatSessionService._build_session_id(user_id, document_id)
+        window = min(limit or ChatSessionService.RECENT_SIZE, ChatSessionService.RECENT_SIZE)
         
         session = await db.chat_sessions.find_one(
             {"_id": session_id, "user_id": user_id, "document_id": document_id},
-            {"messages": 1}
+            {"recent": {"$slice": -window}, "messages": {"$slice": -window}}
         )
         
-        if not session or "messages" not in session:
+        if not session:
             return []
         
-        messages = session["messages"]
-        
-        if limit:
-            messages = messages[-limit:]
+        messages = session.get("recent") or session.get("messages") or []
         
         return [{"role": m["role"], "content": m["content"]} for m in messages]
     
+    @staticmethod
+    async def get_history_page(user_id: str, document_id: str, limit: int = 50,
+                               before: Optional[int] = None) -> Tuple[List[Dict], Optional[int]]:
+        """Up to ``limit`` messages older than sequence number ``before``
+        (newest page when omitted), oldest first, plus the cursor for the
+        next older page or None at the start of the session."""
+        db = await get_db()
+        
+        session_id = ChatSessionService._build_session_id(user_id, document_id)
+        
+        query = {"session_id": session_id, "user_id": user_id}
+        if before is not None:
+            if before <= 0:
+                return [], None
+            query["bucket"] = {"$lte": (before - 1) // ChatSessionService.BUCKET_SIZE}
+        
+        bucket_count = limit // ChatSessionService.BUCKET_SIZE + 2
+        buckets = await db.chat_messages.find(query, {"messages": 1}).sort(
+            "bucket", -1
+        ).limit(bucket_count).to_list(length=bucket_count)
+        
+        if buckets:
+            messages = [m for bucket in buckets for m in bucket.get("messages", [])]
+        else:
+            # Not migrated yet: the next append moves it into buckets.
+            messages = await ChatSessionService._legacy_messages(session_id, user_id)
+        messages = [m for m in messages if before is None or m["seq"] < before]
+        messages.sort(key=lambda m: m["seq"])
+        messages = messages[-limit:]
+        
+        next_cursor = messages[0]["seq"] if messages and messages[0]["seq"] > 0 else None
+        page = [
+            {
+                "seq": m["seq"],
+                "role": m["role"],
+                "content": m["content"],
+                "timestamp": m["timestamp"].isoformat() if m.get("timestamp") else None
+            }
+            for m in messages
+        ]
+        return page, next_cursor
+    
+    @staticmethod
+    async def _legacy_messages(session_id: str, user_id: str) -> List[Dict]:
+        """A pre-bucket session's ``messages`` array, tagged with the sequence
+        numbers it holds (those ending at message_count)."""
+        db = await get_db()
+        session = await db.chat_sessions.find_one(
+            {"_id": session_id, "user_id": user_id, "messages": {"$exists": True}},
+            {"messages": 1, "message_count": 1}
+        )
+        legacy = (session or {}).get("messages") or []
+        if not legacy:
+            return []
+        first_seq = max(0, session.get("message_count", len(legacy)) - len(legacy))
+        return [{**m, "seq": first_seq + offset} for offset, m in enumerate(legacy)]
+    
     @staticmethod
     async def get_context_string(user_id: str, document_id: str) -> str:
         history = await ChatSessionService.get_history(
             user_id, document_id, 
             limit=ChatSessionService.MEMORY_WINDOW
         )
-        
-        if not history:
-            return "No previous conversation."
-        
-        context_parts = ["Previous conversation:"]
-        for msg in history:
-            role = "User" if msg["role"] == "user" else "Assistant"
-            context_parts.append(f"{role}: {msg['content']}")
-        
-        return "\n".join(context_parts)
+        return _format_history(history)
     
     @staticmethod
     async def enhance_query(query: str, user_id: str, document_id: str) -> str:
         history = await ChatSessionService.get_history(user_id, document_id, limit=4)
+        return _expand_followup(query, history)
+    
+    @staticmethod
+    async def load_turn(user_id: str, document_id: str) -> "ChatTurn":
+        db = await get_db()
+        
+        session_id = ChatSessionService._build_session_id(user_id, document_id)
+        window = ChatSessionService.MEMORY_WINDOW
         
-        if not history:
-            return query
+        session = await db.chat_sessions.find_one(
+            {"_id": session_id, "user_id": user_id, "document_id": document_id},
+            {
+                "recent": {"$slice": -window},
+                "messages": {"$slice": -window},
+                "message_count": 1,
+                "summary": 1,
+                "summary_through": 1
+            }
+        ) or {}
         
-        is_followup = (
-            len(query.split()) < 5 or
-            any(word in query.lower() for word in ['it', 'this', 'that', 'they', 'them', 'its', 'more', 'explain'])
+        history = [
+            {"role": m["role"], "content": m["content"]}
+            for m in session.get("recent") or session.get("messages") or []
+        ]
+        return ChatTurn(
+            user_id, document_id, history,
+            message_count=session.get("message_count", len(history)),
+            summary=session.get("summary", ""),
+            summary_through=session.get("summary_through", 0)
         )
+    
+    @staticmethod
+    def schedule_summary(user_id: str, document_id: str):
+        """Refresh the session's rolling summary in the background, unless a
+        refresh for it is already running in this process."""
+        session_id = ChatSessionService._build_session_id(user_id, document_id)
+        if session_id in ChatSessionService._summarizing:
+            return
+        ChatSessionService._summarizing.add(session_id)
         
-        if is_followup and len(history) >= 2:
-            recent = history[-2:]
-            context = " ".join([msg["content"] for msg in recent])
-            return f"{context} {query}"
+        task = asyncio.ensure_future(ChatSessionService._refresh_summary(user_id, document_id))
+        ChatSessionService._background.add(task)
         
-        return query
+        def _done(t):
+            ChatSessionService._background.discard(t)
+            ChatSessionService._summarizing.discard(session_id)
+        task.add_done_callback(_done)
+    
+    @staticmethod
+    async def _refresh_summary(user_id: str, document_id: str):
+        """Fold the messages older than the last CHAT_RECENT_TURNS turns into
+        the summary. Only the messages since the previous refresh are sent to
+        the model, together with the previous summary, oldest first and at
+        most CHAT_SUMMARY_BATCH_MAX per refresh; a longer backlog is caught up
+        by the next refreshes."""
+        from Services.gemini_client import summarize_conversation
+        
+        try:
+            db = await get_db()
+            session_id = ChatSessionService._build_session_id(user_id, document_id)
+            session = await db.chat_sessions.find_one(
+                {"_id": session_id},
+                {"message_count": 1, "summary": 1, "summary_through": 1, "generation": 1}
+            )
+            if not session:
+                return
+            
+            summary_through = session.get("summary_through", 0)
+            target = session.get("message_count", 0) - 2 * Config.CHAT_RECENT_TURNS
+            if target <= summary_through:
+                return
+            
+            limit = min(target - summary_through, Config.CHAT_SUMMARY_BATCH_MAX)
+            messages, _ = await ChatSessionService.get_history_page(
+                user_id, document_id, limit=limit, before=summary_through + limit
+            )
+            messages = [m for m in messages if m["seq"] >= summary_through]
+            if not messages:
+                return
+            
+            summary = await summarize_conversation(session.get("summary", ""), messages)
+            if not summary:
+                return
+            
+            # Skip the write if the session was cleared (which bumps its
+            # generation) or another refresh got there first.
+            await db.chat_sessions.update_one(
+                {
+                    "_id": session_id,
+                    "generation": session.get("generation", {"$exists": False}),
+                    "summary_through": session.get("summary_through", {"$exists": False})
+                },
+                {"$set": {"summary": summary, "summary_through": messages[-1]["seq"] + 1}}
+            )
+        except Exception as e:
+            print(f"⚠️ Chat summary refresh failed for {user_id}/{document_id}: {e}")
     
     @staticmethod
     async def clear_session(user_id: str, document_id: str):
@@ -148,18 +399,22 @@ class ChatSessionService:
             {"_id": session_id, "user_id": user_id, "document_id": document_id},
             {
                 "$set": {
-                    "messages": [],
+                    "recent": [],
                     "message_count": 0,
                     "last_active": datetime.utcnow()
-                }
+                },
+                "$inc": {"generation": 1},
+                "$unset": {"messages": "", "summary": "", "summary_through": ""}
             }
         )
+        await db.chat_messages.delete_many({"session_id": session_id, "user_id": user_id})
     
     @staticmethod
     async def delete_session(user_id: str, document_id: str):
         db = await get_db()
         session_id = ChatSessionService._build_session_id(user_id, document_id)
         await db.chat_sessions.delete_one({"_id": session_id, "user_id": user_id, "document_id": document_id})
+        await db.chat_messages.delete_many({"session_id": session_id, "user_id": user_id})
     
     @staticmethod
     async def get_user_sessions(user_id: str, limit: int = 10) -> List[Dict]:
@@ -192,7 +447,7 @@ class ChatSessionService:
         
         session = await db.chat_sessions.find_one(
             {"_id": session_id, "user_id": user_id, "document_id": document_id},
-            {"messages": 0}  # Exclude messages for performance
+            {"recent": 0, "messages": 0}  # Exclude messages for performance
         )
         
         if not session:
@@ -207,3 +462,54 @@ class ChatSessionService:
             "created_at": session.get("created_at").isoformat() if session.get("created_at") else None
         }
 
+
+
+class ChatTurn:
+    """One chat request's view of its session.
+
+    The session is read once when the turn is loaded and shared by query
+    enhancement and prompt building. Prompts carry the rolling summary plus
+    the last CHAT_RECENT_TURNS turns verbatim, rather than a raw window of
+    long answers.
+    """
+
+    def __init__(self, user_id: str, document_id: str, history: List[Dict],
+                 message_count: int = 0, summary: str = "", summary_through: int = 0):
+        self.user_id = user_id
+        self.document_id = document_id
+        self.history = history
+        self.message_count = message_count
+        self.summary = summary
+        self.summary_through = summary_through
+    
+    def unsummarized(self) -> List[Dict]:
+        # ``history`` is the tail of the session, ending at message_count.
+        first_seq = self.message_count - len(self.history)
+        return self.history[max(0, self.summary_through - first_seq):]
+    
+    def followup_terms(self, query: str) -> List[str]:
+        return _followup_terms(query, self.history[-4:])
+    
+    def _recent_tail(self, messages: List[Dict]) -> List[Dict]:
+        # Older messages are left to the summary, including ones the next
+        # refresh hasn't folded in yet.
+        size = 2 * Config.CHAT_RECENT_TURNS
+        return messages[-size:] if size > 0 else []
+    
+    def context_string(self) -> str:
+        if not self.summary:
+            return _format_history(self._recent_tail(self.history))
+        
+        recent = self._recent_tail(self.unsummarized())
+        parts = ["Conversation summary:", self.summary]
+        if recent:
+            parts.append("")
+            parts.append(_format_history(recent).replace("Previous conversation:", "Most recent messages:", 1))
+        return "\n".join(parts)
+    
+    async def record(self, question: str, answer: str):
+        self.message_count = await ChatSessionService.add_exchange(self.user_id, self.document_id, question, answer)
+        
+        due = 2 * (Config.CHAT_RECENT_TURNS + Config.CHAT_SUMMARY_EVERY_TURNS)
+        if self.message_count - self.summary_through >= due:
+            ChatSessionService.schedule_summary(self.user_id, self.document_id)
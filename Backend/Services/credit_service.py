@@ -1,8 +1,15 @@
 from Database.database import get_db
 from fastapi import HTTPException, status
-from datetime import datetime
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from config import Config
+import asyncio
 import uuid
 
+RESERVED = "reserved"
+COMMITTED = "committed"
+REFUNDED = "refunded"
+
 class CreditService:
     DEFAULT_CREDITS = 100
     
@@ -15,8 +22,10 @@ class CreditService:
 
     @staticmethod
     async def get_user_stats(uid: str):
+        from Services.user_stats import UserStatsService
+        
         db = await get_db()
-        user = await db.users.find_one({"_id": uid})
+        user = await UserStatsService.get(uid)
         if not user:
             return None
             
@@ -26,7 +35,9 @@ class CreditService:
             "credits": user.get("credits", CreditService.DEFAULT_CREDITS),
             "plan": user.get("plan", "free"),
             "total_usage": user.get("total_usage", {}),
-            "days_until_reset": CreditService.get_days_until_reset(user)
+            "days_until_reset": CreditService.get_days_until_reset(user),
+            "quiz_average": UserStatsService.quiz_average(user),
+            "recent_activity": user.get("recent_activity", [])
         }
 
     @staticmethod
@@ -44,7 +55,7 @@ class CreditService:
         
         if delta.days >= 30:
             new_reset_date = now
-            await db.users.update_one(
+            await db.user_stats.update_one(
                 {"_id": user["_id"]},
                 {
                     "$set": {
@@ -69,7 +80,6 @@ class CreditService:
             except:
                 last_reset = now
                 
-        from datetime import timedelta
         next_reset = last_reset + timedelta(days=30)
         
         days_left = (next_reset - now).days
@@ -77,37 +87,49 @@ class CreditService:
 
     @staticmethod
     async def check_and_deduct(uid: str, action: str) -> str:
+        """Reserve the action's cost: record the reservation in the credit
+        ledger, then decrement the balance counter. Returns the transaction
+        id to commit or refund once the work finishes.
+
+        The ledger entry goes first so a crash between the two writes can
+        only refund a credit that was never taken (the sweeper settles the
+        entry), never take one that nothing will give back."""
         cost = CreditService.COSTS.get(action, 0)
         if cost == 0:
             return None
 
         db = await get_db()
         transaction_id = str(uuid.uuid4())
+        now = datetime.utcnow()
         
-        result = await db.users.update_one(
-            {
-                "_id": uid, 
-                "credits": {"$gte": cost}
-            },
-            {
-                "$inc": {
-                    "credits": -cost,
-                    f"total_usage.{action}": 1
-                },
-                "$set": {"last_activity": datetime.utcnow()},
-                "$push": {
-                    "pending_transactions": {
-                        "id": transaction_id,
-                        "action": action,
-                        "cost": cost,
-                        "created_at": datetime.utcnow()
-                    }
-                }
-            }
-        )
-
+        await db.credit_ledger.insert_one({
+            "_id": transaction_id,
+            "user_id": uid,
+            "action": action,
+            "cost": cost,
+            "status": RESERVED,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=Config.CREDIT_RESERVATION_TTL)
+        })
+        
+        try:
+            result = await CreditService._reserve(db, uid, action, cost, now)
+            if result.modified_count == 0:
+                user = await db.user_stats.find_one({"_id": uid}, {"credits": 1})
+                if not user:
+                    # No stats document yet: seed it from the user record and retry.
+                    from Services.user_stats import UserStatsService
+                    await UserStatsService.ensure(uid)
+                    result = await CreditService._reserve(db, uid, action, cost, now)
+                    user = await db.user_stats.find_one({"_id": uid}, {"credits": 1})
+        except BaseException:
+            await db.credit_ledger.delete_one({"_id": transaction_id, "status": RESERVED})
+            raise
+            
         if result.modified_count == 0:
-            user = await db.users.find_one({"_id": uid})
+            # Nothing was charged; drop the reservation so the sweeper
+            # doesn't refund it.
+            await db.credit_ledger.delete_one({"_id": transaction_id, "status": RESERVED})
             if not user:
                 raise HTTPException(status_code=404, detail="User not found")
             
@@ -119,21 +141,81 @@ class CreditService:
             
         return transaction_id
 
+    @staticmethod
+    async def _reserve(db, uid: str, action: str, cost: int, now: datetime):
+        return await db.user_stats.update_one(
+            {
+                "_id": uid, 
+                "credits": {"$gte": cost}
+            },
+            {
+                "$inc": {
+                    "credits": -cost,
+                    f"total_usage.{action}": 1
+                },
+                "$set": {"last_activity": now}
+            }
+        )
+
     @staticmethod
     async def complete_transaction(uid: str, transaction_id: str):
         if not transaction_id:
             return
             
         db = await get_db()
-        await db.users.update_one(
-            {"_id": uid},
-            {
-                "$pull": {
-                    "pending_transactions": {"id": transaction_id}
-                }
-            }
+        result = await db.credit_ledger.update_one(
+            {"_id": transaction_id, "user_id": uid, "status": RESERVED},
+            {"$set": {"status": COMMITTED, "settled_at": datetime.utcnow()}}
+        )
+        if result.matched_count == 0:
+            await CreditService._recharge(db, uid, transaction_id)
+
+    @staticmethod
+    async def _recharge(db, uid: str, transaction_id: str):
+        """The work finished after the sweeper had already refunded its
+        reservation as abandoned: take the credit again, if it's still there."""
+        entry = await db.credit_ledger.find_one_and_update(
+            {"_id": transaction_id, "user_id": uid, "status": REFUNDED},
+            {"$set": {"status": COMMITTED, "settled_at": datetime.utcnow(), "recharged": True}}
+        )
+        if not entry:
+            print(f"⚠️ Credit transaction {transaction_id} for {uid} not found or already settled; not committed")
+            return
+        
+        print(f"⚠️ Credit transaction {transaction_id} for {uid} committed after the sweeper refunded it; charging again")
+        result = await CreditService._reserve(db, uid, entry["action"], entry["cost"], datetime.utcnow())
+        if result.modified_count == 0:
+            print(f"⚠️ Could not re-charge {entry['cost']} credits to {uid}: balance too low")
+
+    @staticmethod
+    async def _claim_refund(query: dict):
+        """Move one reservation to refunded. Returns the entry if this call
+        won it, None if it was already committed or refunded."""
+        db = await get_db()
+        return await db.credit_ledger.find_one_and_update(
+            {**query, "status": RESERVED},
+            {"$set": {"status": REFUNDED, "settled_at": datetime.utcnow()}}
         )
 
+    @staticmethod
+    def _refund_update(entries: list) -> dict:
+        credits = 0
+        usage = {}
+        for entry in entries:
+            credits += entry["cost"]
+            key = f"total_usage.{entry['action']}"
+            usage[key] = usage.get(key, 0) - 1
+        return {"$inc": {"credits": credits, **usage}}
+
+    @staticmethod
+    async def _clamp_usage(uid: str, actions):
+        db = await get_db()
+        for action in set(actions):
+            await db.user_stats.update_one(
+                {"_id": uid, f"total_usage.{action}": {"$lt": 0}},
+                {"$set": {f"total_usage.{action}": 0}}
+            )
+
     @staticmethod
     async def refund_by_action(uid: str, action: str, transaction_id: str):
         if not transaction_id:
@@ -143,30 +225,64 @@ class CreditService:
         if cost == 0:
             return True
             
+        entry = await CreditService._claim_refund({"_id": transaction_id, "user_id": uid})
+        if not entry:
+            return False
+        
         db = await get_db()
+        await db.user_stats.update_one({"_id": uid}, CreditService._refund_update([entry]))
+        await CreditService._clamp_usage(uid, [entry["action"]])
+        
+        return True
 
-        result = await db.users.update_one(
-            {
-                "_id": uid,
-                "pending_transactions.id": transaction_id
-            },
-            {
-                "$pull": {
-                    "pending_transactions": {"id": transaction_id}
-                },
-                "$inc": {
-                    "credits": cost,
-                    f"total_usage.{action}": -1
-                }
-            }
+    @staticmethod
+    async def sweep_expired_reservations() -> int:
+        """Refund reservations whose request never committed or refunded them
+        (a crashed job, a killed worker). Refunds are settled per user in one
+        bulk write."""
+        db = await get_db()
+        now = datetime.utcnow()
+        
+        expired = await db.credit_ledger.find(
+            {"status": RESERVED, "expires_at": {"$lt": now}},
+            {"_id": 1}
+        ).limit(Config.CREDIT_SWEEP_BATCH).to_list(length=Config.CREDIT_SWEEP_BATCH)
+        
+        by_user = {}
+        for entry in expired:
+            claimed = await CreditService._claim_refund({"_id": entry["_id"]})
+            if claimed:
+                by_user.setdefault(claimed["user_id"], []).append(claimed)
+        
+        if not by_user:
+            return 0
+        
+        await db.user_stats.bulk_write(
+            [UpdateOne({"_id": uid}, CreditService._refund_update(entries)) for uid, entries in by_user.items()],
+            ordered=False
         )
+        for uid, entries in by_user.items():
+            await CreditService._clamp_usage(uid, [e["action"] for e in entries])
         
-        await db.users.update_one(
-            {"_id": uid, f"total_usage.{action}": {"$lt": 0}},
-            {"$set": {f"total_usage.{action}": 0}}
+        refunded = sum(len(entries) for entries in by_user.values())
+        print(f"Credit sweeper refunded {refunded} expired reservations")
+        return refunded
+
+    @staticmethod
+    async def run_sweeper():
+        db = await get_db()
+        # Reservations used to live on the user document; drop the leftovers.
+        await db.users.update_many(
+            {"pending_transactions": {"$exists": True}},
+            {"$unset": {"pending_transactions": ""}}
         )
         
-        return result.modified_count > 0
+        while True:
+            try:
+                await CreditService.sweep_expired_reservations()
+            except Exception as e:
+                print(f"⚠️ Credit sweep failed: {e}")
+            await asyncio.sleep(Config.CREDIT_SWEEP_INTERVAL)
 
     @staticmethod
     async def initialize_user(uid: str, email: str, name: str, picture: str):
@@ -181,16 +297,12 @@ class CreditService:
                     "last_login": datetime.utcnow()
                 },
                 "$setOnInsert": {
-                    "credits": CreditService.DEFAULT_CREDITS,
                     "plan": "free",
-                    "created_at": datetime.utcnow(),
-                    "total_usage": {
-                        "extract": 0,
-                        "quiz": 0,
-                        "chat": 0,
-                        "notes": 0
-                    }
+                    "created_at": datetime.utcnow()
                 }
             },
             upsert=True
         )
+        
+        from Services.user_stats import UserStatsService
+        await UserStatsService.ensure(uid)
@@ -0,0 +1,104 @@
+import hashlib
+import re
+from typing import List, Dict, Any, Tuple
+
+from config import Config
+from Database.database import get_db
+
+FINGERPRINT_BITS = 64
+BAND_COUNT = 4
+BAND_BITS = FINGERPRINT_BITS // BAND_COUNT
+
+
+def _shingles(text: str, size: int = 3) -> List[str]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def simhash(text: str) -> int:
+    weights = [0] * FINGERPRINT_BITS
+    for shingle in _shingles(text):
+        h = int.from_bytes(hashlib.md5(shingle.encode("utf-8")).digest()[:8], "big")
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        if weights[bit] > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def fingerprint_bands(fingerprint: int) -> List[str]:
+    """Split a fingerprint into fixed bands. Two fingerprints within
+    BAND_COUNT - 1 bits of each other always share at least one band, so
+    bands work as an exact pre-filter for near-duplicate lookups."""
+    mask = (1 << BAND_BITS) - 1
+    return [
+        f"{i}:{(fingerprint >> (i * BAND_BITS)) & mask:04x}"
+        for i in range(BAND_COUNT)
+    ]
+
+
+class ChunkDeduplicator:
+    @staticmethod
+    def _is_near_duplicate(fingerprint: int, bands: List[str], band_index: Dict[str, List[int]]) -> bool:
+        for band in bands:
+            for other in band_index.get(band, []):
+                if hamming_distance(fingerprint, other) <= Config.NEAR_DUPLICATE_MAX_DISTANCE:
+                    return True
+        return False
+
+    @staticmethod
+    async def filter_chunks(user_id: str, chunks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """Drop chunks that near-duplicate an earlier chunk of the same document,
+        and short chunks that near-duplicate one already in the user's library
+        (repeated site chrome). Longer library matches are kept because chat
+        and quiz retrieval are scoped to a single document. Kept chunks get
+        ``simhash`` and ``simhash_bands`` attached for storage."""
+        if not chunks:
+            return chunks, 0
+
+        for chunk in chunks:
+            fingerprint = simhash(chunk["text"])
+            chunk["simhash"] = f"{fingerprint:016x}"
+            chunk["simhash_bands"] = fingerprint_bands(fingerprint)
+
+        library_index: Dict[str, List[int]] = {}
+        all_bands = sorted({band for chunk in chunks for band in chunk["simhash_bands"]})
+
+        db = await get_db()
+        cursor = db.document_chunks.find(
+            {"user_id": user_id, "simhash_bands": {"$in": all_bands}},
+            {"simhash": 1, "simhash_bands": 1}
+        )
+        async for existing in cursor:
+            existing_fp = int(existing["simhash"], 16)
+            for band in existing.get("simhash_bands", []):
+                library_index.setdefault(band, []).append(existing_fp)
+
+        document_index: Dict[str, List[int]] = {}
+        kept = []
+        for chunk in chunks:
+            fingerprint = int(chunk["simhash"], 16)
+            bands = chunk["simhash_bands"]
+
+            if ChunkDeduplicator._is_near_duplicate(fingerprint, bands, document_index):
+                continue
+            if (
+                len(chunk["text"].split()) <= Config.LIBRARY_DEDUP_MAX_WORDS
+                and ChunkDeduplicator._is_near_duplicate(fingerprint, bands, library_index)
+            ):
+                continue
+
+            for band in bands:
+                document_index.setdefault(band, []).append(fingerprint)
+            kept.append(chunk)
+
+        return kept, len(chunks) - len(kept)
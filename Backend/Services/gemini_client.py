@@ -1,27 +1,37 @@
-import os
-import json
-import re
-import google.generativeai as genai
-from google.api_core import exceptions as google_exceptions
-from dotenv import load_dotenv
-from typing import List
+import asyncio
+from typing import List, Dict, Tuple, Union, AsyncIterator
 
 from config import Config
-
-genai.configure(api_key=Config.GEMINI_API_KEY)
-
-MODEL = Config.GEMINI_MODEL
-
-def _call_gemini_direct(model, prompt: str) -> str:
-    response = model.generate_content(prompt)
-    return response.text if hasattr(response, "text") else str(response)
+from Services import llm_gateway
+from Services.context_packer import pack_context
+from Services.structured_output import (
+    MCQuestion,
+    ConceptExtraction,
+    MCQ_SCHEMA,
+    CONCEPTS_SCHEMA,
+    StructuredOutputError,
+    json_config,
+    parse_list,
+    parse_object,
+    is_complete_list,
+    is_complete_object,
+)
+
+# Bump a version whenever its prompt template changes so cached responses
+# rendered from the old template are no longer served.
+PROMPT_VERSIONS = {
+    "concepts": 2,
+    "quiz": 2,
+    "qa": 1,
+}
+
+QA_ERROR_PREFIX = "Unable to answer due to an error."
 
 def _truncate_text(text: str, limit: int = 50000) -> str:
     return text if len(text) <= limit else text[:limit]
 
-def extract_concepts_from_text(text: str) -> dict:
-    truncated_text = _truncate_text(text, Config.MAX_TEXT_LENGTH_CONCEPTS)
-    prompt = """
+def _build_concepts_prompt(text: str, count: int) -> str:
+    return """
 You are an expert educational assistant. Analyze the ENTIRE text provided below to extract the most important key concepts.
 
 IMPORTANT:
@@ -40,7 +50,7 @@ Examples of BAD concepts (avoid these):
 - "Understanding how the event loop works is essential"
 - "The call stack is where functions are executed"
 
-Extract the 10 most important concepts as SHORT KEYWORDS/PHRASES and describe relationships between them.
+Extract the """ + str(count) + """ most important concepts as SHORT KEYWORDS/PHRASES and describe relationships between them.
 
 Return strictly valid JSON with two keys:
   - "concepts": ["concept1", "concept2", ...] (each concept should be 1-3 words)
@@ -49,32 +59,132 @@ Return strictly valid JSON with two keys:
 Do not include extra commentary. Use the document context for relationships.
 
 Text:
-""" + truncated_text
+""" + text
+
+async def _extract_concepts_single(text: str, count: int, use_cache: bool = True) -> dict:
+    truncated_text = _truncate_text(text, Config.MAX_TEXT_LENGTH_CONCEPTS)
+    prompt = _build_concepts_prompt(truncated_text, count)
 
-    model = genai.GenerativeModel(MODEL)
     try:
-        raw = _call_gemini_direct(model, prompt)
+        raw = await llm_gateway.generate(
+            prompt,
+            task="concepts",
+            generation_config=json_config(CONCEPTS_SCHEMA),
+            cache_version=PROMPT_VERSIONS["concepts"],
+            use_cache=use_cache,
+            cacheable=is_complete_object(ConceptExtraction)
+        )
     except Exception as e:
         print(f"⚠️ Concept extraction error: {str(e)}")
         return {"concepts": [], "relationships": [], "error": str(e)}
 
     try:
-        cleaned = raw.strip()
-        start = cleaned.find("{")
-        end = cleaned.rfind("}")
-        if start != -1 and end != -1:
-            cleaned = cleaned[start:end+1]
-        data = json.loads(cleaned)
-        if not isinstance(data.get("concepts"), list) or not isinstance(data.get("relationships"), list):
-            raise ValueError("Invalid JSON shape")
-        return data
-    except Exception as e:
-        return {"error": "failed_to_parse_model_response", "raw": raw}
-
-def generate_mcq_from_text(text: str, count: int = 10, topics: List[str] = None) -> List[dict]:
-    count = int(max(Config.MIN_QUIZ_QUESTIONS, min(Config.MAX_QUIZ_QUESTIONS, count)))
-    truncated_text = _truncate_text(text, Config.MAX_TEXT_LENGTH_QUIZ)
-    
+        extraction, complete = parse_object(raw, ConceptExtraction, salvage_fields=("concepts", "relationships"))
+    except StructuredOutputError as e:
+        print(f"⚠️ Concept extraction parse error: {str(e)}")
+        return {"concepts": [], "relationships": [], "error": "failed_to_parse_model_response"}
+
+    result = extraction.model_dump()
+    if not complete:
+        result["partial"] = True
+    return result
+
+def _concept_key(name) -> str:
+    return " ".join(str(name).split()).casefold()
+
+def _group_into_sections(chunk_texts: List[str], max_chars: int) -> List[str]:
+    sections = []
+    current = []
+    current_len = 0
+    for chunk in chunk_texts:
+        if current and current_len + len(chunk) > max_chars:
+            sections.append("\n".join(current))
+            current = []
+            current_len = 0
+        current.append(chunk)
+        current_len += len(chunk)
+    if current:
+        sections.append("\n".join(current))
+    return sections
+
+def _reduce_concepts(partials: List[dict], limit: int) -> dict:
+    """Merge per-section extractions, ranking concepts by how many sections
+    mention them and how early each section lists them."""
+    scores = {}
+    names = {}
+    first_seen = {}
+    for partial in partials:
+        seen_here = set()
+        concepts = partial.get("concepts") or []
+        for rank, concept in enumerate(concepts):
+            if not isinstance(concept, str) or not concept.strip():
+                continue
+            key = _concept_key(concept)
+            if key in seen_here:
+                continue
+            seen_here.add(key)
+            scores[key] = scores.get(key, 0.0) + 1.0 + 1.0 / (rank + 1)
+            names.setdefault(key, concept.strip())
+            first_seen.setdefault(key, len(first_seen))
+
+    ranked = sorted(scores, key=lambda k: (-scores[k], first_seen[k]))[:limit]
+    kept = set(ranked)
+
+    edge_counts = {}
+    edges = {}
+    for partial in partials:
+        for rel in partial.get("relationships") or []:
+            if not isinstance(rel, dict):
+                continue
+            source = _concept_key(rel.get("source", ""))
+            target = _concept_key(rel.get("target", ""))
+            relation = " ".join(str(rel.get("relation", "")).split())
+            if source not in kept or target not in kept or source == target:
+                continue
+            edge_key = (source, relation.casefold(), target)
+            edge_counts[edge_key] = edge_counts.get(edge_key, 0) + 1
+            edges.setdefault(edge_key, {
+                "source": names[source],
+                "relation": relation or "related to",
+                "target": names[target]
+            })
+
+    ranked_edges = sorted(edge_counts, key=lambda e: -edge_counts[e])[:limit * 2]
+
+    return {
+        "concepts": [names[k] for k in ranked],
+        "relationships": [edges[e] for e in ranked_edges]
+    }
+
+async def extract_concepts_from_text(text: str, chunk_texts: List[str] = None, use_cache: bool = True) -> dict:
+    count = Config.CONCEPTS_PER_DOCUMENT
+    if len(text) <= Config.CONCEPT_MAP_REDUCE_THRESHOLD:
+        return await _extract_concepts_single(text, count, use_cache)
+
+    if not chunk_texts:
+        from Services.chunking_service import TextChunker
+        chunker = TextChunker(chunk_size=Config.DEFAULT_CHUNK_SIZE, overlap=0)
+        chunk_texts = [c["text"] for c in chunker.chunk_by_sentences(text)]
+
+    sections = _group_into_sections(chunk_texts, Config.CONCEPT_SECTION_CHARS)
+    limit = asyncio.Semaphore(max(1, Config.CONCEPT_MAP_CONCURRENCY))
+
+    async def _map(section: str) -> dict:
+        async with limit:
+            return await _extract_concepts_single(section, count, use_cache)
+
+    partials = await asyncio.gather(*(_map(section) for section in sections))
+
+    succeeded = [p for p in partials if "error" not in p]
+    if not succeeded:
+        return {"concepts": [], "relationships": [], "error": partials[0].get("error") if partials else "no_sections"}
+
+    result = _reduce_concepts(succeeded, count)
+    result["sections_processed"] = len(succeeded)
+    result["sections_failed"] = len(partials) - len(succeeded)
+    return result
+
+def _build_mcq_prompt(text: str, count: int, topics: List[str] = None) -> str:
     topics_hint = ""
     if topics:
         topics_hint = f"\nFocus on these topics: {', '.join(topics)}\n"
@@ -111,46 +221,133 @@ For each question return a JSON object with keys:
 Return a JSON array of these objects only—no extra text.
 
 Text:
-""" + truncated_text
-
-    model = genai.GenerativeModel(MODEL)
-    try:
-        raw = _call_gemini_direct(model, prompt)
-    except Exception as e:
-        print(f"⚠️ MCQ generation error: {str(e)}")
-        raise Exception(f"Quiz generation failed: {str(e)}")
+""" + text
+    return prompt
+
+async def _generate_mcq_shard(context: List[Union[str, Dict]], count: int, topics: List[str] = None, use_cache: bool = True) -> Tuple[List[dict], bool]:
+    prompt = _build_mcq_prompt(pack_context(context, Config.CONTEXT_BUDGET_QUIZ), count, topics)
+    raw = await llm_gateway.generate(
+        prompt,
+        task="quiz",
+        generation_config=json_config(MCQ_SCHEMA),
+        cache_version=PROMPT_VERSIONS["quiz"],
+        use_cache=use_cache,
+        cacheable=is_complete_list(MCQuestion)
+    )
+    questions, complete = parse_list(raw, MCQuestion)
+    return [q.model_dump() for q in questions], complete
+
+def _plan_shards(context_chunks: List[Union[str, Dict]], count: int) -> List[tuple]:
+    """Split the context into disjoint, contiguous slices and spread the
+    question count across them, ~QUIZ_SHARD_SIZE questions per slice."""
+    shard_size = max(1, Config.QUIZ_SHARD_SIZE)
+    num_shards = max(1, min(-(-count // shard_size), len(context_chunks)))
+
+    per_shard, extra = divmod(count, num_shards)
+    chunks_per_shard, extra_chunks = divmod(len(context_chunks), num_shards)
+
+    plan = []
+    pos = 0
+    for i in range(num_shards):
+        take = chunks_per_shard + (1 if i < extra_chunks else 0)
+        plan.append((context_chunks[pos:pos + take], per_shard + (1 if i < extra else 0)))
+        pos += take
+    return plan
+
+def _is_duplicate_question(terms: List[str], seen: List[List[str]]) -> bool:
+    from Services.question_cache import term_similarity
+    return any(term_similarity(terms, other) >= Config.QUIZ_DUPLICATE_THRESHOLD for other in seen)
+
+async def iter_mcq_shards(
+    context_chunks: List[Union[str, Dict]],
+    count: int = 10,
+    topics: List[str] = None,
+    use_cache: bool = True,
+    stats: Dict = None
+) -> AsyncIterator[List[dict]]:
+    """Generate the quiz in parallel shards, yielding each shard's new
+    questions (near-duplicates of earlier ones removed) as it completes.
+
+    If given, ``stats`` is filled with shard counts; ``complete`` is False
+    when any shard failed or was salvaged from a malformed response, and
+    such a quiz shouldn't be cached."""
+    from Services.question_cache import analyze_question
 
+    count = int(max(Config.MIN_QUIZ_QUESTIONS, min(Config.MAX_QUIZ_QUESTIONS, count)))
+    context_chunks = [c for c in context_chunks if ((c.get("content") if isinstance(c, dict) else c) or "").strip()]
+    if not context_chunks:
+        raise Exception("Quiz generation failed: no context provided")
+
+    limit = asyncio.Semaphore(max(1, Config.QUIZ_SHARD_CONCURRENCY))
+
+    async def _run(context: List[Union[str, Dict]], shard_count: int) -> Tuple[List[dict], bool]:
+        async with limit:
+            return await _generate_mcq_shard(context, shard_count, topics, use_cache)
+
+    tasks = [asyncio.ensure_future(_run(context, n)) for context, n in _plan_shards(context_chunks, count)]
+    if stats is None:
+        stats = {}
+    stats.update({"shards": len(tasks), "failed": 0, "salvaged": 0, "complete": False})
+    seen_terms = []
+    emitted = 0
+    errors = []
     try:
-        cleaned = raw.strip()
-        if cleaned.startswith("```"):
-            first_newline = cleaned.find("\n")
-            if first_newline != -1:
-                cleaned = cleaned[first_newline + 1:]
-            if cleaned.endswith("```"):
-                cleaned = cleaned[:-3].strip()
-        
-        start = cleaned.find("[")
-        end = cleaned.rfind("]")
-        if start != -1 and end != -1:
-            cleaned = cleaned[start:end+1]
-        
-        data = json.loads(cleaned)
-        return data
-    except json.JSONDecodeError as e:
-        print(f"⚠️ JSON parsing error: {str(e)}")
-        print(f"⚠️ Problematic JSON (first 500 chars): {cleaned[:500]}")
-        return [{
-            "question": "Quiz generation incomplete - please try again",
-            "options": ["A) Try again", "B) Reduce question count", "C) Try different topics", "D) Check content length"],
-            "answer": "A",
-            "explanation": f"The AI response was malformed or incomplete. This can happen with very long content. Error: {str(e)[:100]}"
-        }]
-    except Exception as e:
-        return [{"question": "Parsing failed", "options": [], "answer": None, "explanation": raw}]
-
-def ask_question_about_text(question: str, text: str, history: List[dict] = None) -> str:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                questions, shard_complete = await next_done
+            except Exception as e:
+                print(f"⚠️ MCQ shard failed: {str(e)}")
+                errors.append(e)
+                stats["failed"] += 1
+                continue
+            if not shard_complete:
+                stats["salvaged"] += 1
+
+            fresh = []
+            for question in questions:
+                if emitted + len(fresh) >= count:
+                    break
+                terms = analyze_question(str(question["question"]))
+                if _is_duplicate_question(terms, seen_terms):
+                    continue
+                seen_terms.append(terms)
+                fresh.append(question)
+
+            if fresh:
+                emitted += len(fresh)
+                yield fresh
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if not emitted:
+        raise Exception(f"Quiz generation failed: {str(errors[0]) if errors else 'no questions generated'}")
+    stats["complete"] = stats["failed"] == 0 and stats["salvaged"] == 0
+
+async def generate_mcq_from_text(
+    text: str = "",
+    count: int = 10,
+    topics: List[str] = None,
+    use_cache: bool = True,
+    context_chunks: List[Union[str, Dict]] = None,
+    stats: Dict = None
+) -> List[dict]:
+    if context_chunks is None:
+        from Services.chunking_service import TextChunker
+        chunker = TextChunker(chunk_size=Config.DEFAULT_CHUNK_SIZE, overlap=0)
+        context_chunks = [c["text"] for c in chunker.chunk_by_sentences(text)] or [text]
+
+    questions = []
+    async for batch in iter_mcq_shards(context_chunks, count, topics, use_cache, stats):
+        questions.extend(batch)
+    return questions
+
+def _build_qa_prompt(question: str, text: str, history: List[dict] = None, cached: bool = False) -> str:
     history = history or []
-    ctx = _truncate_text(text, Config.MAX_TEXT_LENGTH_QA)
+    if cached:
+        text = "Use the document excerpt provided above." + (
+            f"\n\nAdditional passages retrieved for this question:\n{text}" if text.strip() else ""
+        )
     convo_hint = ""
     if history:
         convo_hint += "Conversation history:\n"
@@ -165,7 +362,7 @@ You are an intelligent assistant with expertise in explaining concepts clearly.
 PRIORITY: Use the document context below to answer questions when relevant information is available.
 
 Document context:
-{ctx}
+{text}
 
 {convo_hint}
 
@@ -180,12 +377,54 @@ Question: {question}
 
 Answer:
     """
+    return prompt
+
+async def ask_question_about_text(question: str, text: str, history: List[dict] = None, use_cache: bool = True, cached_context=None) -> str:
+    prompt = _build_qa_prompt(question, text, history, cached=cached_context is not None)
 
-    model = genai.GenerativeModel(MODEL)
     try:
-        raw = _call_gemini_direct(model, prompt)
+        raw = await llm_gateway.generate(
+            prompt,
+            task="qa",
+            cache_version=PROMPT_VERSIONS["qa"],
+            use_cache=use_cache,
+            cached_context=cached_context
+        )
     except Exception as e:
         print(f"⚠️ Q&A error: {str(e)}")
-        return f"Unable to answer due to an error. Please try again. Error: {str(e)}"
+        return f"{QA_ERROR_PREFIX} Please try again. Error: {str(e)}"
     
     return raw.strip()
+
+async def stream_question_about_text(question: str, text: str, history: List[dict] = None, use_cache: bool = True, cached_context=None) -> AsyncIterator[str]:
+    prompt = _build_qa_prompt(question, text, history, cached=cached_context is not None)
+    async for token in llm_gateway.stream(prompt, task="qa", cache_version=PROMPT_VERSIONS["qa"], use_cache=use_cache, cached_context=cached_context):
+        yield token
+
+def _build_conversation_summary_prompt(previous_summary: str, messages: List[dict]) -> str:
+    lines = []
+    for msg in messages:
+        role = "User" if msg.get("role") == "user" else "Assistant"
+        lines.append(f"{role}: {_truncate_text(msg.get('content', ''), Config.CHAT_SUMMARY_MESSAGE_CHARS)}")
+    transcript = "\n".join(lines)
+
+    return f"""
+Maintain a running summary of a study conversation about a document.
+
+Current summary:
+{previous_summary or "(none yet)"}
+
+New messages:
+{transcript}
+
+Rewrite the summary so it also covers the new messages. Keep the topics the user asked about,
+the key facts and definitions the assistant gave, and any open threads the user may follow up on.
+Drop greetings and repetition. Use at most {Config.CHAT_SUMMARY_MAX_WORDS} words of plain text, no markdown.
+
+Summary:
+    """
+
+async def summarize_conversation(previous_summary: str, messages: List[dict]) -> str:
+    prompt = _build_conversation_summary_prompt(previous_summary, messages)
+    raw = await llm_gateway.generate(prompt, task="chat_summary", use_cache=False)
+    return raw.strip()
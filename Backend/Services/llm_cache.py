@@ -0,0 +1,84 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Dict, Optional, Any
+
+from config import Config
+from Database.database import get_db
+from Services.memory_cache import MemoryCache
+
+
+class LLMResponseCache:
+    _memory = MemoryCache(Config.LLM_CACHE_MAX_ENTRIES, Config.LLM_CACHE_MEMORY_TTL)
+    _stats = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "writes": 0, "bypassed": 0, "errors": 0}
+
+    @staticmethod
+    def build_key(
+        model_name: str,
+        task: str,
+        template_version: int,
+        prompt: str,
+        generation_config: Optional[Dict[str, Any]] = None
+    ) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        config_part = json.dumps(generation_config, sort_keys=True, default=str) if generation_config else ""
+        raw = f"{model_name}|{task}|v{template_version}|{config_part}|{prompt_hash}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def record_bypass():
+        LLMResponseCache._stats["bypassed"] += 1
+
+    @staticmethod
+    async def get(key: str) -> Optional[str]:
+        cached = LLMResponseCache._memory.get(key)
+        if cached is not None:
+            LLMResponseCache._stats["memory_hits"] += 1
+            return cached
+
+        try:
+            db = await get_db()
+            entry = await db.llm_response_cache.find_one({"_id": key}, {"response": 1})
+        except Exception as e:
+            LLMResponseCache._stats["errors"] += 1
+            print(f"LLM cache read failed: {e}")
+            entry = None
+
+        if entry:
+            LLMResponseCache._stats["mongo_hits"] += 1
+            LLMResponseCache._memory.set(key, entry["response"])
+            return entry["response"]
+
+        LLMResponseCache._stats["misses"] += 1
+        return None
+
+    @staticmethod
+    async def set(key: str, response: str, model_name: str, task: str):
+        if not response:
+            return
+
+        LLMResponseCache._memory.set(key, response)
+        try:
+            db = await get_db()
+            await db.llm_response_cache.update_one(
+                {"_id": key},
+                {"$set": {
+                    "response": response,
+                    "model": model_name,
+                    "task": task,
+                    "created_at": datetime.utcnow()
+                }},
+                upsert=True
+            )
+            LLMResponseCache._stats["writes"] += 1
+        except Exception as e:
+            LLMResponseCache._stats["errors"] += 1
+            print(f"LLM cache write failed: {e}")
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        stats = dict(LLMResponseCache._stats)
+        lookups = stats["memory_hits"] + stats["mongo_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["mongo_hits"]) / lookups, 3) if lookups else 0.0
+        stats["memory_entries"] = len(LLMResponseCache._memory)
+        return stats
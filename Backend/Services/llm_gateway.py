@@ -0,0 +1,531 @@
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional, Any, AsyncIterator, Callable, Tuple
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from config import Config
+from Middleware.error_handlers import LLMAPIError
+from Services.llm_cache import LLMResponseCache
+from Services.memory_cache import MemoryCache
+from Services.llm_metrics import LLMMetrics
+from Services.circuit_breaker import get_breaker
+
+genai.configure(api_key=Config.GEMINI_API_KEY)
+
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServerError,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+)
+
+# Errors that mean "this model is saturated or slow right now" and are
+# worth sending to the next tier instead of retrying the same model.
+FALLBACK_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+)
+
+# The server no longer has (or never accepted) a cached-context resource.
+CACHED_CONTEXT_ERRORS = (
+    google_exceptions.NotFound,
+    google_exceptions.PermissionDenied,
+    google_exceptions.FailedPrecondition,
+)
+
+MODEL_TIERS = {
+    "fast": Config.GEMINI_FAST_MODEL,
+    "standard": Config.GEMINI_MODEL,
+}
+TIER_ORDER = ["fast", "standard"]
+
+# Cheap, short-output tasks go to the fast tier so capacity on the main
+# model is kept for chat, quizzes and notes.
+TASK_TIERS = {
+    "summary": "fast",
+    "chat_summary": "fast",
+    "key_concepts": "fast",
+    "flashcards": "fast",
+    "practice_questions": "fast",
+    "concepts": "standard",
+    "notes": "standard",
+    "quiz": "standard",
+    "qa": "standard",
+    "default": "standard",
+}
+
+_models: Dict[str, genai.GenerativeModel] = {}
+_cached_context_models = MemoryCache(64)
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+def get_model(model_name: Optional[str] = None, cached_content: Optional[str] = None) -> genai.GenerativeModel:
+    model_name = model_name or Config.GEMINI_MODEL
+    if cached_content:
+        return _get_cached_context_model(model_name, cached_content)
+    if model_name not in _models:
+        _models[model_name] = genai.GenerativeModel(model_name)
+    return _models[model_name]
+
+
+def _get_cached_context_model(model_name: str, cached_content: str) -> genai.GenerativeModel:
+    model = _cached_context_models.get(cached_content)
+    if model is None:
+        model = genai.GenerativeModel(model_name)
+        # What GenerativeModel.from_cached_content sets, minus its blocking
+        # round trip to fetch a resource we already know the name of.
+        model._cached_content = cached_content
+        _cached_context_models.set(cached_content, model)
+    return model
+
+
+def _get_semaphore(model_name: str) -> asyncio.Semaphore:
+    if model_name not in _semaphores:
+        _semaphores[model_name] = asyncio.Semaphore(Config.LLM_MAX_CONCURRENCY)
+    return _semaphores[model_name]
+
+
+def _task_overrides() -> Dict[str, str]:
+    overrides = {}
+    for entry in Config.LLM_TASK_TIERS.split(","):
+        task, sep, target = entry.partition("=")
+        if sep and task.strip() and target.strip():
+            overrides[task.strip()] = target.strip()
+    return overrides
+
+
+_overrides = _task_overrides()
+
+
+def resolve_models(task: str, model_name: Optional[str] = None) -> List[str]:
+    """Return the models to try for ``task``, in order.
+
+    An explicit ``model_name`` pins the call to that model. Otherwise the
+    task's tier (from TASK_TIERS, or LLM_TASK_TIERS in config, which may name
+    a tier or a model) comes first, followed by the remaining tiers."""
+    if model_name:
+        return [model_name]
+
+    tier = TASK_TIERS.get(task, TASK_TIERS["default"])
+    target = _overrides.get(task, tier)
+    if target in MODEL_TIERS:
+        tier = target
+        chain = []
+    else:
+        chain = [target]
+
+    start = TIER_ORDER.index(tier)
+    for next_tier in TIER_ORDER[start:] + TIER_ORDER[:start]:
+        if MODEL_TIERS[next_tier] not in chain:
+            chain.append(MODEL_TIERS[next_tier])
+    return chain
+
+
+def _response_text(response) -> str:
+    return response.text if hasattr(response, "text") else str(response)
+
+
+def _backoff_delay(attempt: int) -> float:
+    ceiling = min(Config.LLM_BACKOFF_MAX, Config.LLM_BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def _cache_key(prompt: str, task: str, model_name: str, generation_config, cache_version, use_cache: bool) -> Optional[str]:
+    if cache_version is None or not Config.LLM_CACHE_ENABLED:
+        return None
+    if not use_cache:
+        LLMResponseCache.record_bypass()
+        return None
+    return LLMResponseCache.build_key(model_name, task, cache_version, prompt, generation_config)
+
+
+async def generate(
+    prompt: str,
+    *,
+    task: str = "default",
+    model_name: Optional[str] = None,
+    generation_config: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+    max_retries: Optional[int] = None,
+    cache_version: Optional[int] = None,
+    use_cache: bool = True,
+    cacheable: Optional[Callable[[str], bool]] = None,
+    cached_context=None
+) -> str:
+    """Run one Gemini completion without blocking the event loop.
+
+    The model is chosen by ``task`` (see resolve_models) unless ``model_name``
+    pins one. Calls share a per-model concurrency limit, each attempt is
+    bounded by ``timeout``, overload and timeouts move on to the next tier,
+    and other server errors are retried with full-jitter exponential backoff.
+    Raises LLMAPIError once retries are exhausted; other errors (bad request,
+    blocked prompt) propagate unchanged.
+
+    Passing ``cache_version`` (the prompt template's version) makes the call
+    cacheable by exact prompt; ``use_cache=False`` bypasses the cache, and
+    ``cacheable`` can reject responses (e.g. unparseable JSON) from being stored.
+
+    ``cached_context`` (a ContextHandle) is a prompt prefix cached server-side;
+    one attempt is made on the model it was created for. If the server has
+    dropped it, or that model is overloaded or its circuit is open, the
+    prefix is sent inline through the task's normal tiers instead.
+    """
+    prompt, cached_context = _apply_local_context(prompt, cached_context)
+    models = [cached_context.model] if cached_context else resolve_models(task, model_name)
+    cache_key = _cache_key(_full_prompt(prompt, cached_context), task, models[0], generation_config, cache_version, use_cache)
+    if cache_key:
+        cached = await LLMResponseCache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    try:
+        text, answered_by = await _generate_uncached(
+            prompt, task, models, generation_config, timeout,
+            0 if cached_context else max_retries, cached_context
+        )
+    except CACHED_CONTEXT_ERRORS + (LLMAPIError,) as e:
+        if not cached_context:
+            raise
+        _context_unavailable(cached_context, e)
+        text, answered_by = await _generate_uncached(
+            _full_prompt(prompt, cached_context), task, resolve_models(task, model_name),
+            generation_config, timeout, max_retries
+        )
+
+    # A fallback tier's answer isn't what the key promises; don't let it
+    # stand in for the primary model's answer for the cache's lifetime.
+    if cache_key and answered_by == models[0] and (cacheable is None or cacheable(text)):
+        await LLMResponseCache.set(cache_key, text, models[0], task)
+    return text
+
+
+def _full_prompt(prompt: str, cached_context) -> str:
+    return f"{cached_context.contents}\n\n{prompt}" if cached_context else prompt
+
+
+def _apply_local_context(prompt: str, cached_context):
+    """The local backend has no server-side cache: inline its contents."""
+    if cached_context is not None and cached_context.is_local:
+        return _full_prompt(prompt, cached_context), None
+    return prompt, cached_context
+
+
+def _context_unavailable(cached_context, error: BaseException):
+    """The pinned call failed: forget the handle if the server no longer has
+    it; if only its model is unavailable, keep it for later turns."""
+    if isinstance(error, CACHED_CONTEXT_ERRORS):
+        from Services.context_cache import ContextCacheService
+        print(f"⚠️ Cached context {cached_context.name} unusable ({type(error).__name__}); sending inline")
+        ContextCacheService.forget(cached_context)
+    else:
+        print(f"⚠️ {cached_context.model} unavailable for cached context ({error.detail}); sending inline")
+
+
+def _next_model(task: str, models: List[str], index: int, error: BaseException) -> int:
+    """Move to the next tier on overload/timeout; stay put otherwise."""
+    if isinstance(error, FALLBACK_ERRORS) and index + 1 < len(models):
+        LLMMetrics.record_fallback(task)
+        print(f"⚠️ {models[index]} unavailable for {task} ({type(error).__name__}), falling back to {models[index + 1]}")
+        return index + 1
+    return index
+
+
+def _available_model(models: List[str], index: int) -> Optional[int]:
+    """First model from ``index`` on whose circuit admits a call."""
+    for i in range(index, len(models)):
+        if get_breaker(models[i]).allow():
+            return i
+    return None
+
+
+def _report_error(breaker, error: BaseException):
+    """Tell the breaker how a call ended, so a half-open probe never stays
+    outstanding. Overload and timeouts count against the model; any other
+    error means it answered (the request was at fault); a cancelled call
+    says nothing either way."""
+    if isinstance(error, RETRYABLE_ERRORS):
+        breaker.record_failure()
+    elif isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        breaker.release()
+    else:
+        breaker.record_success()
+
+
+async def _call_model(model_name: str, prompt: str, generation_config, timeout: float, cached_name: Optional[str] = None):
+    breaker = get_breaker(model_name)
+    async with _get_semaphore(model_name):
+        try:
+            response = await asyncio.wait_for(
+                get_model(model_name, cached_name).generate_content_async(prompt, generation_config=generation_config),
+                timeout
+            )
+        except BaseException as e:
+            _report_error(breaker, e)
+            raise
+    breaker.record_success()
+    return response
+
+
+def _hedge_delay(task: str) -> Optional[float]:
+    if not Config.LLM_HEDGE_ENABLED or LLMMetrics.sample_count(task) < Config.LLM_HEDGE_MIN_SAMPLES:
+        return None
+    delay = LLMMetrics.percentile(task, Config.LLM_HEDGE_PERCENTILE)
+    return max(Config.LLM_HEDGE_MIN_DELAY, delay) if delay is not None else None
+
+
+_latency_watchers = set()
+
+
+def _sample_when_done(task: str, call: asyncio.Future, started: float):
+    """Record a lost primary's latency once it finishes, so the hedge delay
+    keeps seeing the slow tail instead of only the hedges that beat it."""
+    def _done(finished):
+        _latency_watchers.discard(finished)
+        if not finished.cancelled() and finished.exception() is None:
+            LLMMetrics.record_latency(task, time.monotonic() - started)
+    _latency_watchers.add(call)
+    call.add_done_callback(_done)
+
+
+async def _hedged_call(task: str, model_name: str, prompt: str, generation_config, timeout: float, cached_name: Optional[str] = None):
+    """Call the model; if it hasn't answered by the task's latency percentile,
+    send a duplicate and take whichever succeeds first.
+
+    Returns the response and the primary call's latency, or None when the
+    hedge won (the primary is left to finish and sampled then)."""
+    started = time.monotonic()
+    primary = asyncio.ensure_future(_call_model(model_name, prompt, generation_config, timeout, cached_name))
+    delay = _hedge_delay(task)
+    if delay is None or delay >= timeout:
+        response = await primary
+        return response, time.monotonic() - started
+
+    hedge = None
+    keep_primary = False
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or get_breaker(model_name).state != "closed":
+            response = await primary
+            return response, time.monotonic() - started
+
+        LLMMetrics.record_hedge(task)
+        hedge = asyncio.ensure_future(_call_model(model_name, prompt, generation_config, timeout, cached_name))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for finished in done:
+                if finished.exception() is None:
+                    if finished is primary:
+                        return finished.result(), time.monotonic() - started
+                    LLMMetrics.record_hedge_win(task)
+                    if not primary.done():
+                        keep_primary = True
+                        _sample_when_done(task, primary, started)
+                    return finished.result(), None
+                error = finished.exception()
+        raise error
+    finally:
+        for call in (primary, hedge):
+            if call is not None and not call.done() and not (call is primary and keep_primary):
+                call.cancel()
+
+
+async def _generate_uncached(
+    prompt: str,
+    task: str,
+    models: List[str],
+    generation_config: Optional[Dict[str, Any]],
+    timeout: Optional[float],
+    max_retries: Optional[int],
+    cached_context=None
+) -> Tuple[str, str]:
+    """Returns the text and the model that actually produced it."""
+    timeout = timeout or Config.LLM_TIMEOUT
+    cached_name = cached_context.name if cached_context else None
+    attempts = max(len(models), 1 + (Config.LLM_MAX_RETRIES if max_retries is None else max_retries))
+
+    index = 0
+    last_error = None
+    for attempt in range(attempts):
+        available = _available_model(models, index)
+        if available is None:
+            LLMMetrics.record_rejected(task)
+            raise LLMAPIError("AI service temporarily unavailable (circuit open)")
+        index = available
+        model_name = models[index]
+
+        try:
+            response, latency = await _hedged_call(task, model_name, prompt, generation_config, timeout, cached_name)
+            LLMMetrics.record_success(task, model_name, latency, getattr(response, "usage_metadata", None))
+            return _response_text(response), model_name
+        except RETRYABLE_ERRORS as e:
+            last_error = e
+            LLMMetrics.record_error(task)
+            if attempt + 1 < attempts:
+                next_index = _next_model(task, models, index, e)
+                if next_index == index:
+                    await asyncio.sleep(_backoff_delay(attempt))
+                index = next_index
+
+    print(f"⚠️ LLM call failed after {attempts} attempts ({task}): {last_error!r}")
+    raise LLMAPIError(f"AI service temporarily unavailable ({type(last_error).__name__})")
+
+
+def _chunk_text(chunk) -> str:
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+def _cancel_stream(response):
+    # The SDK doesn't expose cancellation; the underlying gRPC call does.
+    call = getattr(response, "_iterator", None)
+    cancel = getattr(call, "cancel", None)
+    if callable(cancel):
+        cancel()
+
+
+async def stream(
+    prompt: str,
+    *,
+    task: str = "default",
+    model_name: Optional[str] = None,
+    generation_config: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+    cache_version: Optional[int] = None,
+    use_cache: bool = True,
+    cached_context=None
+) -> AsyncIterator[str]:
+    """Yield text deltas as Gemini produces them.
+
+    Opening the stream is retried like ``generate``; once tokens flow, errors
+    are surfaced as LLMAPIError. ``timeout`` bounds the wait for each delta.
+    Closing or cancelling the generator cancels the upstream call and frees
+    the concurrency slot. A cache hit is yielded as a single delta, and a
+    stream that runs to completion is cached. ``cached_context`` works as
+    in ``generate``; the inline fallback only applies before the first delta.
+    """
+    prompt, cached_context = _apply_local_context(prompt, cached_context)
+    models = [cached_context.model] if cached_context else resolve_models(task, model_name)
+    cache_key = _cache_key(_full_prompt(prompt, cached_context), task, models[0], generation_config, cache_version, use_cache)
+    if cache_key:
+        cached = await LLMResponseCache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    outcome = {}
+    try:
+        async for text in _stream_uncached(
+            prompt, task, models, generation_config, timeout, cached_context,
+            max_retries=0 if cached_context else None, outcome=outcome
+        ):
+            parts.append(text)
+            yield text
+    except CACHED_CONTEXT_ERRORS + (LLMAPIError,) as e:
+        if not cached_context or parts:
+            raise
+        _context_unavailable(cached_context, e)
+        async for text in _stream_uncached(
+            _full_prompt(prompt, cached_context), task, resolve_models(task, model_name), generation_config, timeout,
+            outcome=outcome
+        ):
+            parts.append(text)
+            yield text
+
+    if cache_key and outcome.get("model") == models[0]:
+        await LLMResponseCache.set(cache_key, "".join(parts), models[0], task)
+
+
+async def _stream_uncached(
+    prompt: str,
+    task: str,
+    models: List[str],
+    generation_config: Optional[Dict[str, Any]],
+    timeout: Optional[float],
+    cached_context=None,
+    max_retries: Optional[int] = None,
+    outcome: Optional[Dict[str, str]] = None
+) -> AsyncIterator[str]:
+    """``outcome["model"]`` is set to the model that served the stream."""
+    timeout = timeout or Config.LLM_TIMEOUT
+    cached_name = cached_context.name if cached_context else None
+    attempts = max(len(models), 1 + (Config.LLM_MAX_RETRIES if max_retries is None else max_retries))
+
+    index = 0
+    response = None
+    semaphore = None
+    last_error = None
+    for attempt in range(attempts):
+        available = _available_model(models, index)
+        if available is None:
+            LLMMetrics.record_rejected(task)
+            raise LLMAPIError("AI service temporarily unavailable (circuit open)")
+        index = available
+        model_name = models[index]
+        breaker = get_breaker(model_name)
+
+        semaphore = _get_semaphore(model_name)
+        await semaphore.acquire()
+        started = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                get_model(model_name, cached_name).generate_content_async(prompt, generation_config=generation_config, stream=True),
+                timeout
+            )
+            break
+        except RETRYABLE_ERRORS as e:
+            semaphore.release()
+            _report_error(breaker, e)
+            last_error = e
+            LLMMetrics.record_error(task)
+            if attempt + 1 < attempts:
+                next_index = _next_model(task, models, index, e)
+                if next_index == index:
+                    await asyncio.sleep(_backoff_delay(attempt))
+                index = next_index
+        except BaseException as e:
+            semaphore.release()
+            _report_error(breaker, e)
+            raise
+
+    if response is None:
+        print(f"⚠️ LLM stream failed after {attempts} attempts ({task}): {last_error!r}")
+        raise LLMAPIError(f"AI service temporarily unavailable ({type(last_error).__name__})")
+    if outcome is not None:
+        outcome["model"] = model_name
+
+    usage = None
+    try:
+        chunks = response.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+            except StopAsyncIteration:
+                breaker.record_success()
+                LLMMetrics.record_success(task, model_name, time.monotonic() - started, usage)
+                return
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            text = _chunk_text(chunk)
+            if text:
+                yield text
+    except RETRYABLE_ERRORS as e:
+        _report_error(breaker, e)
+        LLMMetrics.record_error(task)
+        print(f"⚠️ LLM stream interrupted ({task}): {e!r}")
+        raise LLMAPIError(f"AI service interrupted ({type(e).__name__})")
+    except BaseException as e:
+        _report_error(breaker, e)
+        raise
+    finally:
+        _cancel_stream(response)
+        semaphore.release()
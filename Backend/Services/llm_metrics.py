@@ -0,0 +1,109 @@
+from collections import deque
+from typing import Any, Dict, Optional
+
+LATENCY_WINDOW = 200
+
+
+def _usage_counts(usage) -> Dict[str, int]:
+    if usage is None:
+        return {"prompt_tokens": 0, "output_tokens": 0}
+    return {
+        "prompt_tokens": int(getattr(usage, "prompt_token_count", 0) or 0),
+        "output_tokens": int(getattr(usage, "candidates_token_count", 0) or 0),
+    }
+
+
+def _rounded(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+class LLMMetrics:
+    """Per-task call counters, token usage and a rolling latency window."""
+
+    _tasks: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def _task(task: str) -> Dict[str, Any]:
+        if task not in LLMMetrics._tasks:
+            LLMMetrics._tasks[task] = {
+                "calls": 0,
+                "errors": 0,
+                "fallbacks": 0,
+                "hedges": 0,
+                "hedge_wins": 0,
+                "rejected": 0,
+                "prompt_tokens": 0,
+                "output_tokens": 0,
+                "models": {},
+                "latencies": deque(maxlen=LATENCY_WINDOW),
+            }
+        return LLMMetrics._tasks[task]
+
+    @staticmethod
+    def record_success(task: str, model_name: str, latency: Optional[float], usage=None):
+        entry = LLMMetrics._task(task)
+        entry["calls"] += 1
+        entry["models"][model_name] = entry["models"].get(model_name, 0) + 1
+        if latency is not None:
+            entry["latencies"].append(latency)
+        for key, value in _usage_counts(usage).items():
+            entry[key] += value
+
+    @staticmethod
+    def record_latency(task: str, latency: float):
+        LLMMetrics._task(task)["latencies"].append(latency)
+
+    @staticmethod
+    def record_error(task: str):
+        LLMMetrics._task(task)["errors"] += 1
+
+    @staticmethod
+    def record_fallback(task: str):
+        LLMMetrics._task(task)["fallbacks"] += 1
+
+    @staticmethod
+    def record_hedge(task: str):
+        LLMMetrics._task(task)["hedges"] += 1
+
+    @staticmethod
+    def record_hedge_win(task: str):
+        LLMMetrics._task(task)["hedge_wins"] += 1
+
+    @staticmethod
+    def record_rejected(task: str):
+        LLMMetrics._task(task)["rejected"] += 1
+
+    @staticmethod
+    def sample_count(task: str) -> int:
+        entry = LLMMetrics._tasks.get(task)
+        return len(entry["latencies"]) if entry else 0
+
+    @staticmethod
+    def percentile(task: str, pct: float) -> Optional[float]:
+        entry = LLMMetrics._tasks.get(task)
+        if not entry or not entry["latencies"]:
+            return None
+        ordered = sorted(entry["latencies"])
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        stats = {}
+        for task, entry in LLMMetrics._tasks.items():
+            latencies = entry["latencies"]
+            stats[task] = {
+                "calls": entry["calls"],
+                "errors": entry["errors"],
+                "fallbacks": entry["fallbacks"],
+                "hedges": entry["hedges"],
+                "hedge_wins": entry["hedge_wins"],
+                "rejected": entry["rejected"],
+                "prompt_tokens": entry["prompt_tokens"],
+                "output_tokens": entry["output_tokens"],
+                "models": dict(entry["models"]),
+                "latency_avg": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "latency_p50": _rounded(LLMMetrics.percentile(task, 50)),
+                "latency_p95": _rounded(LLMMetrics.percentile(task, 95)),
+            }
+        return stats
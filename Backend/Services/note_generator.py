@@ -1,30 +1,34 @@
-from typing import List, Dict
-import google.generativeai as genai
-import os
+from typing import List, Dict, Union
 import re
 
 from config import Config
-
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-def _call_gemini_direct(model, prompt: str) -> str:
-    """Direct call to Gemini API without retry logic"""
-    response = model.generate_content(prompt)
-    return response.text if hasattr(response, "text") else str(response)
-
-def _get_model():
-    return genai.GenerativeModel(Config.GEMINI_MODEL)
-
-def generate_study_notes(content: str, topic: str = "General") -> Dict:
-    model = _get_model()
-    
+from Services import llm_gateway
+from Services.context_packer import pack_context
+from Services.structured_output import StudyNotes, NOTES_SCHEMA, json_config, parse_object, is_complete_object
+
+PROMPT_VERSIONS = {
+    "notes": 2,
+    "summary": 1,
+    "key_concepts": 1,
+    "flashcards": 1,
+    "practice_questions": 1,
+}
+
+async def generate_study_notes(content: Union[str, List[Dict]], topic: str = "General", use_cache: bool = True) -> Dict:
+    """``content`` is either raw text or scored retrieval results; results
+    are packed best-first into the notes context budget."""
     try:
+        context = pack_context(content if isinstance(content, list) else [content], Config.CONTEXT_BUDGET_NOTES)
         combined_prompt = f"""Analyze this content about "{topic}" and provide comprehensive study materials.
 
 Return ONLY valid JSON with this EXACT structure:
 {{
   "summary": "3-4 sentence summary here",
   "key_points": ["point 1", "point 2", "point 3", "point 4", "point 5"],
-  "definitions": {{"term1": "definition1", "term2": "definition2"}},
+  "definitions": [
+    {{"term": "term1", "definition": "definition1"}},
+    {{"term": "term2", "definition": "definition2"}}
+  ],
   "flashcards": [
     {{"question": "question 1", "answer": "answer 1"}},
     {{"question": "question 2", "answer": "answer 2"}},
@@ -40,80 +44,81 @@ Return ONLY valid JSON with this EXACT structure:
 }}
 
 Content:
-{content[:3000]}"""
+{context}"""
         
-        response_text = _call_gemini_direct(model, combined_prompt).strip()
+        response_text = await llm_gateway.generate(
+            combined_prompt,
+            task="notes",
+            generation_config=json_config(NOTES_SCHEMA),
+            cache_version=PROMPT_VERSIONS["notes"],
+            use_cache=use_cache,
+            cacheable=is_complete_object(StudyNotes)
+        )
         
-        import json
-        response_text = re.sub(r'```json\s*', '', response_text)
-        response_text = re.sub(r'```\s*', '', response_text).strip()
+        parsed, complete = parse_object(
+            response_text,
+            StudyNotes,
+            salvage_fields=("summary", "key_points", "definitions", "flashcards", "practice_questions")
+        )
         
-        start = response_text.find('{')
-        end = response_text.rfind('}')
-        if start != -1 and end != -1:
-            response_text = response_text[start:end+1]
-        
-        parsed_response = json.loads(response_text)
-        
-        summary = parsed_response.get('summary', 'Summary not available')
-        key_points_raw = parsed_response.get('key_points', [])
-        key_points = _normalize_key_points(key_points_raw)
-        definitions_raw = parsed_response.get('definitions', {})
-        definitions = _normalize_definitions(definitions_raw)
-        flashcards = parsed_response.get('flashcards', [
-            {"question": "What is the main topic?", "answer": topic},
-            {"question": "Key concept?", "answer": "See summary"}
-        ])
-        practice_questions = parsed_response.get('practice_questions', [
-            {"question": f"Explain the main concepts of {topic}", "difficulty": "medium", "hint": "Review the summary section"}
-        ])
+        key_points = parsed.key_points
+        definitions = {d.term: d.definition for d in parsed.definitions}
         
         mind_map = _generate_mind_map(key_points, topic)
         
-        return {
+        notes = {
             "topic": topic,
-            "summary": summary,
+            "summary": parsed.summary,
             "key_points": key_points,
             "definitions": definitions,
             "mind_map": mind_map,
-            "flashcards": flashcards,
-            "practice_questions": practice_questions,
-            "estimated_study_time": _estimate_study_time(content),
+            "flashcards": [f.model_dump() for f in parsed.flashcards],
+            "practice_questions": [q.model_dump() for q in parsed.practice_questions],
+            "estimated_study_time": _estimate_study_time(context),
             "difficulty_level": _estimate_difficulty(key_points, definitions)
         }
+        if not complete:
+            notes["partial"] = True
+        return notes
     except Exception as e:
         error_msg = str(e)
         print(f"Note generation error: {error_msg}")
         raise Exception(f"Note generation failed: {error_msg}")
 
-def generate_quick_summary(content: str, max_sentences: int = 3) -> str:
-    model = _get_model()
-    
+async def generate_quick_summary(content: str, max_sentences: int = 3, use_cache: bool = True) -> str:
     prompt = f"""Provide a {max_sentences}-sentence summary:
 
-{content[:2000]}"""
+{pack_context([content], Config.CONTEXT_BUDGET_SUMMARY)}"""
     
     try:
-        return _call_gemini_direct(model, prompt).strip()
+        return (await llm_gateway.generate(
+            prompt,
+            task="summary",
+            cache_version=PROMPT_VERSIONS["summary"],
+            use_cache=use_cache
+        )).strip()
     except Exception as e:
         return f"Summary unavailable due to error: {str(e)}"
 
-def extract_key_concepts(content: str, top_n: int = 10) -> List[str]:
-    model = _get_model()
-    
+async def extract_key_concepts(content: str, top_n: int = 10, use_cache: bool = True) -> List[str]:
     prompt = f"""Extract the top {top_n} key concepts. Return as JSON array:
 
-{content[:2000]}"""
+{pack_context([content], Config.CONTEXT_BUDGET_SUMMARY)}"""
     
-    result = model.generate_content(prompt).text.strip()
+    result = (await llm_gateway.generate(
+        prompt,
+        task="key_concepts",
+        cache_version=PROMPT_VERSIONS["key_concepts"],
+        use_cache=use_cache
+    )).strip()
     return _parse_json_array(result)
 
-def _generate_flashcards(content: str, topic: str, model) -> List[Dict]:
+async def _generate_flashcards(content: str, topic: str) -> List[Dict]:
     prompt = f"""Create 5 flashcards for "{topic}" with question and answer. Return as JSON array:
 
-{content[:2000]}"""
+{pack_context([content], Config.CONTEXT_BUDGET_SUMMARY)}"""
     
-    flashcards_text = model.generate_content(prompt).text.strip()
+    flashcards_text = (await llm_gateway.generate(prompt, task="flashcards", cache_version=PROMPT_VERSIONS["flashcards"])).strip()
     flashcards_data = _parse_json_array(flashcards_text, default=[])
     
     if not flashcards_data:
@@ -148,12 +153,12 @@ def _generate_mind_map(key_points: List[str], topic: str) -> Dict:
     
     return mind_map
 
-def _generate_practice_questions(content: str, topic: str, model) -> List[Dict]:
+async def _generate_practice_questions(content: str, topic: str) -> List[Dict]:
     prompt = f"""Create 3 practice questions about "{topic}". Return as JSON array:
 
-{content[:2000]}"""
+{pack_context([content], Config.CONTEXT_BUDGET_SUMMARY)}"""
     
-    questions_text = model.generate_content(prompt).text.strip()
+    questions_text = (await llm_gateway.generate(prompt, task="practice_questions", cache_version=PROMPT_VERSIONS["practice_questions"])).strip()
     questions = _parse_json_array(questions_text, default=[])
     
     if not questions:
@@ -220,56 +225,3 @@ def _parse_json_array(text: str, default: List = None) -> List:
             return [line.strip('- ').strip() for line in lines[:10]]
         
         return default
-
-def _parse_json_object(text: str, default: Dict = None) -> Dict:
-    import json
-    
-    if default is None:
-        default = {}
-    
-    try:
-        text = re.sub(r'```json\s*', '', text)
-        text = re.sub(r'```\s*', '', text)
-        text = text.strip()
-        
-        return json.loads(text)
-    except:
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if match:
-            try:
-                return json.loads(match.group(0))
-            except:
-                pass
-        
-        return default
-
-def _normalize_key_points(key_points: List) -> List[str]:
-    normalized = []
-    for point in key_points:
-        if isinstance(point, dict):
-            text = point.get('point', '') or point.get('text', '') or point.get('description', '') or str(point)
-            normalized.append(text)
-        elif isinstance(point, str):
-            normalized.append(point)
-        else:
-            normalized.append(str(point))
-    return normalized
-
-def _normalize_definitions(definitions) -> Dict[str, str]:
-    if isinstance(definitions, list):
-        result = {}
-        for item in definitions:
-            if isinstance(item, dict):
-                term = item.get('term', '') or item.get('word', '') or item.get('concept', '')
-                definition = item.get('definition', '') or item.get('def', '') or item.get('meaning', '')
-                if term and definition:
-                    result[term] = definition
-        return result
-    elif isinstance(definitions, dict):
-        if 'terms' in definitions and isinstance(definitions['terms'], list):
-            return _normalize_definitions(definitions['terms'])
-        elif 'definitions' in definitions:
-            return _normalize_definitions(definitions['definitions'])
-        else:
-            return {k: str(v) if not isinstance(v, str) else v for k, v in definitions.items()}
-    return {}
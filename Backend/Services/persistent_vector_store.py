@@ -1,13 +1,51 @@
 import pickle
 import numpy as np
-from typing import List, Dict, Tuple, Optional, Any
+from typing import List, Dict, Tuple, Optional, Any, Union
 from datetime import datetime
 from bson import ObjectId
 from rank_bm25 import BM25Okapi
 
 
+from config import Config
 from Database.database import get_db
 
+
+def weighted_query(query: str, context_terms: Optional[List[str]] = None) -> Dict[str, float]:
+    """Turn a question plus optional conversation keywords into BM25 query
+    weights: the question's own terms count fully, context terms only add
+    BM25_CONTEXT_TERM_WEIGHT."""
+    weights: Dict[str, float] = {}
+    for term in query.lower().split():
+        weights[term] = weights.get(term, 0.0) + 1.0
+    for term in context_terms or []:
+        term = term.lower()
+        if term not in weights:
+            weights[term] = Config.BM25_CONTEXT_TERM_WEIGHT
+    return weights
+
+
+def _select_terms(bm25: BM25Okapi, weights: Dict[str, float]) -> Dict[str, float]:
+    """Keep the BM25_MAX_QUERY_TERMS terms with the highest weight x IDF.
+    Terms the index has never seen can't score and are dropped first."""
+    scored = [
+        (weight * bm25.idf[term], term, weight)
+        for term, weight in weights.items()
+        if term in bm25.idf
+    ]
+    scored.sort(key=lambda t: t[0], reverse=True)
+    return {term: weight for _, term, weight in scored[:Config.BM25_MAX_QUERY_TERMS]}
+
+
+def _weighted_scores(bm25: BM25Okapi, terms: Dict[str, float], candidates: Optional[List[int]] = None) -> np.ndarray:
+    size = bm25.corpus_size if candidates is None else len(candidates)
+    scores = np.zeros(size)
+    for term, weight in terms.items():
+        if candidates is None:
+            scores += weight * bm25.get_scores([term])
+        else:
+            scores += weight * np.asarray(bm25.get_batch_scores([term], candidates))
+    return scores
+
 class PersistentVectorStore:
     _instance = None
     _cache: Dict[str, Dict[str, Any]] = {}
@@ -21,7 +59,7 @@ class PersistentVectorStore:
         db = await get_db()
         return db.bm25_tokens, db.vectorizer_state
 
-    async def save_bm25_tokens(self, user_id: str, document_id: str, chunk_id: int, tokens: List[str]):
+    async def save_bm25_tokens(self, user_id: str, document_id: str, chunk_id: int, tokens: List[str], section_id: Optional[int] = None):
         indices_col, _ = await self._get_collection()
         
         await indices_col.update_one(
@@ -35,6 +73,7 @@ class PersistentVectorStore:
                 "$set": {
                     "bm25_tokens": tokens,
                     "bm25_doc_length": len(tokens),
+                    "section_id": section_id,
                     "updated_at": datetime.utcnow()
                 }
             },
@@ -62,34 +101,100 @@ class PersistentVectorStore:
         
         tokenized_corpus = []
         chunk_ids = []
+        chunk_sections = []
         
         async for doc in cursor:
             if "bm25_tokens" in doc:
                 tokenized_corpus.append(doc["bm25_tokens"])
                 chunk_ids.append(doc["chunk_id"])
+                section_id = doc.get("section_id")
+                chunk_sections.append(f"{doc['document_id']}:{section_id}" if section_id is not None else None)
                 
         if not chunk_ids:
             return None, []
             
         bm25 = BM25Okapi(tokenized_corpus)
         
-        self._cache.setdefault(cache_key, {})["bm25"] = (bm25, chunk_ids)
+        entry = self._cache.setdefault(cache_key, {})
+        entry["bm25"] = (bm25, chunk_ids)
+        entry["chunk_sections"] = chunk_sections
+        entry.pop("sections", None)
         
         return bm25, chunk_ids
 
-    async def _fetch_chunks(self, chunk_ids: List[ObjectId]) -> Dict[ObjectId, str]:
+    async def load_section_index(self, user_id: str, document_id: Optional[str] = None):
+        """Section-level BM25 built from the chunk index: one pseudo-document
+        per section holding the term counts of all its chunks."""
+        cache_key = f"{user_id}_{document_id}" if document_id else user_id
+        bm25, chunk_ids = await self.load_bm25_index(user_id, document_id)
+        if not bm25:
+            return None, [], {}
+        
+        entry = self._cache[cache_key]
+        if "sections" in entry:
+            return entry["sections"]
+        
+        members: Dict[str, List[int]] = {}
+        for idx, section_key in enumerate(entry.get("chunk_sections", [])):
+            if section_key is not None:
+                members.setdefault(section_key, []).append(idx)
+        
+        if len(members) < 2:
+            entry["sections"] = (None, [], {})
+            return entry["sections"]
+        
+        section_keys = list(members.keys())
+        section_corpus = []
+        for section_key in section_keys:
+            tokens = []
+            for idx in members[section_key]:
+                for term, freq in bm25.doc_freqs[idx].items():
+                    tokens.extend([term] * freq)
+            section_corpus.append(tokens)
+        
+        entry["sections"] = (BM25Okapi(section_corpus), section_keys, members)
+        return entry["sections"]
+
+    async def _fetch_chunks(self, chunk_ids: List[ObjectId]) -> Dict[ObjectId, Dict]:
         db = await get_db()
-        chunks = await db.document_chunks.find({"_id": {"$in": chunk_ids}}).to_list(length=len(chunk_ids))
-        return {c["_id"]: c["text"] for c in chunks}
+        chunks = await db.document_chunks.find(
+            {"_id": {"$in": chunk_ids}},
+            {"text": 1, "chunk_index": 1, "metadata.section_path": 1}
+        ).to_list(length=len(chunk_ids))
+        return {c["_id"]: c for c in chunks}
 
-    async def search_bm25(self, user_id: str, query: str, k: int = 4, document_id: Optional[str] = None) -> List[Dict]:
+    async def _build_results(self, top_chunk_ids: List[ObjectId], top_scores: List[float]) -> List[Dict]:
+        if not top_chunk_ids:
+            return []
+            
+        content_map = await self._fetch_chunks(top_chunk_ids)
+        
+        results = []
+        for i, chunk_id in enumerate(top_chunk_ids):
+            if chunk_id in content_map:
+                chunk = content_map[chunk_id]
+                result = {
+                    "content": chunk["text"],
+                    "score": float(top_scores[i]),
+                    "chunk_id": str(chunk_id),
+                    "chunk_index": chunk.get("chunk_index")
+                }
+                section_path = chunk.get("metadata", {}).get("section_path")
+                if section_path:
+                    result["section_path"] = section_path
+                results.append(result)
+                
+        return results
+
+    async def search_bm25(self, user_id: str, query: Union[str, Dict[str, float]], k: int = 4, document_id: Optional[str] = None) -> List[Dict]:
+        """``query`` is either plain text or term weights from weighted_query."""
         bm25, chunk_ids = await self.load_bm25_index(user_id, document_id)
         
         if not bm25:
             return []
             
-        tokenized_query = query.lower().split()
-        scores = bm25.get_scores(tokenized_query)
+        terms = _select_terms(bm25, weighted_query(query) if isinstance(query, str) else query)
+        scores = _weighted_scores(bm25, terms)
         
         top_indices = np.argsort(scores)[-k:][::-1]
         
@@ -101,20 +206,44 @@ class PersistentVectorStore:
                 top_chunk_ids.append(chunk_ids[idx])
                 top_scores.append(scores[idx])
                 
-        if not top_chunk_ids:
+        return await self._build_results(top_chunk_ids, top_scores)
+
+    async def search_hierarchical(
+        self,
+        user_id: str,
+        query: Union[str, Dict[str, float]],
+        k: int = 4,
+        document_id: Optional[str] = None,
+        top_sections: int = 3
+    ) -> List[Dict]:
+        """Score sections first, then only the chunks inside the best ones.
+        Falls back to flat search for indexes without section information."""
+        section_bm25, section_keys, members = await self.load_section_index(user_id, document_id)
+        if not section_bm25:
+            return await self.search_bm25(user_id, query, k=k, document_id=document_id)
+        
+        bm25, chunk_ids = await self.load_bm25_index(user_id, document_id)
+        weights = weighted_query(query) if isinstance(query, str) else query
+        
+        section_scores = _weighted_scores(section_bm25, _select_terms(section_bm25, weights))
+        best_sections = [
+            idx for idx in np.argsort(section_scores)[-top_sections:][::-1]
+            if section_scores[idx] > 0
+        ]
+        if not best_sections:
             return []
-            
-        content_map = await self._fetch_chunks(top_chunk_ids)
         
-        results = []
-        for i, chunk_id in enumerate(top_chunk_ids):
-            if chunk_id in content_map:
-                results.append({
-                    "content": content_map[chunk_id],
-                    "score": float(top_scores[i])
-                })
-                
-        return results
+        candidates = [idx for s_idx in best_sections for idx in members[section_keys[s_idx]]]
+        scores = _weighted_scores(bm25, _select_terms(bm25, weights), candidates)
+        
+        top_chunk_ids = []
+        top_scores = []
+        for pos in np.argsort(scores)[-k:][::-1]:
+            if scores[pos] > 0:
+                top_chunk_ids.append(chunk_ids[candidates[pos]])
+                top_scores.append(scores[pos])
+        
+        return await self._build_results(top_chunk_ids, top_scores)
 
     async def delete_document_index(self, user_id: str, document_id: str):
         indices_col, _ = await self._get_collection()
@@ -123,6 +252,12 @@ class PersistentVectorStore:
             "document_id": ObjectId(document_id)
         })
         
+        from Services.question_cache import QuestionCacheService
+        await QuestionCacheService.invalidate_document(document_id)
+        
+        from Services.context_cache import ContextCacheService
+        await ContextCacheService.invalidate_document(user_id, document_id)
+        
         cache_key_specific = f"{user_id}_{document_id}"
         if cache_key_specific in self._cache:
             del self._cache[cache_key_specific]
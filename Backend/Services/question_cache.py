@@ -0,0 +1,116 @@
+import re
+from datetime import datetime
+from typing import List, Dict, Optional, Any
+
+from config import Config
+from Database.database import get_db
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "been", "do", "does", "did",
+    "what", "whats", "which", "who", "whom", "how", "why", "when", "where",
+    "explain", "describe", "define", "tell", "me", "us", "about", "please", "can",
+    "could", "would", "you", "your", "i", "we", "it", "its", "this", "that", "these",
+    "those", "of", "in", "on", "for", "to", "and", "or", "with", "by", "as", "at",
+    "from", "into", "mean", "means", "meant", "give", "show", "some", "there",
+}
+
+
+def analyze_question(question: str) -> List[str]:
+    """Normalize a question to a sorted set of content terms, so rephrasings
+    like "what is the event loop" and "explain the event loop" coincide."""
+    terms = set()
+    for word in re.findall(r"\w+", question.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.add(word)
+    return sorted(terms)
+
+
+def term_similarity(a: List[str], b: List[str]) -> float:
+    set_a, set_b = set(a), set(b)
+    if not set_a or not set_b:
+        return 0.0
+    return len(set_a & set_b) / len(set_a | set_b)
+
+
+class QuestionCacheService:
+    _stats = {"hits": 0, "misses": 0, "context_mismatches": 0, "stores": 0}
+
+    @staticmethod
+    def _chunk_key(context_results: List[Dict]) -> List[str]:
+        return sorted(str(r["chunk_id"]) for r in context_results if r.get("chunk_id"))
+
+    @staticmethod
+    async def lookup(document_id: str, question: str, context_results: List[Dict]) -> Optional[str]:
+        """Return a stored answer for a near-identical question over exactly
+        the same retrieved chunks, or None."""
+        if not Config.QUESTION_CACHE_ENABLED:
+            return None
+
+        terms = analyze_question(question)
+        chunk_ids = QuestionCacheService._chunk_key(context_results)
+        if not terms or not chunk_ids:
+            QuestionCacheService._stats["misses"] += 1
+            return None
+
+        db = await get_db()
+        candidates = await db.question_cache.find(
+            {"document_id": document_id, "terms": {"$in": terms}},
+            {"terms": 1, "chunk_ids": 1, "answer": 1}
+        ).limit(Config.QUESTION_CACHE_CANDIDATES).to_list(length=Config.QUESTION_CACHE_CANDIDATES)
+
+        best = None
+        best_score = 0.0
+        for candidate in candidates:
+            score = term_similarity(terms, candidate.get("terms", []))
+            if score >= Config.QUESTION_CACHE_THRESHOLD and score > best_score:
+                if candidate.get("chunk_ids") != chunk_ids:
+                    QuestionCacheService._stats["context_mismatches"] += 1
+                    continue
+                best, best_score = candidate, score
+
+        if not best:
+            QuestionCacheService._stats["misses"] += 1
+            return None
+
+        QuestionCacheService._stats["hits"] += 1
+        await db.question_cache.update_one(
+            {"_id": best["_id"]},
+            {"$inc": {"hits": 1}, "$set": {"last_hit_at": datetime.utcnow()}}
+        )
+        return best["answer"]
+
+    @staticmethod
+    async def store(user_id: str, document_id: str, question: str, context_results: List[Dict], answer: str):
+        if not Config.QUESTION_CACHE_ENABLED:
+            return
+
+        terms = analyze_question(question)
+        chunk_ids = QuestionCacheService._chunk_key(context_results)
+        if not terms or not chunk_ids or not answer:
+            return
+
+        db = await get_db()
+        await db.question_cache.update_one(
+            {"document_id": document_id, "terms": terms, "chunk_ids": chunk_ids},
+            {
+                "$set": {"answer": answer, "question": question, "user_id": user_id},
+                "$setOnInsert": {"hits": 0, "created_at": datetime.utcnow()}
+            },
+            upsert=True
+        )
+        QuestionCacheService._stats["stores"] += 1
+
+    @staticmethod
+    async def invalidate_document(document_id: str):
+        db = await get_db()
+        await db.question_cache.delete_many({"document_id": str(document_id)})
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        stats = dict(QuestionCacheService._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
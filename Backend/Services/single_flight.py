@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from config import Config
+from Database.database import get_db
+
+
+class SingleFlight:
+    """Coalesces concurrent identical generations.
+
+    Within a worker, callers with the same key await one shared task. Across
+    workers, a lease document in ``generation_leases`` elects a single
+    generator; the others poll ``lookup`` (the persisted cache) until the
+    result appears or the lease expires and can be taken over. The holder
+    renews the lease while it generates, so only a dead worker's lease
+    expires.
+    """
+
+    _inflight: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def build_key(*parts: Any) -> str:
+        raw = "|".join("" if p is None else str(p) for p in parts)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    async def run(
+        key: str,
+        generate: Callable[[], Awaitable[Any]],
+        lookup: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Tuple[Any, bool]:
+        """Return ``(result, shared)``; ``shared`` is True when another request
+        did the work."""
+        task = SingleFlight._inflight.get(key)
+        shared = task is not None
+
+        if task is None:
+            # Detached from the calling request so a disconnecting leader
+            # doesn't cancel the generation its followers are waiting on.
+            task = asyncio.ensure_future(SingleFlight._run_with_lease(key, generate, lookup))
+            SingleFlight._inflight[key] = task
+            task.add_done_callback(lambda t: SingleFlight._forget(key, t))
+
+        result, from_other_worker = await asyncio.shield(task)
+        return result, shared or from_other_worker
+
+    @staticmethod
+    def _forget(key: str, task: asyncio.Task):
+        if SingleFlight._inflight.get(key) is task:
+            del SingleFlight._inflight[key]
+        if not task.cancelled():
+            task.exception()
+
+    @staticmethod
+    async def _run_with_lease(
+        key: str,
+        generate: Callable[[], Awaitable[Any]],
+        lookup: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Tuple[Any, bool]:
+        owner = str(uuid.uuid4())
+        deadline = time.monotonic() + Config.SINGLE_FLIGHT_WAIT_TIMEOUT
+
+        while True:
+            if await SingleFlight._acquire_lease(key, owner):
+                heartbeat = asyncio.ensure_future(SingleFlight._heartbeat(key, owner))
+                try:
+                    # The previous holder may have finished between our
+                    # last poll and taking over the lease.
+                    result = await lookup()
+                    if result is not None:
+                        return result, True
+                    return await generate(), False
+                finally:
+                    heartbeat.cancel()
+                    await SingleFlight._release_lease(key, owner)
+
+            result = await lookup()
+            if result is not None:
+                return result, True
+
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=409,
+                    detail="An identical request is still being generated. Please try again shortly."
+                )
+            await asyncio.sleep(Config.SINGLE_FLIGHT_POLL_INTERVAL)
+
+    @staticmethod
+    async def _acquire_lease(key: str, owner: str) -> bool:
+        db = await get_db()
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=Config.SINGLE_FLIGHT_LEASE_TTL)
+
+        try:
+            await db.generation_leases.insert_one({"_id": key, "owner": owner, "expires_at": expires_at})
+            return True
+        except DuplicateKeyError:
+            result = await db.generation_leases.update_one(
+                {"_id": key, "expires_at": {"$lt": now}},
+                {"$set": {"owner": owner, "expires_at": expires_at}}
+            )
+            return result.modified_count == 1
+
+    @staticmethod
+    async def _heartbeat(key: str, owner: str):
+        """Push the lease's expiry forward until cancelled, or until another
+        worker has taken it over."""
+        while True:
+            await asyncio.sleep(Config.SINGLE_FLIGHT_LEASE_TTL / 3)
+            try:
+                db = await get_db()
+                result = await db.generation_leases.update_one(
+                    {"_id": key, "owner": owner},
+                    {"$set": {"expires_at": datetime.utcnow() + timedelta(seconds=Config.SINGLE_FLIGHT_LEASE_TTL)}}
+                )
+                if result.matched_count == 0:
+                    print(f"⚠️ Generation lease {key[:12]} was lost while generating")
+                    return
+            except Exception as e:
+                print(f"⚠️ Generation lease {key[:12]} renewal failed: {e}")
+
+    @staticmethod
+    async def _release_lease(key: str, owner: str):
+        db = await get_db()
+        await db.generation_leases.delete_one({"_id": key, "owner": owner})
@@ -0,0 +1,290 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+T = TypeVar("T", bound=BaseModel)
+
+_decoder = json.JSONDecoder()
+
+
+class StructuredOutputError(ValueError):
+    pass
+
+
+class MCQuestion(BaseModel):
+    question: str = Field(min_length=1)
+    options: List[str] = Field(min_length=4, max_length=4)
+    answer: str
+    explanation: str = ""
+    difficulty: str = "medium"
+    type: str = "concept"
+
+    @field_validator("answer")
+    @classmethod
+    def _answer_letter(cls, v: str) -> str:
+        letter = v.strip()[:1].upper()
+        if letter not in ("A", "B", "C", "D"):
+            raise ValueError("answer must be one of A-D")
+        return letter
+
+    @field_validator("difficulty")
+    @classmethod
+    def _lower(cls, v: str) -> str:
+        return v.strip().lower()
+
+
+class ConceptRelation(BaseModel):
+    source: str = Field(min_length=1)
+    relation: str = "related to"
+    target: str = Field(min_length=1)
+
+
+class ConceptExtraction(BaseModel):
+    concepts: List[str]
+    relationships: List[ConceptRelation] = []
+
+
+class Definition(BaseModel):
+    term: str = Field(min_length=1)
+    definition: str = Field(min_length=1)
+
+
+class Flashcard(BaseModel):
+    question: str = Field(min_length=1)
+    answer: str = Field(min_length=1)
+
+
+class PracticeQuestion(BaseModel):
+    question: str = Field(min_length=1)
+    difficulty: str = "medium"
+    hint: str = ""
+
+
+class StudyNotes(BaseModel):
+    summary: str = Field(min_length=1)
+    key_points: List[str] = Field(min_length=1)
+    definitions: List[Definition] = []
+    flashcards: List[Flashcard] = []
+    practice_questions: List[PracticeQuestion] = []
+
+
+# Gemini response schemas (OpenAPI subset). Kept explicit rather than derived
+# from the models: the API rejects most of what pydantic's JSON schema emits.
+_STRING = {"type": "string"}
+
+MCQ_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "question": _STRING,
+            "options": {"type": "array", "items": _STRING},
+            "answer": {"type": "string", "enum": ["A", "B", "C", "D"]},
+            "explanation": _STRING,
+            "difficulty": {"type": "string", "enum": ["easy", "medium", "hard"]},
+            "type": {"type": "string", "enum": ["concept", "application", "scenario", "comparison"]},
+        },
+        "required": ["question", "options", "answer", "explanation"],
+    },
+}
+
+CONCEPTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "concepts": {"type": "array", "items": _STRING},
+        "relationships": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"source": _STRING, "relation": _STRING, "target": _STRING},
+                "required": ["source", "relation", "target"],
+            },
+        },
+    },
+    "required": ["concepts", "relationships"],
+}
+
+NOTES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": _STRING,
+        "key_points": {"type": "array", "items": _STRING},
+        "definitions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"term": _STRING, "definition": _STRING},
+                "required": ["term", "definition"],
+            },
+        },
+        "flashcards": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"question": _STRING, "answer": _STRING},
+                "required": ["question", "answer"],
+            },
+        },
+        "practice_questions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "question": _STRING,
+                    "difficulty": {"type": "string", "enum": ["easy", "medium", "hard"]},
+                    "hint": _STRING,
+                },
+                "required": ["question", "difficulty", "hint"],
+            },
+        },
+    },
+    "required": ["summary", "key_points", "definitions", "flashcards", "practice_questions"],
+}
+
+
+def json_config(schema: Dict[str, Any], **extra) -> Dict[str, Any]:
+    return {"response_mime_type": "application/json", "response_schema": schema, **extra}
+
+
+def _strip_fences(raw: str) -> str:
+    cleaned = raw.strip()
+    if cleaned.startswith("```"):
+        first_newline = cleaned.find("\n")
+        cleaned = cleaned[first_newline + 1:] if first_newline != -1 else ""
+        if cleaned.rstrip().endswith("```"):
+            cleaned = cleaned.rstrip()[:-3]
+    return cleaned.strip()
+
+
+def salvage_array(text: str, start: int) -> Tuple[List[Any], bool]:
+    """Decode the JSON array opening at ``text[start]`` element by element.
+
+    Returns the elements that decoded and whether the array was closed; a
+    response cut off mid-element keeps everything before the cut."""
+    items = []
+    pos = start + 1
+    length = len(text)
+    while pos < length:
+        while pos < length and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= length:
+            break
+        if text[pos] == "]":
+            return items, True
+        try:
+            item, pos = _decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            break
+        items.append(item)
+    return items, False
+
+
+def _validate_items(items: List[Any], model: Type[T]) -> Tuple[List[T], int]:
+    valid = []
+    rejected = 0
+    for item in items:
+        try:
+            valid.append(model.model_validate(item))
+        except ValidationError:
+            rejected += 1
+    return valid, rejected
+
+
+def parse_list(raw: str, model: Type[T]) -> Tuple[List[T], bool]:
+    """Parse a JSON array of ``model`` items, dropping invalid elements.
+
+    The flag is True only when the whole array parsed and every element
+    validated; callers should cache nothing else."""
+    text = _strip_fences(raw)
+    start = text.find("[")
+    if start == -1:
+        raise StructuredOutputError("No JSON array in model response")
+
+    items, closed = salvage_array(text, start)
+    valid, rejected = _validate_items(items, model)
+    if not valid:
+        raise StructuredOutputError("No valid items in model response")
+    return valid, closed and rejected == 0
+
+
+def parse_object(raw: str, model: Type[T], salvage_fields: Tuple[str, ...] = ()) -> Tuple[T, bool]:
+    """Parse a JSON object into ``model``.
+
+    If the object is truncated or invalid, the fields named in
+    ``salvage_fields`` are recovered individually (arrays element by
+    element) and the model is validated from those; the flag is then False."""
+    text = _strip_fences(raw)
+    start = text.find("{")
+    if start == -1:
+        raise StructuredOutputError("No JSON object in model response")
+
+    try:
+        data, _ = _decoder.raw_decode(text, start)
+        return model.model_validate(data), True
+    except (json.JSONDecodeError, ValidationError) as e:
+        if not salvage_fields:
+            raise StructuredOutputError(f"Malformed model response: {e}") from e
+        error = e
+
+    salvaged: Dict[str, Any] = {}
+    for field in salvage_fields:
+        value_pos = _field_value_pos(text, field, start)
+        if value_pos is None:
+            continue
+        if text[value_pos] != "[":
+            try:
+                salvaged[field] = _decoder.raw_decode(text, value_pos)[0]
+            except json.JSONDecodeError:
+                pass
+            continue
+        items, _ = salvage_array(text, value_pos)
+        item_model = _item_model(model, field)
+        salvaged[field] = (
+            [item.model_dump() for item in _validate_items(items, item_model)[0]]
+            if item_model else [item for item in items if isinstance(item, str)]
+        )
+
+    try:
+        return model.model_validate(salvaged), False
+    except ValidationError:
+        raise StructuredOutputError(f"Malformed model response: {error}") from error
+
+
+def _field_value_pos(text: str, field: str, start: int) -> Optional[int]:
+    key_pos = text.find(f'"{field}"', start)
+    if key_pos == -1:
+        return None
+    colon = text.find(":", key_pos + len(field) + 2)
+    if colon == -1:
+        return None
+    pos = colon + 1
+    while pos < len(text) and text[pos] in " \t\r\n":
+        pos += 1
+    return pos if pos < len(text) else None
+
+
+def _item_model(model: Type[BaseModel], field: str) -> Optional[Type[BaseModel]]:
+    annotation = model.model_fields[field].annotation
+    args = getattr(annotation, "__args__", ())
+    if args and isinstance(args[0], type) and issubclass(args[0], BaseModel):
+        return args[0]
+    return None
+
+
+def is_complete_list(model: Type[BaseModel]):
+    def check(raw: str) -> bool:
+        try:
+            return parse_list(raw, model)[1]
+        except StructuredOutputError:
+            return False
+    return check
+
+
+def is_complete_object(model: Type[BaseModel]):
+    def check(raw: str) -> bool:
+        try:
+            return parse_object(raw, model)[1]
+        except StructuredOutputError:
+            return False
+    return check
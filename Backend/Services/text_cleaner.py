@@ -1,5 +1,6 @@
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, NavigableString, CData, Tag
+from typing import List, Dict
 import re
 
 HEADERS = {
@@ -29,3 +30,125 @@ def extract_text_from_url(url: str) -> str:
     cleaned = cleaned.strip()
 
     return cleaned
+
+
+HEADING_LEVELS = {"h1": 1, "h2": 2, "h3": 3}
+
+BLOCK_TAGS = ["nav", "header", "footer", "aside", "form", "section", "div", "ul", "ol", "table", "p"]
+BOILERPLATE_MARKERS = re.compile(r"cookie|consent|gdpr|newsletter|subscribe|breadcrumb|share|social", re.I)
+WRAP_WIDTH = 80
+
+
+def _is_boilerplate(tag: Tag, link_density_threshold: float, max_words: int) -> bool:
+    """Link density / text density heuristic: menus and footers are mostly
+    link text, or short link-heavy fragments that never wrap past a line."""
+    text = tag.get_text(" ", strip=True)
+    words = len(text.split())
+    if not words or words > max_words:
+        return False
+
+    if tag.find(list(HEADING_LEVELS)) and tag.name not in ("nav", "footer", "aside"):
+        return False
+
+    link_words = sum(len(a.get_text(" ", strip=True).split()) for a in tag.find_all("a"))
+    link_density = link_words / words
+    wrapped_lines = max(1, -(-len(text) // WRAP_WIDTH))
+    text_density = words / wrapped_lines
+
+    if link_density >= link_density_threshold:
+        return True
+    if link_density > link_density_threshold * 0.66 and text_density < 10:
+        return True
+
+    marker = " ".join([tag.get("id") or ""] + list(tag.get("class") or []))
+    if marker and BOILERPLATE_MARKERS.search(marker) and words < max_words // 2:
+        return True
+
+    return False
+
+
+def remove_boilerplate(soup: BeautifulSoup, link_density_threshold: float = 0.5, max_words: int = 250) -> int:
+    removed = 0
+    for tag in soup.find_all(BLOCK_TAGS):
+        if tag.decomposed:
+            continue
+        if _is_boilerplate(tag, link_density_threshold, max_words):
+            tag.decompose()
+            removed += 1
+    return removed
+
+
+def _clean_block(text: str) -> str:
+    lines = (line.strip() for line in text.splitlines())
+    phrases = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return "\n".join(phrase for phrase in phrases if phrase)
+
+
+def extract_sections(
+    html: str,
+    min_words: int = 40,
+    link_density_threshold: float = 0.5,
+    boilerplate_max_words: int = 250
+) -> List[Dict]:
+    """Split a page into an h1/h2/h3 section tree, in document order.
+
+    Navigation, footers and similar link-heavy blocks are dropped first.
+    Each section carries its heading path and cleaned text (heading included).
+    Sections shorter than ``min_words`` are folded into the preceding one so a
+    run of tiny headings doesn't turn into a run of tiny chunks.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+
+    for script in soup(["script", "style", "noscript"]):
+        script.decompose()
+
+    remove_boilerplate(soup, link_density_threshold, boilerplate_max_words)
+
+    raw_sections = [{"level": 0, "heading": "", "path": [], "parts": []}]
+    stack = []
+
+    for element in soup.descendants:
+        if isinstance(element, Tag) and element.name in HEADING_LEVELS:
+            heading = element.get_text(" ", strip=True)
+            if not heading:
+                continue
+            level = HEADING_LEVELS[element.name]
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, heading))
+            raw_sections.append({
+                "level": level,
+                "heading": heading,
+                "path": [h for _, h in stack],
+                "parts": [heading + "\n"]
+            })
+        elif type(element) in (NavigableString, CData):
+            if element.find_parent(list(HEADING_LEVELS)):
+                continue
+            raw_sections[-1]["parts"].append(str(element))
+
+    sections = []
+    for raw in raw_sections:
+        text = _clean_block("".join(raw["parts"]))
+        if not text:
+            continue
+        if sections and len(text.split()) < min_words:
+            sections[-1]["text"] += "\n" + text
+            continue
+        sections.append({
+            "id": len(sections),
+            "level": raw["level"],
+            "heading": raw["heading"],
+            "path": raw["path"],
+            "text": text
+        })
+
+    for section in sections:
+        parent = None
+        for candidate in reversed(sections[:section["id"]]):
+            if candidate["level"] < section["level"]:
+                parent = candidate["id"]
+                break
+        section["parent"] = parent
+
+    return sections
@@ -0,0 +1,95 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from config import Config
+from Database.database import get_db
+
+
+class UserStatsService:
+    """One ``user_stats`` document per user holding everything the dashboard
+    shows: the credit balance and usage counters (kept by CreditService),
+    running quiz totals and a ring of the most recent activities. Writers
+    update it incrementally so /auth/me is a single point read."""
+
+    @staticmethod
+    async def get(uid: str) -> Optional[Dict]:
+        db = await get_db()
+        return await db.user_stats.find_one({"_id": uid})
+
+    @staticmethod
+    async def ensure(uid: str):
+        """Create the stats document if it's missing, seeding it from the
+        user's existing credits, quiz results and activity history."""
+        db = await get_db()
+        if await db.user_stats.find_one({"_id": uid}, {"_id": 1}):
+            return
+
+        from Services.credit_service import CreditService
+        from Services.activity_service import ActivityService
+
+        user = await db.users.find_one({"_id": uid}) or {}
+        totals = await db.quiz_results.aggregate([
+            {"$match": {"user_id": uid}},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "sum": {"$sum": "$percentage"}}}
+        ]).to_list(length=1)
+        recent = await ActivityService.get_recent_activity(uid, limit=Config.USER_STATS_RECENT_ACTIVITY)
+
+        now = datetime.utcnow()
+        stats = {
+            "_id": uid,
+            "credits": user.get("credits", CreditService.DEFAULT_CREDITS),
+            "plan": user.get("plan", "free"),
+            "total_usage": user.get("total_usage", {action: 0 for action in CreditService.COSTS}),
+            "last_reset_date": user.get("last_reset_date", user.get("created_at", now)),
+            "quiz_count": totals[0]["count"] if totals else 0,
+            "quiz_percentage_sum": totals[0]["sum"] if totals else 0,
+            "recent_activity": [
+                {key: a.get(key) for key in ("id", "action_type", "title", "details", "created_at")}
+                for a in recent
+            ],
+            "created_at": now
+        }
+
+        try:
+            await db.user_stats.insert_one(stats)
+        except DuplicateKeyError:
+            return
+
+        # The balance now lives here; drop the copy on the user document.
+        await db.users.update_one(
+            {"_id": uid},
+            {"$unset": {"credits": "", "total_usage": "", "last_reset_date": "", "pending_transactions": ""}}
+        )
+
+    @staticmethod
+    async def record_quiz(uid: str, percentage: float):
+        db = await get_db()
+        await db.user_stats.update_one(
+            {"_id": uid},
+            {"$inc": {"quiz_count": 1, "quiz_percentage_sum": percentage}}
+        )
+
+    @staticmethod
+    async def push_activities(activities: List[Tuple[str, Dict]]):
+        """Push (uid, activity) pairs onto each user's ring, kept newest
+        first. Safe to repeat: an activity already in the ring is skipped, and
+        a retried older one sorts into place rather than onto the front."""
+        if not activities:
+            return
+        db = await get_db()
+        await db.user_stats.bulk_write([
+            UpdateOne({"_id": uid, "recent_activity.id": {"$ne": activity["id"]}}, {"$push": {"recent_activity": {
+                "$each": [activity],
+                "$sort": {"created_at": -1},
+                "$slice": Config.USER_STATS_RECENT_ACTIVITY
+            }}})
+            for uid, activity in activities
+        ])
+
+    @staticmethod
+    def quiz_average(stats: Dict) -> int:
+        count = stats.get("quiz_count", 0)
+        return round(stats.get("quiz_percentage_sum", 0) / count) if count else 0
@@ -1,3 +1,4 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
@@ -17,12 +18,16 @@ app.add_exception_handler(LLMAPIError, llm_api_error_handler)
 app.add_exception_handler(Exception, general_exception_handler)
 
 
+from Middleware.rate_limit import rate_limit_headers
+app.middleware("http")(rate_limit_headers)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=Config.CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "Retry-After"],
 )
 
 from Routes import extract, quiz, chat, warmup
@@ -39,6 +44,25 @@ app.include_router(quiz.router, tags=["quiz"], dependencies=[Depends(get_current
 app.include_router(notes.router, tags=["notes"], dependencies=[Depends(get_current_user)])
 app.include_router(auth.router, tags=["auth"], prefix="/auth", dependencies=[Depends(get_current_user)])
 
+_background_tasks = []
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    from Services.credit_service import CreditService
+    from Services.activity_service import ActivityService
+    _background_tasks.append(asyncio.create_task(CreditService.run_sweeper()))
+    _background_tasks.append(asyncio.create_task(ActivityService.run_flusher()))
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    from Services.activity_service import ActivityService
+    for task in _background_tasks:
+        task.cancel()
+    await ActivityService.flush()
+
+
 @app.get("/")
 def read_root():
     return {"status": "ok", "message": "Luma backend running with RAG and ML support"}
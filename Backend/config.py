@@ -9,27 +9,114 @@ class Config:
     MONGODB_URL = os.getenv("MONGODB_URL")
     FIREBASE_KEY_PATH = os.getenv("FIREBASE_KEY_PATH", "serviceAccountKey.json")
     FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID", "luma-362fc")
+    AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "2048"))
+    AUTH_USER_INIT_TTL = int(os.getenv("AUTH_USER_INIT_TTL", "3600"))
     
     GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+    GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-2.5-flash-lite")
+    # Comma-separated task=tier (or task=model) overrides, e.g. "notes=fast".
+    LLM_TASK_TIERS = os.getenv("LLM_TASK_TIERS", "")
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60.0"))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+    LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8.0"))
+    LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "True").lower() == "true"
+    LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+    LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+    LLM_BREAKER_WINDOW = float(os.getenv("LLM_BREAKER_WINDOW", "60"))
+    LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+    LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+    LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+    
+    LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "True").lower() == "true"
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+    LLM_CACHE_MEMORY_TTL = int(os.getenv("LLM_CACHE_MEMORY_TTL", "3600"))
+    LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "604800"))
+    
+    QUESTION_CACHE_ENABLED = os.getenv("QUESTION_CACHE_ENABLED", "True").lower() == "true"
+    QUESTION_CACHE_THRESHOLD = float(os.getenv("QUESTION_CACHE_THRESHOLD", "0.8"))
+    QUESTION_CACHE_CANDIDATES = int(os.getenv("QUESTION_CACHE_CANDIDATES", "50"))
+    QUESTION_CACHE_TTL = int(os.getenv("QUESTION_CACHE_TTL", "2592000"))
+    
+    USER_STATS_RECENT_ACTIVITY = int(os.getenv("USER_STATS_RECENT_ACTIVITY", "5"))
+    
+    ACTIVITY_FLUSH_SIZE = int(os.getenv("ACTIVITY_FLUSH_SIZE", "100"))
+    ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "2.0"))
+    ACTIVITY_BUFFER_MAX = int(os.getenv("ACTIVITY_BUFFER_MAX", "5000"))
+    ACTIVITY_RETENTION_DAYS = int(os.getenv("ACTIVITY_RETENTION_DAYS", "90"))
+    
+    CREDIT_RESERVATION_TTL = int(os.getenv("CREDIT_RESERVATION_TTL", "1800"))
+    CREDIT_SWEEP_INTERVAL = int(os.getenv("CREDIT_SWEEP_INTERVAL", "300"))
+    CREDIT_SWEEP_BATCH = int(os.getenv("CREDIT_SWEEP_BATCH", "500"))
+    CREDIT_LEDGER_RETENTION_DAYS = int(os.getenv("CREDIT_LEDGER_RETENTION_DAYS", "90"))
+    
+    # Renewed every third of its length while the holder generates.
+    SINGLE_FLIGHT_LEASE_TTL = int(os.getenv("SINGLE_FLIGHT_LEASE_TTL", "30"))
+    SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "0.5"))
+    SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "150"))
+    
+    # "gemini" (server-side CachedContent), "local" (inline stub) or "off".
+    # Handles cover a turn's retrieved chunk set, capped like the inline QA
+    # context; Gemini rejects caches below its own minimum size, so raise
+    # CONTEXT_CACHE_MIN_TOKENS to match before enabling that backend.
+    CONTEXT_CACHE_BACKEND = os.getenv("CONTEXT_CACHE_BACKEND", "off").lower()
+    CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "900"))
+    CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "256"))
+    CONTEXT_CACHE_MAX_TOKENS = int(os.getenv("CONTEXT_CACHE_MAX_TOKENS", os.getenv("CONTEXT_BUDGET_QA", "750")))
+    CONTEXT_CACHE_EXPIRY_MARGIN = int(os.getenv("CONTEXT_CACHE_EXPIRY_MARGIN", "60"))
+    CONTEXT_CACHE_RETRY_AFTER = int(os.getenv("CONTEXT_CACHE_RETRY_AFTER", "600"))
     
     DEFAULT_CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "512"))
     DEFAULT_CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
     
     MAX_TEXT_LENGTH_CONCEPTS = int(os.getenv("MAX_TEXT_LENGTH_CONCEPTS", "50000"))
-    MAX_TEXT_LENGTH_QUIZ = int(os.getenv("MAX_TEXT_LENGTH_QUIZ", "2500"))
-    MAX_TEXT_LENGTH_QA = int(os.getenv("MAX_TEXT_LENGTH_QA", "3000"))
+    
+    CONTEXT_BUDGET_QA = int(os.getenv("CONTEXT_BUDGET_QA", "750"))
+    CONTEXT_BUDGET_QUIZ = int(os.getenv("CONTEXT_BUDGET_QUIZ", "625"))
+    CONTEXT_BUDGET_NOTES = int(os.getenv("CONTEXT_BUDGET_NOTES", "750"))
+    CONTEXT_BUDGET_SUMMARY = int(os.getenv("CONTEXT_BUDGET_SUMMARY", "500"))
+    
+    CONCEPTS_PER_DOCUMENT = int(os.getenv("CONCEPTS_PER_DOCUMENT", "10"))
+    CONCEPT_MAP_REDUCE_THRESHOLD = int(os.getenv("CONCEPT_MAP_REDUCE_THRESHOLD", "12000"))
+    CONCEPT_SECTION_CHARS = int(os.getenv("CONCEPT_SECTION_CHARS", "8000"))
+    CONCEPT_MAP_CONCURRENCY = int(os.getenv("CONCEPT_MAP_CONCURRENCY", "4"))
     
     MIN_QUIZ_QUESTIONS = int(os.getenv("MIN_QUIZ_QUESTIONS", "5"))
     MAX_QUIZ_QUESTIONS = int(os.getenv("MAX_QUIZ_QUESTIONS", "20"))
     DEFAULT_QUIZ_QUESTIONS = int(os.getenv("DEFAULT_QUIZ_QUESTIONS", "10"))
+    QUIZ_SHARD_SIZE = int(os.getenv("QUIZ_SHARD_SIZE", "5"))
+    QUIZ_SHARD_CONCURRENCY = int(os.getenv("QUIZ_SHARD_CONCURRENCY", "4"))
+    QUIZ_DUPLICATE_THRESHOLD = float(os.getenv("QUIZ_DUPLICATE_THRESHOLD", "0.8"))
+    
+    CHAT_HISTORY_PAGE_MAX = int(os.getenv("CHAT_HISTORY_PAGE_MAX", "200"))
+    CHAT_RECENT_TURNS = int(os.getenv("CHAT_RECENT_TURNS", "2"))
+    CHAT_SUMMARY_EVERY_TURNS = int(os.getenv("CHAT_SUMMARY_EVERY_TURNS", "3"))
+    CHAT_SUMMARY_BATCH_MAX = int(os.getenv("CHAT_SUMMARY_BATCH_MAX", "200"))
+    CHAT_SUMMARY_MAX_WORDS = int(os.getenv("CHAT_SUMMARY_MAX_WORDS", "150"))
+    CHAT_SUMMARY_MESSAGE_CHARS = int(os.getenv("CHAT_SUMMARY_MESSAGE_CHARS", "2000"))
+    CHAT_QUERY_EXPANSION_TERMS = int(os.getenv("CHAT_QUERY_EXPANSION_TERMS", "6"))
     
     DEFAULT_RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
     BM25_TOP_K = int(os.getenv("BM25_TOP_K", "10"))
+    BM25_MAX_QUERY_TERMS = int(os.getenv("BM25_MAX_QUERY_TERMS", "12"))
+    BM25_CONTEXT_TERM_WEIGHT = float(os.getenv("BM25_CONTEXT_TERM_WEIGHT", "0.3"))
+    HIERARCHICAL_RETRIEVAL = os.getenv("HIERARCHICAL_RETRIEVAL", "True").lower() == "true"
+    HIERARCHICAL_TOP_SECTIONS = int(os.getenv("HIERARCHICAL_TOP_SECTIONS", "3"))
+    MIN_SECTION_WORDS = int(os.getenv("MIN_SECTION_WORDS", "40"))
+    
+    BOILERPLATE_LINK_DENSITY = float(os.getenv("BOILERPLATE_LINK_DENSITY", "0.5"))
+    BOILERPLATE_MAX_WORDS = int(os.getenv("BOILERPLATE_MAX_WORDS", "250"))
+    NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "3"))
+    LIBRARY_DEDUP_MAX_WORDS = int(os.getenv("LIBRARY_DEDUP_MAX_WORDS", "120"))
     
-    RATE_LIMIT_CHAT = os.getenv("RATE_LIMIT_CHAT", "20/minute")
-    RATE_LIMIT_EXTRACT = os.getenv("RATE_LIMIT_EXTRACT", "10/minute")
-    RATE_LIMIT_QUIZ = os.getenv("RATE_LIMIT_QUIZ", "15/minute")
-    RATE_LIMIT_NOTES = os.getenv("RATE_LIMIT_NOTES", "15/minute")
+    # "mongo" shares limits across workers; "memory" is per process.
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "mongo").lower()
+    RATE_LIMIT_CHAT = os.getenv("RATE_LIMIT_CHAT", "50/hour")
+    RATE_LIMIT_EXTRACT = os.getenv("RATE_LIMIT_EXTRACT", "20/hour")
+    RATE_LIMIT_QUIZ = os.getenv("RATE_LIMIT_QUIZ", "10/hour")
+    RATE_LIMIT_NOTES = os.getenv("RATE_LIMIT_NOTES", "15/hour")
     
     HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30.0"))
     USER_AGENT = os.getenv(